@@ -0,0 +1,644 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the WebSphere and Installation Manager command line tools used
+by the modules in library/. The benchmark harness installs one wrapper per
+tool (imcl, manageprofiles.sh, wsadmin.sh, ...) which runs this script with
+the tool name as first argument.
+
+The fakes keep just enough state under FAKE_WAS_ROOT for the modules to see
+the effect of a previous run, so converged runs can be measured. Their cost
+is configured through environment variables, FAKE_<TOOL>_<SETTING> overrides
+FAKE_WAS_<SETTING> for a single tool (TOOL is the upper case tool name with
+every other character replaced by _, for example FAKE_MANAGEPROFILES_SH_RC):
+
+  LATENCY       seconds to sleep before doing anything (default 0.5)
+  OUTPUT_LINES  number of filler lines printed to stdout (default 20)
+  RC            exit code (default 0)
+
+Every call is appended as a JSON line to FAKE_WAS_CALL_LOG if it is set.
+
+wsadmin.sh -f wsadmin_worker.py serves the persistent worker protocol of
+module_utils/websphere_wsadmin.py. Requests cost WSADMIN_SH_REQUEST_LATENCY
+seconds (default 0.05) instead of the full LATENCY, they are logged as calls
+of the tool wsadmin-worker.
+"""
+from __future__ import print_function
+
+import os
+import re
+import ast
+import sys
+import json
+import shutil
+import time
+import signal
+import socket
+import xml.etree.ElementTree as ElementTree
+
+
+ROOT = os.environ.get("FAKE_WAS_ROOT", "/tmp/fake_was")
+DEFAULT_VERSION = "8.5.5009.20160225_0435"
+
+
+def setting(tool, name, default):
+    key = re.sub(r"[^A-Z0-9]", "_", tool.upper())
+    return os.environ.get("FAKE_{0}_{1}".format(key, name), os.environ.get("FAKE_WAS_{0}".format(name), default))
+
+
+def option(args, name, default=None):
+    if name in args and args.index(name) + 1 < len(args):
+        return args[args.index(name) + 1]
+    return default
+
+
+def load_state(name, default):
+    try:
+        with open(os.path.join(ROOT, "state", name + ".json")) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def save_state(name, value):
+    state_dir = os.path.join(ROOT, "state")
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    with open(os.path.join(state_dir, name + ".json"), "w") as f:
+        json.dump(value, f)
+
+
+def installed_xml_path():
+    return os.path.join(ROOT, "appdata", "installed.xml")
+
+
+def read_installed():
+    packages = []
+    if os.path.exists(installed_xml_path()):
+        for location in ElementTree.parse(installed_xml_path()).getroot().iter("location"):
+            for package in location.iter("package"):
+                packages.append(dict(id=package.get("id"), version=package.get("version"), location=location.get("path")))
+    return packages
+
+
+def write_installed(packages):
+    root = ElementTree.Element("installInfo")
+    locations = {}
+    for package in packages:
+        if package["location"] not in locations:
+            locations[package["location"]] = ElementTree.SubElement(
+                root, "location", id=package["location"], path=package["location"]
+            )
+        ElementTree.SubElement(locations[package["location"]], "package", id=package["id"], version=package["version"])
+    if not os.path.isdir(os.path.dirname(installed_xml_path())):
+        os.makedirs(os.path.dirname(installed_xml_path()))
+    ElementTree.ElementTree(root).write(installed_xml_path())
+
+
+def populate(path, files=20, keep=False):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for i in range(files):
+        if keep and os.path.exists(os.path.join(path, "file{0}.jar".format(i))):
+            # Installation Manager reuses the artifacts it finds in im_shared
+            continue
+        with open(os.path.join(path, "file{0}.jar".format(i)), "w") as f:
+            f.write("x" * 1024)
+
+
+def repository_versions(repo):
+    versions = {}
+    offerings_dir = os.path.join(repo, "Offerings")
+    if os.path.isdir(offerings_dir):
+        for name in os.listdir(offerings_dir):
+            offering_id, sep, version = name[:-len(".jar")].partition("_")
+            versions.setdefault(offering_id, []).append(version)
+    return versions
+
+
+def imcl(args):
+    command = args[0] if args else ""
+    if command == "listInstalledPackages":
+        for package in read_installed():
+            if "-long" in args:
+                print("{0} : {1}_{2} : {1} : {2}".format(package["location"], package["id"], package["version"]))
+            else:
+                print("{0}_{1}".format(package["id"], package["version"]))
+    elif command == "listAvailablePackages":
+        for offering_id, versions in sorted(repository_versions(option(args, "-repositories", "")).items()):
+            for version in versions:
+                print("{0}_{1}".format(offering_id, version))
+    elif command == "install":
+        dest = option(args, "-installationDirectory")
+        packages = read_installed()
+        for offering in args[1:]:
+            if offering.startswith("-"):
+                break
+            offering_id, sep, version = offering.split(",")[0].partition("_")
+            packages = [p for p in packages if not (p["id"] == offering_id and p["location"] == dest)]
+            packages.append(dict(id=offering_id, version=version or DEFAULT_VERSION, location=dest))
+        write_installed(packages)
+        populate(os.path.join(dest, "lib"))
+        shared = option(args, "-sharedResourcesDirectory")
+        if shared:
+            populate(os.path.join(shared, "native"), 5, keep=True)
+        if "-showProgress" in args:
+            sys.stdout.write("    25%    50%    75%   100%\n")
+    elif command == "uninstall":
+        dest = option(args, "-installationDirectory")
+        offerings = [o for o in args[1:] if not o.startswith("-") and o != dest]
+        write_installed([p for p in read_installed() if not (p["location"] == dest and p["id"] in offerings)])
+
+
+def im_installer(args):
+    dest = option(args, "-installationDirectory", os.path.join(ROOT, "im"))
+    packages = [p for p in read_installed() if p["id"] != "com.ibm.cic.agent"]
+    packages.append(dict(id="com.ibm.cic.agent", version="1.8.5000.20160506_1125", location=os.path.join(dest, "eclipse")))
+    write_installed(packages)
+
+
+SERVERINDEX_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<serverindex:ServerIndex xmlns:serverindex="http://www.ibm.com/websphere/appserver/schemas/5.0/serverindex.xmi" hostName="{host}">
+  <serverEntries serverName="{server}" serverType="{type}">
+    <specialEndpoints endPointName="SOAP_CONNECTOR_ADDRESS">
+      <endPoint host="{host}" port="{soap_port}"/>
+    </specialEndpoints>
+  </serverEntries>
+</serverindex:ServerIndex>
+"""
+
+SERVER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<process:Server xmlns:process="http://www.ibm.com/websphere/appserver/schemas/5.0/process.xmi" name="{server}">
+  <processDefinitions>
+    <jvmEntries initialHeapSize="256" maximumHeapSize="1024"/>
+  </processDefinitions>
+</process:Server>
+"""
+
+
+def write_config(path, cell, node, host, template):
+    """
+    Writes the configuration repository files a new profile has
+    """
+    server, server_type, soap_port = dict(
+        management=("dmgr", "DEPLOYMENT_MANAGER", 8879),
+        managed=("nodeagent", "NODE_AGENT", 8878)
+    ).get(os.path.basename(template or ""), ("server1", "APPLICATION_SERVER", 8880))
+    cell_dir = os.path.join(path, "config", "cells", cell)
+    server_dir = os.path.join(cell_dir, "nodes", node, "servers", server)
+    os.makedirs(server_dir)
+    with open(os.path.join(cell_dir, "cell.xml"), "w") as f:
+        f.write('<topology.cell:Cell xmlns:topology.cell="http://www.ibm.com/websphere/appserver/schemas/5.0/'
+                'topology.cell.xmi" name="{0}" cellType="DISTRIBUTED"/>\n'.format(cell))
+    with open(os.path.join(cell_dir, "nodes", node, "serverindex.xml"), "w") as f:
+        f.write(SERVERINDEX_XML.format(host=host, server=server, type=server_type, soap_port=soap_port))
+    with open(os.path.join(server_dir, "server.xml"), "w") as f:
+        f.write(SERVER_XML.format(server=server))
+
+
+def write_registry(wasdir, profiles):
+    """
+    Writes properties/profileRegistry.xml with the profiles in <wasdir>/profiles
+    """
+    root = ElementTree.Element("profiles")
+    for name, profile in sorted(profiles.items()):
+        if os.path.dirname(os.path.dirname(profile["path"])) == wasdir:
+            ElementTree.SubElement(root, "profile", isAReservationTicket="false",
+                                   isDefault="true" if len(root) == 0 else "false",
+                                   name=name, path=profile["path"], template=profile["template"] or "")
+    if not os.path.isdir(os.path.join(wasdir, "properties")):
+        os.makedirs(os.path.join(wasdir, "properties"))
+    ElementTree.ElementTree(root).write(os.path.join(wasdir, "properties", "profileRegistry.xml"))
+
+
+def manageprofiles(args):
+    profiles = load_state("profiles", {})
+    if "-listProfiles" in args:
+        print("[{0}]".format(", ".join(sorted(profiles))))
+    elif "-create" in args:
+        name = option(args, "-profileName")
+        path = option(args, "-profilePath")
+        for subdir in ("config", "logs", "bin"):
+            if not os.path.isdir(os.path.join(path, subdir)):
+                os.makedirs(os.path.join(path, subdir))
+        write_config(path, option(args, "-cellName", "was_cell"), option(args, "-nodeName"),
+                     option(args, "-hostName", "localhost"), option(args, "-templatePath"))
+        profiles[name] = dict(path=path, template=option(args, "-templatePath"), node=option(args, "-nodeName"))
+        save_state("profiles", profiles)
+        write_registry(os.path.dirname(os.path.dirname(path)), profiles)
+        print("INSTCONFSUCCESS: Success: Profile {0} now exists.".format(name))
+    elif "-delete" in args:
+        removed = profiles.pop(option(args, "-profileName"), None)
+        save_state("profiles", profiles)
+        if removed:
+            write_registry(os.path.dirname(os.path.dirname(removed["path"])), profiles)
+        print("INSTCONFSUCCESS: Success: The profile no longer exists.")
+
+
+def log_call(tool, args, started, rc):
+    call_log = os.environ.get("FAKE_WAS_CALL_LOG")
+    if call_log:
+        with open(call_log, "a") as f:
+            f.write(json.dumps(dict(tool=tool, args=args, start=started, end=time.time(), rc=rc)) + "\n")
+
+
+def run_script(path):
+    """
+    Pretends to run a script, printing the records of the ansible_result
+    calls with literal arguments the way the profile from
+    module_utils/websphere_wsadmin.py does
+    """
+    output = "Executed {0}\n".format(path)
+    try:
+        with open(path) as f:
+            script = f.read()
+    except (IOError, OSError):
+        return output
+    for match in re.finditer(r"^ansible_result\((.*)\)\s*$", script, re.M):
+        output += "@@ansible-result@@ {0}\n".format(json.dumps(ast.literal_eval(match.group(1))))
+    return output
+
+
+def run_steps(code):
+    """
+    Pretends to run the steps of the driver from module_utils/websphere_wsadmin.py
+    """
+    output = ""
+    steps = ast.literal_eval(code.split("\n", 1)[0][len("STEPS = "):])
+    for index, (kind, value, args) in enumerate(steps):
+        failed = "fail" in value
+        output += "@@ansible-step-begin@@ {0}\n".format(index)
+        if kind == "script" and not failed:
+            output += run_script(value)
+        else:
+            output += "{0} {1}\n".format("Failed" if failed else "Executed", value)
+        output += "\n@@ansible-step-end@@ {0!r}\n".format(dict(rc=int(failed), elapsed=0.001))
+        if failed and "STOP_ON_FAILURE = 1" in code:
+            break
+    return output
+
+
+def apply_config(code):
+    """
+    Pretends to run the config driver from module_utils/websphere_wsadmin.py
+    against a configuration kept in the state directory
+    """
+    header = dict(line.split(" = ", 1) for line in code.split("\n")[:4])
+    config = load_state("config", {})
+    result = dict(changes=[], errors=[], saved=0, synced=0)
+    for entry in ast.literal_eval(header["DESIRED"]):
+        current = config.setdefault(entry["label"], {})
+        desired = entry["attributes"] + [["{0}.{1}".format(entry["properties_attribute"], name), value]
+                                         for name, value in entry["properties"]]
+        for name, value in desired:
+            if current.get(name) != value:
+                result["changes"].append(dict(object=entry["label"], attribute=name, old=current.get(name), new=value))
+                current[name] = value
+    if result["changes"] and header["CHECK_MODE"] == "0":
+        save_state("config", config)
+        if header["SAVE"] == "0":
+            save_state("workspace", dict(dirty=True))
+        else:
+            result.update(saved=1, synced=int(header["SYNC"]))
+            if header["SYNC"] == "0":
+                save_state("workspace", dict(load_state("workspace", {}), unsynced=True))
+    return "@@ansible-config@@ {0!r}\n".format(result)
+
+
+def flush(code):
+    """
+    Pretends to run the flush driver from module_utils/websphere_wsadmin.py
+    """
+    workspace = load_state("workspace", {})
+    nodes = load_state("nodes", [])
+    result = dict(saved=int(bool(workspace.get("dirty"))), synced=[], in_sync=nodes, errors=[])
+    if code.startswith("SYNC = 1") and (workspace.get("dirty") or workspace.get("unsynced")):
+        result.update(synced=nodes, in_sync=[])
+    save_state("workspace", {})
+    return "@@ansible-flush@@ {0!r}\n".format(result)
+
+
+def rolling_restart(code):
+    """
+    Pretends to run the cluster restart driver from
+    module_utils/websphere_wsadmin.py. The members are FAKE_CLUSTER_MEMBERS,
+    node/server pairs separated by commas, a batch takes
+    WSADMIN_SH_MEMBER_LATENCY seconds (default 0.2) and the members in
+    FAKE_CLUSTER_FAIL_MEMBERS fail to launch.
+    """
+    restart = ast.literal_eval(code.split("\n", 1)[0][len("RESTART = "):])
+    members = [dict(zip(("node", "server"), member.split("/")), status="skipped", error=None, applications=["app"])
+               for member in os.environ.get("FAKE_CLUSTER_MEMBERS", "node1/member1,node1/member2,"
+                                            "node2/member3,node2/member4").split(",")]
+    failing = os.environ.get("FAKE_CLUSTER_FAIL_MEMBERS", "").split(",")
+    latency = float(setting("wsadmin.sh", "MEMBER_LATENCY", "0.2"))
+    summary = dict(cluster=restart["cluster"], batches=0, aborted=0, failures=0, error=None)
+    if restart["cluster"] == "missing":
+        summary["error"] = "cluster missing does not exist"
+        members = []
+
+    def count_of(amount):
+        return -(-len(members) * amount[0] // 100) if amount[1] else amount[0]
+
+    size = max(1, count_of(restart["batch_size"]))
+    for index in range(0, len(members), size):
+        summary["batches"] += 1
+        batch = members[index:index + size]
+        for member in batch:
+            member["batch"] = summary["batches"]
+            if restart["dry_run"]:
+                member["status"] = "planned"
+            elif not summary["aborted"]:
+                member.update(status="ok", stop_seconds=round(latency / 4, 3), start_seconds=round(latency / 2, 3),
+                              ready_seconds=round(latency * 3 / 4, 3), elapsed=latency)
+                if member["server"] in failing:
+                    member.update(status="failed", error="launchProcess: ADMN0022E", ready_seconds=None)
+                    summary["failures"] += 1
+        if not restart["dry_run"] and not summary["aborted"]:
+            time.sleep(latency)
+            summary["aborted"] = int(summary["failures"] > count_of(restart["failure_threshold"]))
+        for member in batch:
+            print("@@ansible-restart@@ {0!r}".format(member))
+        sys.stdout.flush()
+    print("@@ansible-restart-done@@ {0!r}".format(summary))
+
+
+def list_nodes(code):
+    """
+    Pretends to print the node of the deployment manager and AdminTask.listNodes()
+    """
+    output = "@@ansible-dmgr-node@@ dmgrNode\n" if "getNode" in code else ""
+    return output + "\n".join(["dmgrNode"] + load_state("nodes", [])) + "\n"
+
+
+def wsadmin_worker(state_file, idle_timeout):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(50)
+    server.settimeout(idle_timeout)
+    token = "fake{0}".format(os.getpid())
+    with open(state_file, "w") as f:
+        f.write("{0} {1}\n".format(server.getsockname()[1], token))
+    running = True
+    while running:
+        try:
+            connection = server.accept()[0]
+        except socket.timeout:
+            if load_state("workspace", {}).get("dirty"):
+                continue
+            break
+        started = time.time()
+        connection.settimeout(None)
+        request = b""
+        chunk = connection.recv(65536)
+        while chunk:
+            request += chunk
+            chunk = connection.recv(65536)
+        request_token, sep, code = request.decode("utf-8").partition("\n")
+        if request_token == token:
+            time.sleep(float(setting("wsadmin.sh", "REQUEST_LATENCY", "0.05")))
+            if code.strip() == "#shutdown":
+                running = False
+                output = ""
+            elif code.startswith("STEPS = "):
+                output = run_steps(code)
+            elif code.startswith("DESIRED = "):
+                output = apply_config(code)
+            elif "@@ansible-flush@@" in code:
+                output = flush(code)
+            elif "listNodes" in code:
+                output = list_nodes(code)
+            elif "execfile(" in code:
+                output = run_script(ast.literal_eval(re.search(r"execfile\((.*)\)", code).group(1)))
+            else:
+                output = "Executed {0}\n".format(code.strip().splitlines()[-1])
+            connection.sendall("0\n{0}".format(output).encode("utf-8"))
+            log_call("wsadmin-worker", [code], started, 0)
+        connection.close()
+    server.close()
+    os.remove(state_file)
+
+
+def wsadmin(args):
+    print('WASX7209I: Connected to process "dmgr" on node dmgrNode using SOAP connector;  '
+          'The type of process is: DeploymentManager')
+    command = option(args, "-c")
+    if command and "listNodes" in command:
+        sys.stdout.write(list_nodes(command))
+    elif option(args, "-f"):
+        with open(option(args, "-f")) as f:
+            code = f.read()
+        if code.startswith("STEPS = "):
+            sys.stdout.write(run_steps(code))
+            return None
+        if code.startswith("DESIRED = "):
+            sys.stdout.write(apply_config(code))
+            return None
+        if "@@ansible-flush@@" in code:
+            sys.stdout.write(flush(code))
+            return None
+        if code.startswith("RESTART = "):
+            rolling_restart(code)
+            return None
+        sys.stdout.write(run_script(option(args, "-f")))
+        if os.path.basename(option(args, "-f")) == "wsadmin_worker.py":
+            return lambda: wsadmin_worker(args[-2], int(args[-1]))
+
+
+def dmgr_node_dirs(profiles, node):
+    """
+    Returns the directories of a node in the cells of the deployment manager profiles
+    """
+    dirs = []
+    for profile in profiles.values():
+        if os.path.basename(profile.get("template") or "") == "management":
+            cells_dir = os.path.join(profile["path"], "config", "cells")
+            for cell in os.listdir(cells_dir) if os.path.isdir(cells_dir) else []:
+                dirs.append(os.path.join(cells_dir, cell, "nodes", node))
+    return dirs
+
+
+def add_node(args):
+    profiles = load_state("profiles", {})
+    nodes = load_state("nodes", [])
+    node = profiles.get(option(args, "-profileName"), {}).get("node")
+    if node and node not in nodes:
+        nodes.append(node)
+        save_state("nodes", nodes)
+    for node_dir in dmgr_node_dirs(profiles, node) if node else []:
+        if not os.path.isdir(node_dir):
+            os.makedirs(node_dir)
+        with open(os.path.join(node_dir, "serverindex.xml"), "w") as f:
+            f.write(SERVERINDEX_XML.format(host="localhost", server="nodeagent", type="NODE_AGENT", soap_port=8878))
+    print("ADMU0003I: Node {0} has been successfully federated.".format(node))
+
+
+def remove_node(args):
+    profiles = load_state("profiles", {})
+    node = profiles.get(option(args, "-profileName"), {}).get("node")
+    save_state("nodes", [n for n in load_state("nodes", []) if n != node])
+    for node_dir in dmgr_node_dirs(profiles, node) if node else []:
+        shutil.rmtree(node_dir, ignore_errors=True)
+    print("ADMU2024I: Removal of node {0} is complete.".format(node))
+
+
+def server_paths(args):
+    """
+    Returns the log directory and the pid file of the server named in the arguments
+    """
+    server = args[0]
+    profile = option(args, "-profileName", server)
+    profile_path = load_state("profiles", {}).get(profile, {}).get("path") or \
+        os.path.join(ROOT, "was", "profiles", profile)
+    log_dir = os.path.join(profile_path, "logs", server)
+    return profile_path, log_dir, os.path.join(log_dir, server + ".pid")
+
+
+def running_pid(pid_file):
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+        # A killed server may stay a zombie when nobody reaps orphans
+        with open("/proc/{0}/stat".format(pid)) as f:
+            if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                return None
+        return pid
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def start_server(args):
+    """
+    Starts a fake server process with the command line of a WebSphere
+    server and writes its pid file. The server process writes its messages
+    to SystemOut.log, the ready message READY_DELAY seconds after the start.
+    READY=fail writes a startup error, READY=none no ready message.
+    """
+    server = args[0]
+    profile_path, log_dir, pid_file = server_paths(args)
+    pid = running_pid(pid_file)
+    if pid:
+        print("ADMU3027E: An instance of the server may already be running: {0}".format(server))
+        return 255
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), "WsServer",
+                                  os.path.join(profile_path, "config"), "benchCell", "benchNode", server])
+    with open(pid_file, "w") as f:
+        f.write(str(pid))
+    if not float(setting("startServer.sh", "READY_DELAY", "0")):
+        # Without a delay the server is ready before the script returns
+        for i in range(200):
+            try:
+                with open(os.path.join(log_dir, "SystemOut.log")) as f:
+                    if "WSVR000" in f.read():
+                        break
+            except IOError:
+                pass
+            time.sleep(0.01)
+    print("ADMU3000I: Server {0} open for e-business; process id is {1}".format(server, pid))
+
+
+def ws_server(args):
+    """
+    Runs as the process of a started server until it is killed. SIGQUIT
+    writes a javacore into the profile directory like the IBM JVM does,
+    with WSSERVER_IGNORE_TERM=1 the server ignores SIGTERM like a server
+    hung in a shutdown hook.
+    """
+    config_dir, server = args[0], args[-1]
+    log = os.path.join(os.path.dirname(config_dir), "logs", server, "SystemOut.log")
+
+    def javacore(signum, frame):
+        with open(os.path.join(os.path.dirname(config_dir), "javacore.{0}.{1}.0001.txt".format(
+                time.strftime("%Y%m%d.%H%M%S"), os.getpid())), "w") as f:
+            f.write("0SECTION       TITLE subcomponent dump routine\n")
+
+    signal.signal(signal.SIGQUIT, javacore)
+    if setting("WsServer", "IGNORE_TERM", ""):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    with open(log, "a") as f:
+        f.write("[10/18/26 12:00:00:000 UTC] 00000001 AdminHelper   A   ADMN0015I: The administration service is "
+                "initialized.\n")
+    time.sleep(float(setting("startServer.sh", "READY_DELAY", "0")))
+    ready = setting("startServer.sh", "READY", "ready")
+    with open(log, "a") as f:
+        if ready == "ready":
+            f.write("[10/18/26 12:00:01:000 UTC] 00000001 WsServerImpl  A   WSVR0001I: Server {0} open for "
+                    "e-business\n".format(server))
+        elif ready == "fail":
+            f.write("[10/18/26 12:00:01:000 UTC] 00000001 WsServerImpl  E   WSVR0009E: Error occurred during "
+                    "startup\n")
+    while True:
+        time.sleep(3600)
+
+
+def stop_server(args):
+    server = args[0]
+    pid_file = server_paths(args)[2]
+    pid = running_pid(pid_file)
+    if not pid:
+        print('ADMU0509I: The Application Server "{0}" cannot be reached. It appears to be stopped.'.format(server))
+        return 246
+    os.kill(pid, signal.SIGTERM)
+    while running_pid(pid_file):
+        time.sleep(0.01)
+    os.remove(pid_file)
+    print("ADMU4000I: Server {0} stop completed.".format(server))
+
+
+def liberty_server(args):
+    action, name = (args + ["", ""])[:2]
+    if action == "create":
+        server_dir = os.path.join(ROOT, "liberty", "usr", "servers", name)
+        if not os.path.isdir(server_dir):
+            os.makedirs(server_dir)
+    print("Server {0} {1}.".format(name, action))
+
+
+TOOLS = {
+    "imcl": imcl,
+    "install": im_installer,
+    "uninstallc": lambda args: write_installed([p for p in read_installed() if p["id"] != "com.ibm.cic.agent"]),
+    "manageprofiles.sh": manageprofiles,
+    "wsadmin.sh": wsadmin,
+    "addNode.sh": add_node,
+    "removeNode.sh": remove_node,
+    "wasservice.sh": lambda args: print("Service updated."),
+    "startServer.sh": start_server,
+    "stopServer.sh": stop_server,
+    "server": liberty_server,
+}
+
+
+def main():
+    tool, args = sys.argv[1], sys.argv[2:]
+    if tool == "WsServer":
+        return ws_server(args)
+    started = time.time()
+    time.sleep(float(setting(tool, "LATENCY", "0.5")))
+    for i in range(int(setting(tool, "OUTPUT_LINES", "20"))):
+        print("{0} output line {1}".format(tool, i))
+    rc = int(setting(tool, "RC", "0"))
+    serve = None
+    if rc == 0:
+        serve = TOOLS[tool](args)
+        if isinstance(serve, int):
+            rc, serve = serve, None
+    else:
+        sys.stderr.write("{0} failed with exit code {1}\n".format(tool, rc))
+    sys.stdout.flush()
+    log_call(tool, args, started, rc)
+    if serve is not None:
+        serve()
+    sys.exit(rc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the wall time of the modules in library/ against fake WebSphere
+and Installation Manager binaries (see fakes/fake_was.py), so it runs on any
+Linux box without WebSphere installed. Ansible has to be importable by the
+python running the modules.
+
+Every module is run in three scenarios on a freshly built fake tree:
+
+  check      check mode before anything exists
+  fresh      the first real run, which has to do all the work
+  converged  a second run, which should find nothing to do
+
+For every run the report shows the wall time, the number of fake processes
+spawned, the time spent inside them (calls running in parallel are counted
+once) and the rest, which is the overhead of the module itself. Examples:
+
+  python benchmarks/run.py
+  python benchmarks/run.py --latency 2 --output-lines 50000 --repeat 3
+  python benchmarks/run.py --module ibmwas --module ibmxs --json baseline.json
+  python benchmarks/run.py --fail imcl=1
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import signal
+import getpass
+import argparse
+import tempfile
+import subprocess
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+FAKE_WAS = os.path.join(BENCHMARKS_DIR, "fakes", "fake_was.py")
+SCENARIOS = ["check", "fresh", "converged"]
+
+# Makes the repository's module_utils importable as ansible.module_utils.*
+# and runs the module the way Ansible does with a file of arguments
+BOOTSTRAP = """
+import sys, runpy
+import ansible.module_utils
+ansible.module_utils.__path__.append(sys.argv[1])
+module, sys.argv = sys.argv[2], [sys.argv[2], sys.argv[3]]
+runpy.run_path(module, run_name="__main__")
+"""
+
+OFFERINGS = [
+    "com.ibm.websphere.ND.v85_8.5.5008.20151112_0939",
+    "com.ibm.websphere.ND.v85_8.5.5009.20160225_0435",
+    "com.ibm.websphere.IHS.v85_8.5.5009.20160225_0435",
+    "com.ibm.websphere.WXS.v86_8.6.1000.20160516_1650",
+]
+
+WRAPPERS = {
+    "im/eclipse/tools/imcl": "imcl",
+    "im_installer/install": "install",
+    "was/bin/manageprofiles.sh": "manageprofiles.sh",
+    "was/bin/wsadmin.sh": "wsadmin.sh",
+    "was/bin/addNode.sh": "addNode.sh",
+    "was/bin/removeNode.sh": "removeNode.sh",
+    "was/bin/wasservice.sh": "wasservice.sh",
+    "was/bin/startServer.sh": "startServer.sh",
+    "was/bin/stopServer.sh": "stopServer.sh",
+    "liberty/bin/server": "server",
+}
+
+
+def module_args(root):
+    """
+    Returns the arguments of every benchmarked module, in the order they run
+
+    :param root: Root of the fake tree
+    :return: List of (label, module name, arguments) tuples
+    """
+    was = os.path.join(root, "was")
+    return [
+        ("ibmim", "ibmim", dict(
+            src=os.path.join(root, "im_installer"), dest=os.path.join(root, "im"),
+            logdir=os.path.join(root, "logs", "im"))),
+        ("ibmwas", "ibmwas", dict(
+            ibmim=os.path.join(root, "im"), dest=os.path.join(root, "was_install"),
+            im_shared=os.path.join(root, "im_shared"), repo=os.path.join(root, "repo"),
+            offering=["com.ibm.websphere.ND.v85", "com.ibm.websphere.IHS.v85"],
+            logdir=os.path.join(root, "logs", "was"))),
+        ("ibmxs", "ibmxs", dict(
+            ibmim=os.path.join(root, "im"), dest=os.path.join(root, "xs"),
+            repo=os.path.join(root, "repo"), logdir=os.path.join(root, "logs", "xs"))),
+        ("profile_dmgr", "profile_dmgr", dict(
+            wasdir=was, name="dmgr", host_name="localhost", node_name="dmgrNode")),
+        ("profile_nodeagent", "profile_nodeagent", dict(
+            wasdir=was, name="node1", template="managed", host_name="localhost",
+            node_name="node1", dmgr_host="localhost", federate=True, service_username=getpass.getuser())),
+        ("was_facts", "was_facts", dict(wasdir=was, name="dmgr")),
+        ("server", "server", dict(
+            wasdir=was, name="server1", username="wasadmin", password="wasadmin")),
+        ("server_parallel", "server", dict(
+            wasdir=was, name=["server1", "server2", "server3", "server4"], username="wasadmin",
+            password="wasadmin", parallelism=4)),
+        ("server_ready", "server", dict(
+            wasdir=was, name="server5", username="wasadmin", password="wasadmin", wait_for="ready")),
+        ("cluster_restart", "cluster_restart", dict(
+            wasdir=was, username="wasadmin", password="wasadmin", cluster="cluster1", batch_size="50%")),
+        ("wsadmin", "wsadmin", dict(
+            wasdir=was, username="wasadmin", password="wasadmin",
+            script=os.path.join(root, "scripts", "bench.py"))),
+        ("wsadmin_worker", "wsadmin", dict(
+            wasdir=was, username="wasadmin", password="wasadmin",
+            script=os.path.join(root, "scripts", "bench.py"), worker=True)),
+        ("wsadmin_steps", "wsadmin", dict(
+            wasdir=was, username="wasadmin", password="wasadmin",
+            steps=[os.path.join(root, "scripts", "bench.py"),
+                   dict(command="AdminConfig.save()"),
+                   dict(command="AdminControl.invoke(sync, 'sync')", name="sync")])),
+        ("wsadmin_config", "wsadmin", dict(
+            wasdir=was, username="wasadmin", password="wasadmin",
+            config=[dict(containment="/Node:node1/Server:server1/", type="JavaVirtualMachine",
+                         attributes=dict(initialHeapSize=512, maximumHeapSize=2048),
+                         properties={"com.ibm.ws.cache.CacheConfig.showObjectContents": True},
+                         properties_attribute="systemProperties"),
+                    dict(containment="/Node:node1/Server:server1/", type="ThreadPool", name="WebContainer",
+                         attributes=dict(minimumSize=20, maximumSize=50))])),
+        ("profile_liberty", "profile_liberty", dict(
+            libertydir=os.path.join(root, "liberty"), name="bench")),
+        ("liberty_server", "liberty_server", dict(
+            libertydir=os.path.join(root, "liberty"), name="bench")),
+    ]
+
+
+def build_tree(root, python):
+    """
+    Creates the fake Installation Manager, WebSphere and Liberty trees
+
+    :param root: Directory to build the tree in
+    :param python: Python interpreter that runs the fakes
+    :return: None
+    """
+    for path, tool in WRAPPERS.items():
+        path = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write('#!/bin/sh\nexec "{0}" "{1}" {2} "$@"\n'.format(python, FAKE_WAS, tool))
+        os.chmod(path, 0o755)
+    os.makedirs(os.path.join(root, "im", "eclipse", "configuration"))
+    with open(os.path.join(root, "im", "eclipse", "configuration", "config.ini"), "w") as f:
+        f.write("cic.appDataLocation={0}\n".format(os.path.join(root, "appdata")))
+    os.makedirs(os.path.join(root, "appdata"))
+    open(os.path.join(root, "im_installer", "silent-install.ini"), "w").close()
+    os.makedirs(os.path.join(root, "repo", "Offerings"))
+    with open(os.path.join(root, "repo", "repository.config"), "w") as f:
+        f.write("LayoutPolicy=Composite\nLayoutPolicyVersion=0.0.0.1\n")
+    for offering in OFFERINGS:
+        with open(os.path.join(root, "repo", "Offerings", offering + ".jar"), "w") as f:
+            f.write(offering)
+    os.makedirs(os.path.join(root, "was", "profiles"))
+    os.makedirs(os.path.join(root, "liberty", "usr", "servers"))
+    os.makedirs(os.path.join(root, "scripts"))
+    with open(os.path.join(root, "scripts", "bench.py"), "w") as f:
+        f.write("print AdminControl.getCell()\n")
+        f.write("ansible_result({'cell': 'benchCell', 'nodes': ['dmgrNode', 'node1']})\n")
+
+
+def stop_workers(root):
+    """
+    Stops the wsadmin workers started in a fake tree
+    """
+    sys.path.insert(0, os.path.join(REPO_DIR, "module_utils"))
+    from websphere_wsadmin import DEFAULT_WORKER_DIR, stop_worker
+    worker_dir = os.path.join(root, DEFAULT_WORKER_DIR.replace("~/", ""))
+    if os.path.isdir(worker_dir):
+        for name in os.listdir(worker_dir):
+            if name.endswith(".worker"):
+                stop_worker(os.path.join(worker_dir, name))
+
+
+def stop_servers(root):
+    """
+    Kills the fake server processes started in a fake tree
+    """
+    for pid_file in glob.glob(os.path.join(root, "was", "profiles", "*", "logs", "*", "*.pid")):
+        try:
+            with open(pid_file) as f:
+                pid = int(f.read().strip())
+            with open("/proc/{0}/cmdline".format(pid)) as f:
+                if "WsServer" in f.read():
+                    os.kill(pid, signal.SIGTERM)
+        except (IOError, OSError, ValueError):
+            pass
+
+
+def run_module(python, name, args, check_mode, env):
+    """
+    Runs a module once and measures it
+
+    :return: Dictionary of the measurements and the module result
+    """
+    args = dict(args, _ansible_check_mode=check_mode)
+    fd, args_file = tempfile.mkstemp(prefix="bench_args_")
+    with os.fdopen(fd, "w") as f:
+        json.dump(dict(ANSIBLE_MODULE_ARGS=args), f)
+    # Workers started by an earlier run log into the same file, so only the
+    # calls appended during this run are counted
+    call_log = env["FAKE_WAS_CALL_LOG"]
+    offset = os.path.getsize(call_log) if os.path.exists(call_log) else 0
+    started = time.time()
+    child = subprocess.Popen(
+        [python, "-c", BOOTSTRAP, os.path.join(REPO_DIR, "module_utils"),
+         os.path.join(REPO_DIR, "library", name + ".py"), args_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=env
+    )
+    stdout_value, stderr_value = child.communicate()
+    wall = time.time() - started
+    calls = []
+    if os.path.exists(call_log):
+        with open(call_log) as f:
+            f.seek(offset)
+            calls = [json.loads(line) for line in f if line.strip()]
+    os.remove(args_file)
+    try:
+        result = json.loads(stdout_value[stdout_value.index("{"):])
+    except ValueError:
+        result = dict(failed=True, msg=(stderr_value or stdout_value).strip().splitlines()[-1:])
+    tools = {}
+    for call in calls:
+        tools[call["tool"]] = tools.get(call["tool"], 0) + call["end"] - call["start"]
+    # Calls made in parallel overlap, count the time any tool was running
+    tool_time = 0
+    busy_until = 0
+    for call in sorted(calls, key=lambda call: call["start"]):
+        start = max(call["start"], busy_until)
+        if call["end"] > start:
+            tool_time += call["end"] - start
+            busy_until = call["end"]
+    return dict(
+        wall=wall,
+        spawned=len(calls),
+        tool_time=tool_time,
+        overhead=wall - tool_time,
+        tools=tools,
+        changed=result.get("changed", False),
+        failed=bool(result.get("failed")) or child.returncode != 0,
+        skipped=bool(result.get("skipped")),
+        msg=result.get("msg")
+    )
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(runs):
+    """
+    Reduces the repeated runs of one module and scenario to their medians
+    """
+    summary = dict(runs[-1])
+    for key in ("wall", "tool_time", "overhead"):
+        summary[key] = round(median([run[key] for run in runs]), 3)
+    summary["tools"] = dict(
+        (tool, round(median([run["tools"].get(tool, 0) for run in runs]), 3))
+        for tool in runs[-1]["tools"]
+    )
+    summary["repeat"] = len(runs)
+    return summary
+
+
+def report(results):
+    print("{0:<18} {1:<10} {2:>8} {3:>8} {4:>9} {5:>9}  {6}".format(
+        "module", "scenario", "wall", "spawned", "in tools", "overhead", "result"))
+    for result in results:
+        if result["failed"]:
+            outcome = "failed: {0}".format(result["msg"])
+        elif result["skipped"]:
+            outcome = "skipped"
+        else:
+            outcome = "changed" if result["changed"] else "ok"
+        print("{0:<18} {1:<10} {2:>7.3f}s {3:>8} {4:>8.3f}s {5:>8.3f}s  {6}".format(
+            result["module"], result["scenario"], result["wall"], result["spawned"],
+            result["tool_time"], result["overhead"], outcome))
+    print("{0:<29} {1:>7.3f}s".format("total", sum([r["wall"] for r in results])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", action="append", help="module to run, repeat for several (default: all)")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario, the median is reported")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds every fake binary sleeps")
+    parser.add_argument("--output-lines", type=int, default=20, help="lines every fake binary prints")
+    parser.add_argument("--fail", action="append", default=[], metavar="TOOL=RC",
+                        help="make a fake binary exit with RC, for example imcl=1")
+    parser.add_argument("--python", default=sys.executable, help="python interpreter for the modules")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the fake trees for inspection")
+    options = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not options.scenario or s in options.scenario]
+    env = dict(os.environ, FAKE_WAS_LATENCY=str(options.latency), FAKE_WAS_OUTPUT_LINES=str(options.output_lines))
+    for failure in options.fail:
+        tool, sep, rc = failure.partition("=")
+        env["FAKE_{0}_RC".format("".join([c if c.isalnum() else "_" for c in tool.upper()]))] = rc or "1"
+
+    runs = {}
+    order = []
+    for i in range(options.repeat):
+        root = tempfile.mkdtemp(prefix="fake_was_")
+        build_tree(root, options.python)
+        # Worker state files end up in the fake tree as well
+        env.update(FAKE_WAS_ROOT=root, FAKE_WAS_CALL_LOG=os.path.join(root, "calls.log"), HOME=root)
+        for label, name, args in module_args(root):
+            if options.module and name not in options.module and label not in options.module:
+                continue
+            for scenario in scenarios:
+                key = (label, scenario)
+                if key not in runs:
+                    runs[key] = []
+                    order.append(key)
+                runs[key].append(run_module(options.python, name, args, scenario == "check", env))
+        stop_workers(root)
+        if not options.keep:
+            stop_servers(root)
+        if options.keep:
+            print("fake tree kept in {0}".format(root))
+        else:
+            shutil.rmtree(root)
+
+    results = []
+    for label, scenario in order:
+        result = summarize(runs[(label, scenario)])
+        result.update(module=label, scenario=scenario)
+        results.append(result)
+    report(results)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(dict(
+                latency=options.latency,
+                output_lines=options.output_lines,
+                repeat=options.repeat,
+                results=results
+            ), f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
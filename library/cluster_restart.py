@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import time
+import tempfile
+
+
+DOCUMENTATION = """
+---
+module: cluster_restart
+author: "Amir Mofasser <amir.mofasser@gmail.com>"
+short_description: This is an Ansible module for rolling restarts of WebSphere clusters
+description:
+  - This is an Ansible module for rolling restarts of the members of a
+    WebSphere cluster through the deployment manager
+  - All batches run in a single wsadmin session. The members of a batch are
+    stopped with the stop operation of their Server MBean and launched with
+    launchProcess of the NodeAgent MBean of their node. The next batch is
+    only stopped when every member of the batch is STARTED and, with
+    check_applications, all of its applications are running.
+  - Members that fail to stop, to launch or to become ready in time count
+    as failures. Once there are more failures than failure_threshold the
+    remaining members are left alone and the task fails.
+options:
+  wasdir:
+    required: false
+    default: "/opt/IBM/WebSphere"
+    description:
+      - Path to installation location of WAS
+  host:
+    required: false
+    default: "localhost"
+    description:
+      - Host name of the deployment manager
+  port:
+    required: false
+    default: 8879
+    description:
+      - SOAP port number of the deployment manager
+  username:
+    required: true
+    description:
+      - WAS user name
+  password:
+    required: true
+    description:
+      - WAS user password
+  cluster:
+    required: true
+    description:
+      - Name of the cluster
+  batch_size:
+    required: false
+    default: "1"
+    description:
+      - Members restarted at the same time, either a count or a percentage
+        of the members like 25%. Percentages are rounded up.
+  failure_threshold:
+    required: false
+    default: "0"
+    description:
+      - Failed members tolerated before the restart stops, either a count
+        or a percentage of the members. The batch in which the threshold is
+        crossed still completes.
+  stop_timeout:
+    required: false
+    default: 300
+    description:
+      - Seconds to wait for the members of a batch to stop
+  ready_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds to wait for the members of a batch to be ready after they
+        were launched
+  check_applications:
+    required: false
+    default: true
+    description:
+      - Wait for the applications deployed to a member to be started, not
+        only for the member itself
+  timeout:
+    required: false
+    description:
+      - Seconds after which wsadmin is killed, its process group gets
+        SIGTERM and 10 seconds later SIGKILL. By default there is no timeout.
+  java_shareclasses:
+    required: false
+    description:
+      - Name of an IBM J9 shared class cache for the wsadmin JVM, passed as
+        -Xshareclasses. %u in the name is replaced with the user name.
+  java_shareclasses_dir:
+    required: false
+    default: "~/.ansible/wsadmin/javasharedresources"
+    description:
+      - Directory of the shared class cache, created if it does not exist
+  java_quickstart:
+    required: false
+    default: false
+    description:
+      - Start the wsadmin JVM with -Xquickstart
+  java_initial_heap:
+    required: false
+    description:
+      - Initial heap size of the wsadmin JVM, for example 64m
+  java_max_heap:
+    required: false
+    description:
+      - Maximum heap size of the wsadmin JVM, for example 256m
+  jython_cache_dir:
+    required: false
+    description:
+      - Directory in which Jython caches the package index of the WebSphere
+        jars (python.cachedir), created if it does not exist
+"""
+
+RETURN = """
+msg:
+    description: message of the result
+    returned: in all cases
+    type: string
+    sample: "Restarted 4 members of app_cluster in 2 batches"
+members:
+    description: node, server, batch, status (ok, failed, skipped or planned in check mode), error and
+                 the seconds it took to stop, to launch and to become ready of every member
+    returned: when the cluster exists
+    type: list
+    sample: [{"node": "node1", "server": "member1", "batch": 1, "status": "ok", "error": null,
+              "stop_seconds": 12.1, "start_seconds": 35.4, "ready_seconds": 61.0, "elapsed": 73.2,
+              "applications": ["app"]}]
+batches:
+    description: number of batches
+    returned: in all cases
+    type: int
+failures:
+    description: number of members that failed
+    returned: in all cases
+    type: int
+aborted:
+    description: whether the restart stopped because the failure threshold was crossed
+    returned: in all cases
+    type: bool
+elapsed:
+    description: seconds the restart took
+    returned: in all cases
+    type: float
+stdout:
+    description: output of wsadmin without the member records
+    returned: failure
+    type: string
+stderr:
+    description: error output of wsadmin
+    returned: failure
+    type: string
+"""
+
+
+def main():
+    """
+    Main module function that restarts the members of a cluster in batches
+
+    :return: Ansible module JSON state
+    """
+    module = AnsibleModule(
+        argument_spec=dict(
+            wasdir=dict(required=False, default="/opt/IBM/WebSphere"),
+            host=dict(default="localhost", required=False),
+            port=dict(default="8879", required=False),
+            username=dict(required=True),
+            password=dict(required=True),
+            cluster=dict(required=True),
+            batch_size=dict(default="1", required=False),
+            failure_threshold=dict(default="0", required=False),
+            stop_timeout=dict(default=300, type="int"),
+            ready_timeout=dict(default=600, type="int"),
+            check_applications=dict(default=True, type="bool"),
+            timeout=dict(required=False, type="int"),
+            **java_argument_spec()
+        ),
+        supports_check_mode=True
+    )
+
+    wasdir = module.params["wasdir"]
+    cluster = module.params["cluster"]
+
+    if not os.path.exists(wasdir):
+        module.fail_json(msg="{0} does not exists".format(wasdir))
+
+    try:
+        batch_size = parse_amount(module.params["batch_size"])
+        failure_threshold = parse_amount(module.params["failure_threshold"])
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+    if batch_size[0] < 1:
+        module.fail_json(msg="batch_size must be at least 1")
+
+    code = cluster_restart_code(
+        cluster,
+        batch_size,
+        failure_threshold,
+        module.params["stop_timeout"],
+        module.params["ready_timeout"],
+        check_applications=module.params["check_applications"],
+        dry_run=module.check_mode
+    )
+
+    started = time.time()
+    fd, driver = tempfile.mkstemp(prefix="ansible_wsadmin_", suffix=".py")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(code)
+        tail = OutputTail()
+        result = run_command(
+            "{0}/bin/wsadmin.sh -lang jython "
+            "-conntype SOAP "
+            "-host {1} "
+            "-port {2} "
+            "-username {3} "
+            "-password {4} "
+            "{5} "
+            "-f {6}".format(
+                wasdir,
+                module.params["host"],
+                module.params["port"],
+                module.params["username"],
+                module.params["password"],
+                java_options(module.params),
+                driver
+            ),
+            line_filter=tail.feed,
+            timeout=module.params["timeout"]
+        )
+    finally:
+        os.remove(driver)
+    elapsed = round(time.time() - started, 3)
+
+    stdout = tail.output()
+    members = parse_records(stdout, RESTART_MARKER)
+    summary = parse_result(stdout, RESTART_DONE_MARKER)
+    output = result.as_dict()
+    output["stdout"] = "\n".join([line for line in stdout.splitlines()
+                                  if not line.startswith(RESTART_MARKER) and not line.startswith(RESTART_DONE_MARKER)])
+    restarted = [member for member in members if member["status"] in ("ok", "failed")]
+
+    if summary is None:
+        # wsadmin could not connect or was killed before the restart finished
+        module.fail_json(
+            msg=result.failure_msg("wsadmin failed"),
+            members=members,
+            elapsed=elapsed,
+            changed=len(restarted) > 0,
+            **output
+        )
+    if summary["error"]:
+        module.fail_json(msg=summary["error"], elapsed=elapsed, **output)
+
+    if module.check_mode:
+        module.exit_json(
+            changed=len(members) > 0,
+            msg="Would restart {0} members of {1} in {2} batches".format(len(members), cluster, summary["batches"]),
+            members=members,
+            batches=summary["batches"],
+            failures=0,
+            aborted=False,
+            elapsed=elapsed
+        )
+
+    result_fields = dict(
+        changed=len(restarted) > 0,
+        members=members,
+        batches=summary["batches"],
+        failures=summary["failures"],
+        aborted=bool(summary["aborted"]),
+        elapsed=elapsed
+    )
+    if summary["aborted"]:
+        module.fail_json(
+            msg="Stopped the restart of {0}, {1} members failed and {2} were not restarted".format(
+                cluster, summary["failures"], len(members) - len(restarted)),
+            stdout=output["stdout"],
+            stderr=result.stderr,
+            **result_fields
+        )
+    module.exit_json(
+        msg="Restarted {0} members of {1} in {2} batches, {3} failed".format(
+            len(restarted), cluster, summary["batches"], summary["failures"]),
+        **result_fields
+    )
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_process import run_command
+from ansible.module_utils.websphere_wsadmin import RESTART_DONE_MARKER, RESTART_MARKER, OutputTail, \
+    cluster_restart_code, java_argument_spec, java_options, parse_amount, parse_records, parse_result
+if __name__ == "__main__":
+    main()
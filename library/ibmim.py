@@ -1,9 +1,8 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
-import platform
-import datetime
+import re
+import shutil
 
 DOCUMENTATION = """
 ---
@@ -36,6 +35,13 @@ options:
     default: "/var/log/IBM/InstallationManager"
     description:
       - Path to IBM Installation Manager install logs
+  timeout:
+    required: false
+    description:
+      - Seconds after which the installer is killed, its process group gets
+        SIGTERM and 10 seconds later SIGKILL. The task then fails with
+        timed_out set and the output read so far. By default there is no
+        timeout.
 """
 
 RETURN = """
@@ -57,26 +63,17 @@ stderr:
 """
 
 
-def im_is_installed(dest):
+def im_is_installed(module, dest):
     """
     Checks if IBM Installation Manager is installed at the destination directory
 
+    :param module: Ansible module, failed when imcl has to list the packages and times out
     :param dest: IBM Installation Manager installation directory
     :return: True for installed or False for not installed
     """
     if not os.path.exists(dest):
         return False
-    else:
-        child = subprocess.Popen(
-            ["{0}/eclipse/tools/imcl listInstalledPackages".format(dest)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        if stdout_value.find("com.ibm.cic.agent") < 0:
-            return False
-    return True
+    return offering_installed(dest, "com.ibm.cic.agent", module=module)
 
 
 def main():
@@ -91,7 +88,8 @@ def main():
             state=dict(default="present", choices=["present", "absent"]),
             src=dict(required=True),
             dest=dict(required=False, default="/opt/IBM/InstallationManager"),
-            logdir=dict(required=False, default="/var/log/IBM/InstallationManager")
+            logdir=dict(required=False, default="/var/log/IBM/InstallationManager"),
+            timeout=dict(required=False, type="int")
         )
     )
 
@@ -102,7 +100,7 @@ def main():
 
     if state == "present":
         if module.check_mode:
-            if im_is_installed(dest):
+            if im_is_installed(module, dest):
                 module.exit_json(
                     changed=False,
                     msg="IBM IM already installed"
@@ -114,37 +112,29 @@ def main():
                 )
         if not os.path.exists("{0}/install".format(src)):
             module.fail_json(msg="{0}/install not found".format(src))
-        if not os.path.exists(logdir) and not os.listdir(logdir):
-                os.makedirs(logdir)
-        if not im_is_installed(dest):
-            logfile = "{0}_ibmim_{1}.xml".format(
-                platform.node(),
-                datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            )
-            child = subprocess.Popen(
-                ["{0}/install "
-                 "-acceptLicense "
-                 "--launcher.ini {0}/silent-install.ini "
-                 "-log {1}/{2} "
-                 "-installationDirectory {3}".format(src, logdir, logfile, dest)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+        if not im_is_installed(module, dest):
+            log = log_file(logdir, "ibmim_install")
+            result = run_command(
+                "{0}/install "
+                "-acceptLicense "
+                "--launcher.ini {0}/silent-install.ini "
+                "-log {1} "
+                "-installationDirectory {2}".format(src, re.sub(r"\.log$", ".xml", log), dest),
+                log=log,
+                timeout=module.params["timeout"]
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if result.rc != 0:
                 module.fail_json(
-                    msg="IBM IM installation failed",
-                    stderr=stderr_value,
-                    stdout=stdout_value
+                    msg=result.failure_msg("IBM IM installation failed"),
+                    **result.as_dict()
                 )
-            module.exit_json(changed=True, msg="IBM IM installed successfully")
+            module.exit_json(changed=True, msg="IBM IM installed successfully", log=result.log)
         else:
             module.exit_json(changed=False, msg="IBM IM already installed")
 
     if state == "absent":
         if module.check_mode:
-            if im_is_installed(dest):
+            if im_is_installed(module, dest):
                 module.exit_json(
                     changed=True,
                     msg="IBM IM would be uninstalled"
@@ -157,31 +147,30 @@ def main():
         uninstall_dir = "/var/ibm/InstallationManager/uninstall/uninstallc"
         if not os.path.exists(uninstall_dir):
             module.exit_json(changed=False, msg="IBM IM already uninstalled")
-        if not im_is_installed(dest):
-            child = subprocess.Popen(
-                [uninstall_dir],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+        if not im_is_installed(module, dest):
+            result = run_command(
+                uninstall_dir,
+                log=log_file(logdir, "ibmim_uninstall"),
+                timeout=module.params["timeout"]
             )
-            stdout_value, stderr_value = child.communicate()
 
-            if child.returncode != 0:
+            if result.rc != 0:
                 module.fail_json(
-                    msg="IBM IM uninstall failed",
-                    stderr=stderr_value,
-                    stdout=stdout_value
+                    msg=result.failure_msg("IBM IM uninstall failed"),
+                    **result.as_dict()
                 )
             shutil.rmtree(dest, ignore_errors=True, onerror=None)
             module.exit_json(
                 changed=True,
                 msg="IBM IM uninstalled successfully",
-                stdout=stdout_value
+                **result.as_dict()
             )
         else:
             module.exit_json(changed=True, msg="IBM IM already uninstalled")
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_im import offering_installed
+from ansible.module_utils.websphere_process import log_file, run_command
 if __name__ == "__main__":
     main()
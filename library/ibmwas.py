@@ -1,10 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
-import platform
-import datetime
-import shutil
+import re
 
 
 DOCUMENTATION = """
@@ -21,9 +18,10 @@ options:
   state:
     required: false
     default: "present"
-    choices: ["present", "absent"]
+    choices: ["present", "absent", "latest"]
     description:
       - Make sure IBM WebSphere Application Server is present or absent
+      - latest updates installed offerings to the latest version in the repository
   ibmim:
     required: false
     default: "/opt/IBM/InstallationManager"
@@ -42,14 +40,32 @@ options:
     required: true
     description:
       - URL or path to the installation repository used by Installation Manager to install WebSphere products
+  repo_cache:
+    required: false
+    description:
+      - Local or shared directory the repository is staged into before installing
+      - Only new or changed artifacts are copied. Cached artifacts whose size or mtime
+        changed are validated against their SHA-256 digest before they are reused
+      - The artifacts of an HTTP repository are read from its repository.xml and the
+        offering metadata, its directory listings are only used without repository.xml
   offering:
     required: false
-    default: "com.ibm.websphere.ND.v85"
+    default: ["com.ibm.websphere.ND.v85"]
     choices: ["com.ibm.websphere.ND.v85", "com.ibm.websphere.IHS.v85",
               "com.ibm.websphere.PLG.v85", "com.ibm.websphere.WCT.v85",
               "com.ibm.websphere.liberty.IBMJAVA.v70", "com.ibm.websphere.liberty.v85"]
     description:
-      - Name of the offering which you want to install
+      - Name of the offering which you want to install, or a list of offerings
+      - Offerings which are not in the choices are accepted if the repository provides them
+      - An offering can be pinned to a version with id_version
+      - Features are selected with id_version,feature,... or with a dictionary of id,
+        version and features. A single string is one offering, its commas separate features
+      - All missing offerings are installed in a single imcl transaction
+  version:
+    required: false
+    description:
+      - Version, or leading part of a version, for offerings which are not pinned to a version
+      - With state=latest the latest version matching it is installed
   ihs_port:
     required: false
     default: 8080
@@ -60,6 +76,50 @@ options:
     default: "/var/log/IBM/WebSphere"
     description:
       - Path of installation log file
+  artifact_store:
+    required: false
+    description:
+      - Directory of a content addressed store which deduplicates the artifacts in the
+        im_shared directories of several installations on this host
+      - After an install the store records which artifacts the installation
+        added to im_shared for the installed offerings. Before an install
+        im_shared is seeded with the artifacts recorded for the offerings
+        about to be installed, so imcl does not download them again.
+  artifact_store_mode:
+    required: false
+    default: "reflink"
+    choices: ["reflink", "copy", "hardlink"]
+    description:
+      - How artifacts are shared between the store and im_shared
+      - reflink gives copy-on-write copies on file systems which support it
+        (Btrfs, XFS with reflink=1). The task fails on other file systems, like
+        ext4, instead of quietly keeping a second copy of every artifact.
+      - copy only seeds im_shared from the store and shares no disk space, the
+        store then needs as much space as the artifacts
+      - On file systems without reflinks only hardlink saves space
+      - hardlink shares the files themselves. A file Installation Manager
+        rewrites in place changes the stored artifact and every im_shared
+        linked to it, the store verifies the digest of an artifact before
+        reusing it in this mode.
+  artifact_store_seed:
+    required: false
+    description:
+      - List of im_shared directories of existing installations to import
+        into the store first, their artifacts are deduplicated but not
+        recorded for any offering
+  remove_workers:
+    required: false
+    default: 8
+    description:
+      - Number of threads removing the installation directory after an
+        uninstall, at least 1. An installation directory that is a mount
+        point is emptied and kept.
+  timeout:
+    required: false
+    description:
+      - Seconds after which imcl is killed, its process group gets SIGTERM
+        and 10 seconds later SIGKILL. The task then fails with timed_out set
+        and the output read so far. By default there is no timeout.
 """
 
 RETURN = """
@@ -81,24 +141,60 @@ stderr:
 """
 
 
-def was_is_installed(ibmim, offering):
+def was_is_installed(ibmim, offering, dest, packages=None):
     """
     Checks if IBM WebSphere Application Server is installed
 
     :param ibmim: IBM Installation Manager installation directory
     :param offering: Name of the offering which you want to install
+    :param dest: Installation directory of IBM WebSphere Application Server
+    :param packages: Already loaded list of installed packages
     :return: True for installed or False for not installed
     """
-    child = subprocess.Popen(
-        ["{0}/eclipse/tools/imcl listInstalledPackages".format(ibmim)],
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stdout_value, stderr_value = child.communicate()
-    if stdout_value.find(offering) < 0:
-        return False
-    return True
+    return offering_installed(ibmim, offering, dest, packages)
+
+
+def missing_offerings(module, ibmim, offerings, dest):
+    """
+    Filters a list of offerings down to those which are not installed yet
+
+    :param module: Ansible module, failed when imcl has to list the packages and times out
+    :param ibmim: IBM Installation Manager installation directory
+    :param offerings: List of (id, version, features) tuples
+    :param dest: Installation directory of IBM WebSphere Application Server
+    :return: List of (id, version, features) tuples which are not installed
+    """
+    packages = installed_packages(ibmim, module)
+    return [
+        (offering_id, version, features) for offering_id, version, features in offerings
+        if not was_is_installed(ibmim, imcl_offering(offering_id, version), dest, packages)
+    ]
+
+
+def outdated_offerings(module, ibmim, offerings, dest, index):
+    """
+    Filters a list of offerings down to those which are not installed yet or
+    older than the latest matching version in the repository
+
+    :param module: Ansible module, failed when imcl has to list the packages and times out
+    :param ibmim: IBM Installation Manager installation directory
+    :param offerings: List of (id, version, features) tuples
+    :param dest: Installation directory of IBM WebSphere Application Server
+    :param index: Repository index
+    :return: List of (id, version, features) tuples pinned to the version to install
+             and a list of the planned updates
+    """
+    packages = installed_packages(ibmim, module)
+    outdated = []
+    updates = []
+    for offering_id, version, features in offerings:
+        target = latest_version(index, offering_id, version)
+        installed = [package["version"] for package in find_installed(packages, offering_id, location=dest)]
+        current = max(installed, key=parse_version) if installed else None
+        if current is None or parse_version(current) < parse_version(target):
+            outdated.append((offering_id, target, features))
+            updates.append(dict(offering=offering_id, installed=current, version=target))
+    return outdated, updates
 
 
 def main():
@@ -118,14 +214,21 @@ def main():
 
     module = AnsibleModule(
         argument_spec=dict(
-            state=dict(default="present", choices=["present", "absent"]),
+            state=dict(default="present", choices=["present", "absent", "latest"]),
             ibmim=dict(required=False, default="/opt/IBM/InstallationManager"),
             dest=dict(required=False, default="/opt/IBM/WebSphere"),
             im_shared=dict(required=True),
             repo=dict(required=True),
-            offering=dict(default="com.ibm.websphere.ND.v85", choices=offerings),
+            repo_cache=dict(required=False),
+            offering=dict(default=["com.ibm.websphere.ND.v85"], type="raw"),
+            version=dict(required=False),
             ihs_port=dict(default=8080),
-            logdir=dict(required=False, default="/var/log/IBM/WebSphere")
+            logdir=dict(required=False, default="/var/log/IBM/WebSphere"),
+            artifact_store=dict(required=False),
+            artifact_store_mode=dict(default="reflink", choices=STORE_MODES),
+            artifact_store_seed=dict(required=False, default=[], type="list"),
+            remove_workers=dict(required=False, default=8, type="int"),
+            timeout=dict(required=False, type="int")
         ),
         supports_check_mode=True
     )
@@ -135,11 +238,16 @@ def main():
     dest = module.params["dest"]
     im_shared = module.params["im_shared"]
     repo = module.params["repo"]
+    repo_cache = module.params["repo_cache"]
     ihs_port = module.params["ihs_port"]
-    offering = module.params["offering"]
     logdir = module.params["logdir"]
+    artifact_store = module.params["artifact_store"]
+    remove_workers = module.params["remove_workers"]
     eclipse_dir = "{0}/eclipse".format(ibmim)
 
+    if remove_workers < 1:
+        module.fail_json(msg="remove_workers must be at least 1")
+
     def raise_on_path_not_exist(path):
         """
         Raises a module failure exception if path does not exist
@@ -150,54 +258,185 @@ def main():
         if not os.path.exists(path):
             module.fail_json(msg="{0} does not exists".format(path))
 
-    if state == "present":
+    index = []
+
+    def repo_index():
+        """
+        Returns the offering index of the repository, or None if the
+        repository can not be indexed
+
+        :return: Repository index
+        """
+        if not index:
+            try:
+                index.append(repository_index(module, repo, repo_cache))
+            except (RepositoryError, IOError, OSError):
+                index.append(None)
+            if index[0] is not None and not index[0]["offerings"]:
+                index[0] = None
+        return index[0]
+
+    def pending_offerings():
+        """
+        Returns the offerings imcl has to install: the missing ones for
+        state=present, the missing and outdated ones for state=latest
+
+        :return: List of (id, version, features) tuples and list of updates or None
+        """
+        if state == "present":
+            return missing_offerings(module, ibmim, requested, dest), None
+        latest_index = repo_index()
+        if latest_index is None:
+            try:
+                latest_index = imcl_repository_index(ibmim, repo)
+            except RepositoryError as e:
+                module.fail_json(msg="state=latest needs the versions in the repository: {0}".format(e))
+        resolved, unavailable = resolve_offerings(latest_index, requested)
+        if unavailable:
+            module.fail_json(
+                msg="{0} does not provide {1}".format(
+                    repo,
+                    ", ".join([imcl_offering(o["offering"], o["version"]) for o in unavailable])
+                ),
+                unavailable=unavailable
+            )
+        return outdated_offerings(module, ibmim, requested, dest, latest_index)
+
+    def resolve_versions(missing):
+        """
+        Fails the module if the repository does not provide an offering
+
+        :param missing: List of (id, version, features) tuples to install
+        :return: Dictionary of offering id to the version which would be installed
+        """
+        if repo_index() is None:
+            return None
+        resolved, unavailable = resolve_offerings(repo_index(), missing)
+        if unavailable:
+            module.fail_json(
+                msg="{0} does not provide {1}".format(
+                    repo,
+                    ", ".join([imcl_offering(o["offering"], o["version"]) for o in unavailable])
+                ),
+                unavailable=unavailable
+            )
+        return resolved
+
+    requested = []
+    for spec in offering_specs(module.params["offering"]):
+        try:
+            offering_id, version, features = parse_offering_spec(spec)
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+        if version is None:
+            version = module.params["version"]
+        if offering_id not in offerings and (repo_index() is None or
+                                             offering_id not in repo_index()["offerings"]):
+            module.fail_json(
+                msg="offering {0} is not one of {1}".format(offering_id, ", ".join(offerings))
+            )
+        requested.append((offering_id, version, features))
+
+    if state in ["present", "latest"]:
         if module.check_mode:
             if not os.path.exists(eclipse_dir):
                 module.exit_json(
                     changed=False,
                     msg="module would not run {0} does not exist".format(eclipse_dir)
                 )
-            elif was_is_installed(ibmim, offering):
+            missing, updates = pending_offerings()
+            if not missing:
                 module.exit_json(
                     changed=False,
                     msg="WAS ND already installed"
                 )
             else:
+                versions = resolve_versions(missing)
                 module.exit_json(
                     changed=True,
-                    msg="WAS ND would be installed"
+                    msg="WAS ND would be installed",
+                    offerings=[imcl_offering(offering_id, (versions or {}).get(offering_id, version), features)
+                               for offering_id, version, features in missing],
+                    versions=versions,
+                    updates=updates
                 )
         raise_on_path_not_exist(eclipse_dir)
-        if not was_is_installed(ibmim, offering):
-            child = subprocess.Popen(
-                ["{0}/eclipse/tools/imcl install {1} "
-                 "-repositories {2} "
-                 "-installationDirectory {3} "
-                 "-sharedResourcesDirectory {4} "
-                 "-acceptLicense "
-                 "-properties user.ihs.httpPort={5}".format(
+        missing, updates = pending_offerings()
+        if missing:
+            versions = resolve_versions(missing)
+            # imcl needs the exact version, not the leading part the playbook may give
+            offering = " ".join([imcl_offering(offering_id, (versions or {}).get(offering_id, version), features)
+                                 for offering_id, version, features in missing])
+            repo_cache_stats = None
+            if repo_cache:
+                try:
+                    repo, repo_cache_stats = mirror_repository(module, repo, repo_cache)
+                except (RepositoryError, IOError, OSError) as e:
+                    module.fail_json(msg="Staging repository {0} failed: {1}".format(repo, e))
+            artifact_store_stats = None
+            if artifact_store:
+                try:
+                    with ArtifactStore(artifact_store, module.params["artifact_store_mode"]) as store:
+                        # What the install adds to im_shared, the seeded artifacts
+                        # included, is the manifest of its offerings
+                        shared_before = tree_files(im_shared)
+                        manifests = [store.manifest(offering_id, version or (versions or {}).get(offering_id))
+                                     for offering_id, version, features in missing]
+                        manifests = [manifest for manifest in manifests if manifest]
+                        artifact_store_stats = dict(
+                            imported=[store.add_tree(seed) for seed in module.params["artifact_store_seed"]],
+                            manifests=manifests,
+                            seeded=store.seed_tree(im_shared, manifests)
+                        )
+                except (IOError, OSError) as e:
+                    module.fail_json(msg="Seeding {0} from {1} failed: {2}".format(im_shared, artifact_store, e))
+            result = run_command(
+                "{0}/eclipse/tools/imcl install {1} "
+                "-repositories {2} "
+                "-installationDirectory {3} "
+                "-sharedResourcesDirectory {4} "
+                "-acceptLicense "
+                "-showProgress "
+                "-properties user.ihs.httpPort={5}".format(
                     ibmim,
                     offering,
                     repo,
                     dest,
                     im_shared,
                     ihs_port
-                 )],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                ),
+                log=log_file(logdir, "wasnd_install"),
+                progress=True,
+                timeout=module.params["timeout"]
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if result.rc != 0:
                 module.fail_json(
-                    msg="WAS ND install failed",
-                    stdout=stdout_value,
-                    stderr=stderr_value
+                    msg=result.failure_msg("WAS ND install failed"),
+                    **result.as_dict()
                 )
+            if artifact_store:
+                try:
+                    installed = [imcl_offering(package["id"], package["version"])
+                                 for package in find_installed(installed_packages(ibmim, module), location=dest)
+                                 if package["id"] in [offering_id for offering_id, version, features in missing]]
+                    with ArtifactStore(artifact_store, module.params["artifact_store_mode"]) as store:
+                        artifact_store_stats["deduplicated"] = store.add_tree(
+                            im_shared, installed, tree_files(im_shared) - shared_before)
+                        artifact_store_stats["recorded"] = installed
+                except (IOError, OSError) as e:
+                    module.fail_json(
+                        msg="WAS ND installed but deduplicating {0} failed: {1}".format(im_shared, e),
+                        **result.as_dict()
+                    )
             module.exit_json(
                 changed=True,
                 msg="WAS ND installed successfully",
-                stdout=stdout_value
+                offerings=offering.split(" "),
+                versions=versions,
+                updates=updates,
+                repo_cache=repo_cache_stats,
+                artifact_store=artifact_store_stats,
+                **result.as_dict()
             )
         else:
             module.exit_json(changed=False, msg="WAS ND already installed")
@@ -209,7 +448,7 @@ def main():
                     changed=False,
                     msg="module would not run {0} does not exist".format(eclipse_dir)
                 )
-            elif was_is_installed(ibmim, offering):
+            elif len(missing_offerings(module, ibmim, requested, dest)) < len(requested):
                 module.exit_json(
                     changed=True,
                     msg="WAS ND would be uninstalled"
@@ -220,44 +459,56 @@ def main():
                     msg="WAS ND already uninstalled"
                 )
         raise_on_path_not_exist(eclipse_dir)
-        if not os.path.exists(logdir) and not os.listdir(logdir):
-            os.makedirs(logdir)
-        if was_is_installed(ibmim, offering):
-            logfile = "{0}_wasnd_{1}.xml".format(
-                platform.node(),
-                datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            )
-            child = subprocess.Popen(
-                ["{0}/eclipse/IBMIM "
-                 "--launcher.ini {0}/eclipse/silent-install.ini "
-                 "-input {1}/uninstall/uninstall.xml "
-                 "-log {2}/{3}".format(
+        if len(missing_offerings(module, ibmim, requested, dest)) < len(requested):
+            # Uninstall everything Installation Manager has in dest since
+            # the whole directory is removed afterwards
+            installed = sorted(set([
+                package["id"] for package in find_installed(installed_packages(ibmim, module), location=dest)
+            ]))
+            log = log_file(logdir, "wasnd_uninstall")
+            result = run_command(
+                "{0}/eclipse/tools/imcl uninstall {1} "
+                "-installationDirectory {2} "
+                "-log {3}".format(
                     ibmim,
+                    " ".join(installed),
                     dest,
-                    logdir,
-                    logfile
-                 )],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                    re.sub(r"\.log$", ".xml", log)
+                ),
+                log=log,
+                timeout=module.params["timeout"]
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if result.rc != 0:
                 module.fail_json(
-                    msg="WAS ND uninstall failed",
-                    stdout=stdout_value,
-                    stderr=stderr_value
+                    msg=result.failure_msg("WAS ND uninstall failed"),
+                    **result.as_dict()
                 )
-            shutil.rmtree(dest, ignore_errors=False, onerror=None)
+            removed_files = 0
+            if os.path.exists(dest):
+                try:
+                    removed_files = remove_installation(dest, remove_workers)[0]
+                except OSError as e:
+                    module.fail_json(
+                        msg="WAS ND uninstalled but removing {0} failed: {1}".format(dest, e),
+                        **result.as_dict()
+                    )
             module.exit_json(
                 changed=True,
                 msg="WAS ND uninstalled successfully",
-                stdout=stdout_value
+                offerings=installed,
+                removed_files=removed_files,
+                **result.as_dict()
             )
         else:
             module.exit_json(changed=False, msg="WAS ND already uninstalled")
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_im import find_installed, imcl_offering, \
+    installed_packages, offering_installed, offering_specs, parse_offering_spec, parse_version
+from ansible.module_utils.websphere_fs import STORE_MODES, ArtifactStore, remove_installation, tree_files
+from ansible.module_utils.websphere_repo import RepositoryError, imcl_repository_index, \
+    latest_version, mirror_repository, repository_index, resolve_offerings
+from ansible.module_utils.websphere_process import log_file, run_command
 if __name__ == "__main__":
     main()
@@ -1,10 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
-import platform
-import datetime
-import shutil
+import re
 
 
 DOCUMENTATION = """
@@ -21,9 +18,10 @@ options:
   state:
     required: false
     default: "present"
-    choices: ["present", "absent"]
+    choices: ["present", "absent", "latest"]
     description:
       - Make sure IBM WebSphere Extreme Scale Server is present or absent
+      - latest updates the offering to the latest version in the repository
   ibmim:
     required: false
     default: "/opt/IBM/InstallationManager"
@@ -42,6 +40,14 @@ options:
     required: true
     description:
       - URL or path to the installation repository used by Installation Manager to install WebSphere products
+  repo_cache:
+    required: false
+    description:
+      - Local or shared directory the repository is staged into before installing
+      - Only new or changed artifacts are copied. Cached artifacts whose size or mtime
+        changed are validated against their SHA-256 digest before they are reused
+      - The artifacts of an HTTP repository are read from its repository.xml and the
+        offering metadata, its directory listings are only used without repository.xml
   offering:
     required: false
     default: "com.ibm.websphere.WXS.v86"
@@ -50,32 +56,36 @@ options:
               "com.ibm.websphere.WXSCLIENT.was7.v86", "com.ibm.websphere.WXSCLIENT.was8.v86"]
     description:
       - Name of the offering which you want to install
+  version:
+    required: false
+    description:
+      - Version, or leading part of a version, of the offering if it is not pinned to a version
+      - With state=latest the latest version matching it is installed
   logdir:
     required: false
     default: "/var/log/IBM/ExtremeScale"
     description:
       - Path of installation log file
+  timeout:
+    required: false
+    description:
+      - Seconds after which imcl is killed, its process group gets SIGTERM
+        and 10 seconds later SIGKILL. The task then fails with timed_out set
+        and the output read so far. By default there is no timeout.
 """
 
 
-def xs_is_installed(ibmim, offering):
+def xs_is_installed(module, ibmim, offering, dest):
     """
     Checks if IBM WebSphere Extreme Scale Server is installed
 
+    :param module: Ansible module, failed when imcl has to list the packages and times out
     :param ibmim: IBM Installation Manager installation directory
     :param offering: Name of the offering which you want to install
+    :param dest: Installation directory of IBM WebSphere Extreme Scale Server
     :return: True for installed or False for not installed
     """
-    child = subprocess.Popen(
-        ["{0}/eclipse/tools/imcl listInstalledPackages".format(ibmim)],
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stdout_value, stderr_value = child.communicate()
-    if stdout_value.find(offering) < 0:
-        return False
-    return True
+    return offering_installed(ibmim, offering, dest, module=module)
 
 
 def main():
@@ -95,83 +105,184 @@ def main():
 
     module = AnsibleModule(
         argument_spec=dict(
-            state=dict(default="present", choices=["present", "absent"]),
+            state=dict(default="present", choices=["present", "absent", "latest"]),
             ibmim=dict(required=False, default="/opt/IBM/InstallationManager"),
             dest=dict(required=False, default="/opt/IBM/ExtremeScale"),
             repo=dict(required=True),
+            repo_cache=dict(required=False),
             offering=dict(default="com.ibm.websphere.WXS.v86", choices=offerings),
-            logdir=dict(required=False, default="/var/log/IBM/ExtremeScale")
-        )
+            version=dict(required=False),
+            logdir=dict(required=False, default="/var/log/IBM/ExtremeScale"),
+            timeout=dict(required=False, type="int")
+        ),
+        supports_check_mode=True
     )
 
     state = module.params["state"]
     ibmim = module.params["ibmim"]
     dest = module.params["dest"]
     repo = module.params["repo"]
+    repo_cache = module.params["repo_cache"]
     offering = module.params["offering"]
+    if module.params["version"] and not split_offering(offering)[1]:
+        offering = imcl_offering(offering, module.params["version"])
     logdir = module.params["logdir"]
 
     if not os.path.exists("{0}/eclipse".format(ibmim)):
         module.fail_json(msg="{0}/eclipse not found".format(ibmim))
 
-    if state == "present":
-        if not xs_is_installed(ibmim, offering):
-            child = subprocess.Popen(
-                ["{0}/eclipse/tools/imcl install {1} "
-                 "-repositories {2} "
-                 "-installationDirectory {3} "
-                 "-acceptLicense".format(
-                    ibmim,
-                    offering,
-                    repo,
-                    dest
-                 )],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+    def resolve_version(required=False):
+        """
+        Fails the module if the repository does not provide the offering
+
+        :param required: Fall back to imcl if the repository can not be indexed directly
+        :return: Version which would be installed or None if the repository can not be indexed
+        """
+        try:
+            index = repository_index(module, repo, repo_cache)
+        except (RepositoryError, IOError, OSError):
+            index = None
+        if required and (index is None or not index["offerings"]):
+            try:
+                index = imcl_repository_index(ibmim, repo)
+            except RepositoryError as e:
+                module.fail_json(msg="state=latest needs the versions in the repository: {0}".format(e))
+        if index is None or not index["offerings"]:
+            return None
+        offering_id, version = split_offering(offering)[:2]
+        resolved, unavailable = resolve_offerings(index, [(offering_id, version, [])])
+        if unavailable:
+            module.fail_json(
+                msg="{0} does not provide {1}".format(repo, offering),
+                unavailable=unavailable
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
-                module.fail_json(
-                    msg="XS install failed",
-                    stdout=stdout_value,
-                    stderr=stderr_value
-                )
-            module.exit_json(changed=True, msg="XS installed successfully", stdout=stdout_value)
+        return resolved[offering_id]
+
+    def install(offering, version, installed=None):
+        """
+        Installs or updates the offering with imcl and exits the module
+
+        :param offering: Offering argument for imcl
+        :param version: Version which is installed
+        :param installed: Version which is currently installed
+        :return: None
+        """
+        repo_path = repo
+        repo_cache_stats = None
+        if repo_cache:
+            try:
+                repo_path, repo_cache_stats = mirror_repository(module, repo, repo_cache)
+            except (RepositoryError, IOError, OSError) as e:
+                module.fail_json(msg="Staging repository {0} failed: {1}".format(repo, e))
+        result = run_command(
+            "{0}/eclipse/tools/imcl install {1} "
+            "-repositories {2} "
+            "-installationDirectory {3} "
+            "-acceptLicense "
+            "-showProgress".format(
+                ibmim,
+                offering,
+                repo_path,
+                dest
+            ),
+            log=log_file(logdir, "xs_install"),
+            progress=True,
+            timeout=module.params["timeout"]
+        )
+        if result.rc != 0:
+            module.fail_json(
+                msg=result.failure_msg("XS install failed"),
+                **result.as_dict()
+            )
+        module.exit_json(
+            changed=True,
+            msg="XS installed successfully" if installed is None else "XS updated successfully",
+            version=version,
+            installed=installed,
+            repo_cache=repo_cache_stats,
+            **result.as_dict()
+        )
+
+    if state == "present":
+        if module.check_mode:
+            if xs_is_installed(module, ibmim, offering, dest):
+                module.exit_json(changed=False, msg="XS already installed")
+            module.exit_json(changed=True, msg="XS would be installed", version=resolve_version())
+        if not xs_is_installed(module, ibmim, offering, dest):
+            version = resolve_version()
+            if version is None:
+                install(offering, version)
+            # imcl needs the exact version, not the leading part the playbook may give
+            offering_id, pinned, features = split_offering(offering)
+            install(imcl_offering(offering_id, version, features), version)
         else:
             module.exit_json(changed=False, msg="XS already installed")
 
-    if state == "absent":
-        if not os.path.exists(logdir) and not os.listdir(logdir):
-            os.makedirs(logdir)
-        if xs_is_installed(ibmim, offering):
-            logfile = "{0}_xs_{1}.xml".format(
-                platform.node(),
-                datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    if state == "latest":
+        target = resolve_version(required=True)
+        offering_id = split_offering(offering)[0]
+        installed = [
+            package["version"] for package in
+            find_installed(installed_packages(ibmim, module), offering_id, location=dest)
+        ]
+        current = max(installed, key=parse_version) if installed else None
+        if current is not None and parse_version(current) >= parse_version(target):
+            module.exit_json(changed=False, msg="XS already at the latest version", version=current)
+        if module.check_mode:
+            module.exit_json(
+                changed=True,
+                msg="XS would be installed" if current is None else "XS would be updated",
+                version=target,
+                installed=current
             )
-            child = subprocess.Popen(
-                ["{0}/eclipse/tools/imcl uninstall {1} "
-                 "-installationDirectory {2} "
-                 "-log {3}/{4}".format(
+        install(imcl_offering(offering_id, target), target, current)
+
+    if state == "absent":
+        if module.check_mode:
+            if xs_is_installed(module, ibmim, offering, dest):
+                module.exit_json(changed=True, msg="XS would be uninstalled")
+            module.exit_json(changed=False, msg="XS already uninstalled")
+        if xs_is_installed(module, ibmim, offering, dest):
+            log = log_file(logdir, "xs_uninstall")
+            result = run_command(
+                "{0}/eclipse/tools/imcl uninstall {1} "
+                "-installationDirectory {2} "
+                "-log {3}".format(
                     ibmim,
                     offering,
                     dest,
-                    logdir,
-                    logfile
-                 )],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                    re.sub(r"\.log$", ".xml", log)
+                ),
+                log=log,
+                timeout=module.params["timeout"]
+            )
+            if result.rc != 0:
+                module.fail_json(msg=result.failure_msg("XS uninstall failed"), **result.as_dict())
+            removed_files = 0
+            if os.path.exists(dest):
+                try:
+                    removed_files = remove_installation(dest)[0]
+                except OSError as e:
+                    module.fail_json(
+                        msg="XS uninstalled but removing {0} failed: {1}".format(dest, e),
+                        **result.as_dict()
+                    )
+            module.exit_json(
+                changed=True,
+                msg="XS uninstalled successfully",
+                removed_files=removed_files,
+                **result.as_dict()
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
-                module.fail_json(msg="XS uninstall failed", stdout=stdout_value, stderr=stderr_value)
-            shutil.rmtree(dest, ignore_errors=False, onerror=None)
-            module.exit_json(changed=True, msg="XS uninstalled successfully", stdout=stdout_value)
         else:
             module.exit_json(changed=False, msg="XS already uninstalled")
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_im import find_installed, imcl_offering, installed_packages, \
+    offering_installed, parse_version, split_offering
+from ansible.module_utils.websphere_repo import RepositoryError, imcl_repository_index, \
+    mirror_repository, repository_index, resolve_offerings
+from ansible.module_utils.websphere_process import log_file, run_command
+from ansible.module_utils.websphere_fs import remove_installation
 if __name__ == "__main__":
     main()
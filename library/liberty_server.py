@@ -1,7 +1,6 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
 import platform
 import datetime
 
@@ -28,6 +27,13 @@ options:
     required: true
     description:
       - Path to binary files of the application server
+  timeout:
+    required: false
+    description:
+      - Seconds after which the server script is killed, its process group
+        gets SIGTERM and 10 seconds later SIGKILL. The task then fails with
+        timed_out set and the output read so far. By default there is no
+        timeout.
 """
 
 
@@ -41,7 +47,8 @@ def main():
         argument_spec=dict(
             state=dict(default="started", choices=["started", "stopped"]),
             name=dict(required=True),
-            libertydir=dict(required=True)
+            libertydir=dict(required=True),
+            timeout=dict(required=False, type="int")
         )
     )
 
@@ -53,48 +60,41 @@ def main():
         module.fail_json(msg="{0} does not exists".format(libertydir))
 
     if state == "stopped":
-        child = subprocess.Popen(
-            ["{0}/bin/server stop {1}".format(libertydir, name)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        result = run_command(
+            "{0}/bin/server stop {1}".format(libertydir, name),
+            timeout=module.params["timeout"]
         )
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            if not stderr_value.find("is not running") < 0:
+        if result.rc != 0:
+            if result.timed_out or not result.stderr.find("is not running") < 0:
                 module.fail_json(
-                    msg="{0} stop failed".format(name),
-                    stdout=stdout_value,
-                    stderr=stderr_value
+                    msg=result.failure_msg("{0} stop failed".format(name)),
+                    **result.as_dict()
                 )
         module.exit_json(
             changed=True,
             msg="{0} stopped successfully".format(name),
-            stdout=stdout_value
+            stdout=result.stdout
         )
 
     if state == "started":
-        child = subprocess.Popen(
-            ["{0}/bin/server start {1}".format(libertydir, name)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        result = run_command(
+            "{0}/bin/server start {1}".format(libertydir, name),
+            timeout=module.params["timeout"]
         )
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            if not stderr_value.find("is running with process") < 0:
+        if result.rc != 0:
+            if result.timed_out or not result.stderr.find("is running with process") < 0:
                 module.fail_json(
-                    msg="{0} start failed".format(name),
-                    stdout=stdout_value,
-                    stderr=stderr_value
+                    msg=result.failure_msg("{0} start failed".format(name)),
+                    **result.as_dict()
                 )
         module.exit_json(
             changed=True,
             msg="{0} started successfully".format(name),
-            stdout=stdout_value
+            stdout=result.stdout
         )
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_process import run_command
 if __name__ == "__main__":
     main()
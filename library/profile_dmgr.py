@@ -3,7 +3,6 @@
 import os
 import pwd
 import grp
-import subprocess
 import platform
 import datetime
 
@@ -63,6 +62,13 @@ options:
     required: false
     description:
       - Service username
+  timeout:
+    required: false
+    description:
+      - Seconds after which manageprofiles.sh is killed, its process group gets
+        SIGTERM and 10 seconds later SIGKILL. The task then fails with
+        timed_out set and the output read so far. By default there is no
+        timeout.
 """
 
 RETURN = """
@@ -84,24 +90,17 @@ stderr:
 """
 
 
-def profile_exist(name, wasdir):
+def profile_exist(module, name, wasdir):
     """
-    Checks if WAS Deployment Manager profile exists
+    Checks if WAS Deployment Manager profile exists. The profile name has to match
+    exactly.
 
+    :param module: Ansible module, failed when manageprofiles.sh has to list the profiles and times out
     :param name: Profile name
     :param wasdir: Path to installation location of WAS
-    :return: True for exists or False for not exists
+    :return: Dictionary with name, path, template and is_default of the profile or None for not exists
     """
-    child = subprocess.Popen(
-        ["{0}/bin/manageprofiles.sh -listProfiles".format(wasdir)],
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stdout_value, stderr_value = child.communicate()
-    if stdout_value.find(name) < 0:
-        return False
-    return True
+    return find_profile(wasdir, name, module)
 
 
 def chown_user_wasdir(service_username, wasdir):
@@ -140,6 +139,7 @@ def main():
             password=dict(required=False, default="wasadmin"),
             enable_service=dict(required=False, default=False, type="bool"),
             service_username=dict(required=False),
+            timeout=dict(required=False, type="int")
         ),
         supports_check_mode=True
     )
@@ -172,7 +172,7 @@ def main():
                     changed=False,
                     msg="module would not run {0} does not exist".format(wasdir)
                 )
-            elif profile_exist(name, wasdir):
+            elif profile_exist(module, name, wasdir):
                 module.exit_json(
                     changed=False,
                     msg="{0} profile already exist".format(name)
@@ -183,7 +183,7 @@ def main():
                     msg="{0} profile would be created".format(name)
                 )
         raise_on_path_not_exist(wasdir)
-        if not profile_exist(name, wasdir):
+        if not profile_exist(module, name, wasdir):
             if enable_service:
                 if not service_username:
                     module.fail_json(
@@ -231,25 +231,23 @@ def main():
                          username,
                          password
                       )
-            child = subprocess.Popen(
-                [cmd],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+            result = run_command(
+                cmd,
+                log=log_file("{0}/logs/manageprofiles".format(wasdir), "{0}_create".format(name)),
+                timeout=module.params["timeout"],
+                secrets=[password]
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if result.rc != 0:
                 module.fail_json(
-                    msg="Dmgr profile creation failed",
-                    stdout=stdout_value,
-                    stderr=stderr_value
+                    msg=result.failure_msg("Dmgr profile creation failed"),
+                    **result.as_dict()
                 )
             if enable_service:
                 chown_user_wasdir(service_username, wasdir)
             module.exit_json(
                 changed=True,
                 msg="{0} profile created successfully".format(name),
-                stdout=stdout_value
+                **result.as_dict()
             )
         else:
             module.exit_json(changed=False, msg="{0} profile already exist".format(name))
@@ -261,7 +259,7 @@ def main():
                     changed=False,
                     msg="module would not run {0} does not exist".format(wasdir)
                 )
-            elif profile_exist(name, wasdir):
+            elif profile_exist(module, name, wasdir):
                 module.exit_json(
                     changed=True,
                     msg="{0} profile would be removed".format(name)
@@ -272,14 +270,17 @@ def main():
                     msg="{0} profile already removed".format(name)
                 )
         raise_on_path_not_exist(wasdir)
-        if profile_exist(name, wasdir):
-            child = subprocess.Popen(
-                ["{0}/bin/manageprofiles.sh -delete -profileName {1}".format(wasdir, name)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+        if profile_exist(module, name, wasdir):
+            result = run_command(
+                "{0}/bin/manageprofiles.sh -delete -profileName {1}".format(wasdir, name),
+                log=log_file("{0}/logs/manageprofiles".format(wasdir), "{0}_delete".format(name)),
+                timeout=module.params["timeout"]
             )
-            stdout_value, stderr_value = child.communicate()
+            if result.timed_out:
+                module.fail_json(
+                    msg=result.failure_msg("{0} profile removal failed".format(name)),
+                    **result.as_dict()
+                )
             # Creation of a profile with the same name will fail if the
             # directory is not empty. So we better remove the dir forcefully.
             shutil.rmtree(
@@ -290,13 +291,14 @@ def main():
             module.exit_json(
                 changed=True,
                 msg="{0} profile removed successfully".format(name),
-                stdout=stdout_value,
-                stderr=stderr_value
+                **result.as_dict()
             )
         else:
             module.exit_json(changed=False, msg="{0} profile already removed".format(name))
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_process import log_file, run_command
+from ansible.module_utils.websphere_profile import find_profile
 if __name__ == "__main__":
     main()
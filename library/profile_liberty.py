@@ -1,7 +1,6 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
 
 
 DOCUMENTATION = """
@@ -27,6 +26,13 @@ options:
     required: true
     description:
       - Name of the profile
+  timeout:
+    required: false
+    description:
+      - Seconds after which the server script is killed, its process group
+        gets SIGTERM and 10 seconds later SIGKILL. The task then fails with
+        timed_out set and the output read so far. By default there is no
+        timeout.
 """
 
 RETURN = """
@@ -59,6 +65,7 @@ def main():
             state=dict(default="present", choices=["present", "absent"]),
             libertydir=dict(default="/opt/IBM/Liberty", required=True),
             name=dict(required=True),
+            timeout=dict(required=False, type="int")
         ),
         supports_check_mode=True
     )
@@ -96,23 +103,19 @@ def main():
                     msg="{0} server would be created".format(name)
                 )
         raise_on_path_not_exist(libertydir)
-        child = subprocess.Popen(
-            ["{0}/bin/server create {1}".format(libertydir, name)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        result = run_command(
+            "{0}/bin/server create {1}".format(libertydir, name),
+            timeout=module.params["timeout"]
         )
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        if result.rc != 0:
             module.fail_json(
-                msg="Failed to create liberty server {0}".format(name),
-                stdout=stdout_value,
-                stderr=stderr_value
+                msg=result.failure_msg("Failed to create liberty server {0}".format(name)),
+                **result.as_dict()
             )
         module.exit_json(
             changed=True,
             msg="{0} server created successfully".format(name),
-            stdout=stdout_value
+            stdout=result.stdout
         )
 
     if state == "absent":
@@ -150,5 +153,6 @@ def main():
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_process import run_command
 if __name__ == "__main__":
     main()
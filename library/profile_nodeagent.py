@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 import os
 import pwd
-import subprocess
 import platform
 import datetime
 
@@ -78,6 +77,56 @@ options:
     required: false
     description:
       - Service username
+  timeout:
+    required: false
+    description:
+      - Seconds after which manageprofiles.sh, addNode.sh, removeNode.sh,
+        wasservice.sh and wsadmin are killed, their process group gets
+        SIGTERM and 10 seconds later SIGKILL. The task then fails with
+        timed_out set and the output read so far. By default there is no
+        timeout.
+  node_cache_dir:
+    required: false
+    default: "~/.ansible/websphere/nodes"
+    description:
+      - Directory of the node lists of the deployment managers, which may be
+        shared by several hosts
+  node_cache_ttl:
+    required: false
+    default: 300
+    description:
+      - Seconds a cached node list is used instead of asking the deployment
+        manager with wsadmin, 0 disables the cache. A list read from the
+        configuration repository of a deployment manager profile on this
+        host is always current.
+  java_shareclasses:
+    required: false
+    description:
+      - Name of an IBM J9 shared class cache for the JVM of wsadmin, which
+        lists the nodes of the deployment manager, passed as -Xshareclasses
+  java_shareclasses_dir:
+    required: false
+    default: "~/.ansible/wsadmin/javasharedresources"
+    description:
+      - Directory of the shared class cache, created if it does not exist
+  java_quickstart:
+    required: false
+    default: false
+    description:
+      - Start the wsadmin JVM with -Xquickstart
+  java_initial_heap:
+    required: false
+    description:
+      - Initial heap size of the wsadmin JVM, for example 64m
+  java_max_heap:
+    required: false
+    description:
+      - Maximum heap size of the wsadmin JVM, for example 256m
+  jython_cache_dir:
+    required: false
+    description:
+      - Directory in which Jython caches the package index of the WebSphere
+        jars, created if it does not exist
 """
 
 RETURN = """
@@ -96,61 +145,163 @@ stderr:
     returned: failure, when needed
     type: string
     sample: "Some command execution error output"
+timed_out:
+    description: whether a command was killed because it ran into the timeout
+    returned: when it timed out
+    type: bool
 """
 
 
-def profile_exist(name, wasdir):
+# Templates of deployment manager profiles, management since WAS 7
+DMGR_TEMPLATES = ["management", "dmgr"]
+DMGR_NODE_MARKER = "@@ansible-dmgr-node@@ "
+# The node of the deployment manager tells a node list from the output of a failed login
+LIST_NODES_CODE = 'print "{0}" + AdminControl.getNode(); print AdminTask.listNodes()'.format(DMGR_NODE_MARKER)
+
+
+def profile_exist(module, name, wasdir):
     """
-    Checks if WAS Node Agent profile exists
+    Checks if WAS Node Agent profile exists. The profile name has to match
+    exactly.
 
+    :param module: Ansible module, failed when manageprofiles.sh has to list the profiles and times out
     :param name: Profile name
     :param wasdir: Path to installation location of WAS
-    :return: True for exists or False for not exists
+    :return: Dictionary with name, path, template and is_default of the profile or None for not exists
     """
-    child = subprocess.Popen(
-        ["{0}/bin/manageprofiles.sh -listProfiles".format(wasdir)],
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stdout_value, stderr_value = child.communicate()
-    if stdout_value.find(name) < 0:
-        return False
-    return True
+    return find_profile(wasdir, name, module)
 
 
-def node_added(node_name, wasdir, dmgr_host, username, password):
+def local_dmgr_nodes(module, wasdir, dmgr_host, dmgr_port):
     """
-    Check if the Node Agent was added to the Deployment Manager
+    Lists the nodes of the deployment manager from its configuration
+    repository when its profile is on this host
 
-    :param node_name: Name of the node
+    :param module: Ansible module, failed when manageprofiles.sh has to list the profiles and times out
     :param wasdir: Path to installation location of WAS
     :param dmgr_host: Deployment manager host name
+    :param dmgr_port: Deployment manager SOAP port
+    :return: List of node names or None if the deployment manager profile is not local
+    """
+    for profile in registered_profiles(wasdir, module).values():
+        if profile["path"] and os.path.basename(profile["template"] or "") in DMGR_TEMPLATES:
+            nodes = dmgr_nodes(profile["path"], dmgr_host, dmgr_port)
+            if nodes is not None:
+                return nodes
+    return None
+
+
+def wsadmin_nodes(module, wasdir, dmgr_host, dmgr_port, username, password):
+    """
+    Lists the nodes of the deployment manager with wsadmin. A running wsadmin
+    worker for the deployment manager answers this without starting a new
+    wsadmin.
+
+    :param module: Ansible module, fails when wsadmin fails or times out
+    :param wasdir: Path to installation location of WAS
+    :param dmgr_host: Deployment manager host name
+    :param dmgr_port: Deployment manager SOAP port
     :param username: WAS user name
     :param password: WAS user password
-    :return: True for exists or False for not exists
+    :return: Tuple of the list of node names and the source, worker or wsadmin
     """
-    child = subprocess.Popen(
-        ["echo -ne 'y \n' | "
-         "{0}/bin/wsadmin.sh "
-         "-host {1} "
-         "-lang jython "
-         "-username {2} "
-         "-password {3} "
-         "-c 'print AdminTask.listNodes()'".format(
+    try:
+        rc, output = worker_execute(
+            worker_state_file(DEFAULT_WORKER_DIR, dmgr_host, dmgr_port, username),
+            LIST_NODES_CODE + "\n",
+            module.params["timeout"]
+        )
+        nodes = node_names(output)
+        if rc == 0 and nodes is not None:
+            return nodes, "worker"
+    except (WorkerUnavailable, WorkerError):
+        # A busy worker may be running someone else's request, a new
+        # wsadmin still gets the whole timeout
+        pass
+    # wsadmin asks whether to trust the certificate of a new deployment manager
+    result = run_command(
+        "{0}/bin/wsadmin.sh "
+        "-host {1} "
+        "-lang jython "
+        "-username {2} "
+        "-password {3} "
+        "{4} "
+        "-c '{5}'".format(
             wasdir,
             dmgr_host,
             username,
-            password
-         )],
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+            password,
+            java_options(module.params),
+            LIST_NODES_CODE
+        ),
+        tail_lines=None,
+        timeout=module.params["timeout"],
+        stdin_data="y\n"
     )
-    stdout_value, stderr_value = child.communicate()
-    if stdout_value.find(node_name) < 0:
-        return False
-    return True
+    nodes = node_names(result.stdout)
+    if result.rc != 0 or nodes is None:
+        # Without the node list a federated node would be taken for a
+        # new one, or removed from the disk while it is still in the cell
+        module.fail_json(
+            msg=result.failure_msg("Listing the nodes of {0} failed".format(dmgr_host)),
+            **dict(result.as_dict(), rc=result.rc)
+        )
+    return nodes, "wsadmin"
+
+
+def node_names(output):
+    """
+    Picks the node names from the output of LIST_NODES_CODE.
+    AdminTask.listNodes() prints one name per line between the messages of
+    wsadmin. The list is only complete when it holds the node of the
+    deployment manager itself.
+
+    :param output: Output of wsadmin
+    :return: List of node names or None if the output holds no complete list
+    """
+    dmgr_node = None
+    nodes = []
+    for line in output.splitlines():
+        if line.startswith(DMGR_NODE_MARKER):
+            dmgr_node = line[len(DMGR_NODE_MARKER):].strip()
+        elif line.strip() and len(line.split()) == 1:
+            nodes.append(line.strip())
+    if dmgr_node not in nodes:
+        return None
+    return nodes
+
+
+def node_added(module, node_name, wasdir, dmgr_host, dmgr_port, username, password):
+    """
+    Check if the Node Agent was added to the Deployment Manager. The node
+    list is read from the configuration repository of the deployment manager
+    when its profile is on this host, otherwise from the node cache as long
+    as it is younger than node_cache_ttl, and only then from wsadmin.
+
+    :param module: Ansible module, fails when wsadmin times out
+    :param node_name: Name of the node
+    :param wasdir: Path to installation location of WAS
+    :param dmgr_host: Deployment manager host name
+    :param dmgr_port: Deployment manager SOAP port
+    :param username: WAS user name
+    :param password: WAS user password
+    :return: True for exists or False for not exists
+    """
+    ttl = module.params["node_cache_ttl"]
+    cache_file = node_cache_file(module.params["node_cache_dir"], dmgr_host, dmgr_port)
+    nodes = local_dmgr_nodes(module, wasdir, dmgr_host, dmgr_port)
+    if nodes is not None:
+        if ttl:
+            write_node_cache(cache_file, nodes, "config")
+        return node_name in nodes
+    if ttl:
+        cached = read_node_cache(cache_file, ttl)
+        if cached is not None:
+            return node_name in cached["nodes"]
+    nodes, source = wsadmin_nodes(module, wasdir, dmgr_host, dmgr_port, username, password)
+    if ttl:
+        write_node_cache(cache_file, nodes, source)
+    return node_name in nodes
 
 
 def chown_user_wasdir(service_username, wasdir):
@@ -193,6 +344,10 @@ def main():
             federate=dict(required=False, default=False, type="bool"),
             enable_service=dict(required=False, default=False, type="bool"),
             service_username=dict(required=False),
+            timeout=dict(required=False, type="int"),
+            node_cache_dir=dict(required=False, default=DEFAULT_NODE_CACHE_DIR),
+            node_cache_ttl=dict(required=False, default=DEFAULT_NODE_CACHE_TTL, type="int"),
+            **java_argument_spec()
         ),
         supports_check_mode=True
     )
@@ -211,6 +366,9 @@ def main():
     federate = module.params["federate"]
     enable_service = module.params["enable_service"]
     service_username = module.params["service_username"]
+    timeout = module.params["timeout"]
+    node_cache_ttl = module.params["node_cache_ttl"]
+    cache_file = node_cache_file(module.params["node_cache_dir"], dmgr_host, dmgr_port)
 
     def raise_on_path_not_exist(path):
         """
@@ -229,7 +387,7 @@ def main():
                     changed=False,
                     msg="module would not run {0} does not exist".format(wasdir)
                 )
-            elif profile_exist(name, wasdir):
+            elif profile_exist(module, name, wasdir):
                 module.exit_json(
                     changed=False,
                     msg="{0} profile already exist".format(name)
@@ -240,18 +398,18 @@ def main():
                     msg="{0} profile would be created".format(name)
                 )
         raise_on_path_not_exist(wasdir)
-        if not profile_exist(name, wasdir):
-            child = subprocess.Popen(
-                ["{0}/bin/manageprofiles.sh -create "
-                 "-profileName {1} "
-                 "-profilePath {0}/profiles/{1} "
-                 "-templatePath {0}/profileTemplates/{2} "
-                 "-cellName {3} "
-                 "-hostName {4} "
-                 "-nodeName {5} "
-                 "-enableAdminSecurity true "
-                 "-adminUserName {6} "
-                 "-adminPassword {7}".format(
+        if not profile_exist(module, name, wasdir):
+            result = run_command(
+                "{0}/bin/manageprofiles.sh -create "
+                "-profileName {1} "
+                "-profilePath {0}/profiles/{1} "
+                "-templatePath {0}/profileTemplates/{2} "
+                "-cellName {3} "
+                "-hostName {4} "
+                "-nodeName {5} "
+                "-enableAdminSecurity true "
+                "-adminUserName {6} "
+                "-adminPassword {7}".format(
                     wasdir,
                     name,
                     template,
@@ -260,124 +418,112 @@ def main():
                     node_name,
                     username,
                     password
-                 )],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                ),
+                log=log_file("{0}/logs/manageprofiles".format(wasdir), "{0}_create".format(name)),
+                timeout=timeout,
+                secrets=[password]
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if result.rc != 0:
                 module.fail_json(
-                    msg="Nodeagent profile creation failed",
-                    stdout=stdout_value,
-                    stderr=stderr_value
+                    msg=result.failure_msg("Nodeagent profile creation failed"),
+                    **result.as_dict()
                 )
+            stdout_value = result.stdout
             chown_user_wasdir(service_username, wasdir)
 
-            if federate and not node_added(node_name, wasdir, dmgr_host, username, password):
-                child = subprocess.Popen(
-                    ["{0}/bin/addNode.sh {1} {2} "
-                     "-conntype SOAP "
-                     "-username {3} "
-                     "-password {4} "
-                     "-profileName {5}".format(
+            if federate and not node_added(module, node_name, wasdir, dmgr_host, dmgr_port, username, password):
+                node_result = run_command(
+                    "{0}/bin/addNode.sh {1} {2} "
+                    "-conntype SOAP "
+                    "-username {3} "
+                    "-password {4} "
+                    "-profileName {5}".format(
                         wasdir,
                         dmgr_host,
                         dmgr_port,
                         username,
                         password,
                         name
-                     )],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                    ),
+                    timeout=timeout
                 )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                if node_result.rc != 0:
                     module.fail_json(
-                        msg="Node federation failed",
-                        stdout=stdout_value,
-                        stderr=stderr_value
+                        msg=node_result.failure_msg("Node federation failed"),
+                        **node_result.as_dict()
                     )
+                if node_cache_ttl:
+                    update_node_cache(cache_file, added=node_name)
                 chown_user_wasdir(service_username, wasdir)
 
             if enable_service:
-                child = subprocess.Popen(
-                    ["{0}/bin/wasservice.sh "
-                     "-add nodeagent "
-                     "-serverName nodeagent "
-                     "-profilePath {0}/profiles/{1} "
-                     "-logRoot {0}/profiles/{1}/logs/nodeagent "
-                     "-restart true "
-                     "-startType automatic".format(
+                service_result = run_command(
+                    "{0}/bin/wasservice.sh "
+                    "-add nodeagent "
+                    "-serverName nodeagent "
+                    "-profilePath {0}/profiles/{1} "
+                    "-logRoot {0}/profiles/{1}/logs/nodeagent "
+                    "-restart true "
+                    "-startType automatic".format(
                         wasdir,
                         name
-                     )],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                    ),
+                    timeout=timeout
                 )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                if service_result.rc != 0:
                     module.fail_json(
-                        msg="Nodeagent service creation failed",
-                        stdout=stdout_value,
-                        stderr=stderr_value
+                        msg=service_result.failure_msg("Nodeagent service creation failed"),
+                        **service_result.as_dict()
                     )
             module.exit_json(
                 changed=True,
                 msg="{0} profile created successfully".format(name),
-                stdout=stdout_value
+                stdout=stdout_value,
+                log=result.log
             )
         else:
-            if federate and not node_added(node_name, wasdir, dmgr_host, username, password):
-                child = subprocess.Popen(
-                    ["{0}/bin/addNode.sh {1} {2} "
-                     "-conntype SOAP "
-                     "-username {3} "
-                     "-password {4} "
-                     "-profileName {5}".format(
+            if federate and not node_added(module, node_name, wasdir, dmgr_host, dmgr_port, username, password):
+                node_result = run_command(
+                    "{0}/bin/addNode.sh {1} {2} "
+                    "-conntype SOAP "
+                    "-username {3} "
+                    "-password {4} "
+                    "-profileName {5}".format(
                         wasdir,
                         dmgr_host,
                         dmgr_port,
                         username,
                         password,
                         name
-                     )],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                    ),
+                    timeout=timeout
                 )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                if node_result.rc != 0:
                     module.fail_json(
-                        msg="Node federation failed",
-                        stdout=stdout_value,
-                        stderr=stderr_value
+                        msg=node_result.failure_msg("Node federation failed"),
+                        **node_result.as_dict()
                     )
                     chown_user_wasdir(service_username, wasdir)
+                if node_cache_ttl:
+                    update_node_cache(cache_file, added=node_name)
                 if enable_service:
-                    child = subprocess.Popen(
-                        ["{0}/bin/wasservice.sh "
-                         "-add nodeagent "
-                         "-serverName nodeagent "
-                         "-profilePath {0}/profiles/{1} "
-                         "-logRoot {0}/profiles/{1}/logs/nodeagent "
-                         "-restart true "
-                         "-startType automatic".format(
+                    service_result = run_command(
+                        "{0}/bin/wasservice.sh "
+                        "-add nodeagent "
+                        "-serverName nodeagent "
+                        "-profilePath {0}/profiles/{1} "
+                        "-logRoot {0}/profiles/{1}/logs/nodeagent "
+                        "-restart true "
+                        "-startType automatic".format(
                             wasdir,
                             name
-                         )],
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE
+                        ),
+                        timeout=timeout
                     )
-                    stdout_value, stderr_value = child.communicate()
-                    if child.returncode != 0:
+                    if service_result.rc != 0:
                         module.fail_json(
-                            msg="Nodeagent service creation failed",
-                            stdout=stdout_value,
-                            stderr=stderr_value
+                            msg=service_result.failure_msg("Nodeagent service creation failed"),
+                            **service_result.as_dict()
                         )
                 module.exit_json(
                     changed=True,
@@ -389,71 +535,69 @@ def main():
             )
 
     if state == "absent":
-        if not os.path.exists(wasdir):
-            module.exit_json(
-                changed=False,
-                msg="module would not run {0} does not exist".format(wasdir)
-            )
-        elif profile_exist(name, wasdir):
-            module.exit_json(
-                changed=True,
-                msg="{0} profile would be removed".format(name)
-            )
-        else:
-            module.exit_json(
-                changed=True,
-                msg="{0} profile already removed".format(name)
-            )
+        if module.check_mode:
+            if not os.path.exists(wasdir):
+                module.exit_json(
+                    changed=False,
+                    msg="module would not run {0} does not exist".format(wasdir)
+                )
+            elif profile_exist(module, name, wasdir):
+                module.exit_json(
+                    changed=True,
+                    msg="{0} profile would be removed".format(name)
+                )
+            else:
+                module.exit_json(
+                    changed=True,
+                    msg="{0} profile already removed".format(name)
+                )
         raise_on_path_not_exist(wasdir)
-        if profile_exist(name, wasdir):
+        if profile_exist(module, name, wasdir):
             if enable_service:
-                child = subprocess.Popen(
-                    ["{0}/bin/wasservice.sh -remove nodeagent".format(wasdir)],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                service_result = run_command(
+                    "{0}/bin/wasservice.sh -remove nodeagent".format(wasdir),
+                    timeout=timeout
                 )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                if service_result.rc != 0:
                     module.fail_json(
-                        msg="Nodeagent service remove failed",
-                        stdout=stdout_value,
-                        stderr=stderr_value
+                        msg=service_result.failure_msg("Nodeagent service remove failed"),
+                        **service_result.as_dict()
                     )
-            if federate and node_added(node_name, wasdir, dmgr_host, username, password):
-                child = subprocess.Popen(
-                    ["{0}/bin/removeNode.sh {1} {2} "
-                     "-conntype SOAP "
-                     "-username {3} "
-                     "-password {4} "
-                     "-profileName {5}".format(
+            if federate and node_added(module, node_name, wasdir, dmgr_host, dmgr_port, username, password):
+                node_result = run_command(
+                    "{0}/bin/removeNode.sh {1} {2} "
+                    "-conntype SOAP "
+                    "-username {3} "
+                    "-password {4} "
+                    "-profileName {5}".format(
                         wasdir,
                         dmgr_host,
                         dmgr_port,
                         username,
                         password,
                         name
-                     )],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                    ),
+                    timeout=timeout
                 )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                if node_result.rc != 0:
                     module.fail_json(
-                        msg="Node remove failed",
-                        stdout=stdout_value,
-                        stderr=stderr_value
+                        msg=node_result.failure_msg("Node remove failed"),
+                        **node_result.as_dict()
                     )
-            child = subprocess.Popen(
-                ["{0}/bin/manageprofiles.sh "
-                 "-delete "
-                 "-profileName {1}".format(wasdir, name)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                if node_cache_ttl:
+                    update_node_cache(cache_file, removed=node_name)
+            result = run_command(
+                "{0}/bin/manageprofiles.sh "
+                "-delete "
+                "-profileName {1}".format(wasdir, name),
+                log=log_file("{0}/logs/manageprofiles".format(wasdir), "{0}_delete".format(name)),
+                timeout=timeout
             )
-            stdout_value, stderr_value = child.communicate()
+            if result.timed_out:
+                module.fail_json(
+                    msg=result.failure_msg("{0} profile removal failed".format(name)),
+                    **result.as_dict()
+                )
             # Creation of a profile with the same name will fail if the
             # directory is not empty. So we better remove the dir forcefully.
             shutil.rmtree(
@@ -464,13 +608,19 @@ def main():
             module.exit_json(
                 changed=True,
                 msg="{0} profile removed successfully".format(name),
-                stdout=stdout_value,
-                stderr=stderr_value
+                **result.as_dict()
             )
         else:
             module.exit_json(changed=False, msg="{0} profile already removed".format(name))
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_config import dmgr_nodes
+from ansible.module_utils.websphere_nodes import DEFAULT_NODE_CACHE_DIR, DEFAULT_NODE_CACHE_TTL, node_cache_file, \
+    read_node_cache, update_node_cache, write_node_cache
+from ansible.module_utils.websphere_process import log_file, run_command
+from ansible.module_utils.websphere_profile import find_profile, registered_profiles
+from ansible.module_utils.websphere_wsadmin import DEFAULT_WORKER_DIR, WorkerError, WorkerUnavailable, \
+    java_argument_spec, java_options, worker_execute, worker_state_file
 if __name__ == "__main__":
     main()
@@ -1,25 +1,35 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
+import time
 import platform
 import datetime
+import xml.etree.ElementTree as ElementTree
 
 
 DOCUMENTATION = """
 ---
 module: profile_server
 author: "Amir Mofasser <amir.mofasser@gmail.com>"
-short_description: This is an Ansible module for Stopping or Starting an Application Server
+short_description: This is an Ansible module for Stopping or Starting Application Servers
 description:
-  - This is an Ansible module for Stopping or Starting an Application Server
+  - This is an Ansible module for Stopping or Starting Application Servers
 options:
   state:
     required: false
     default: "started"
-    choices: ["started", "stopped"]
+    choices: ["started", "stopped", "restarted"]
     description:
-      - Start or stop Application server
+      - Start, stop or restart the Application servers. Whether a server
+        runs is read from logs/<server>/<server>.pid of the profile and the
+        command line of that process in /proc, a server that already is
+        started or stopped is left alone. restarted always stops and starts
+        a running server.
+  name:
+    required: true
+    description:
+      - Name of the Application server or a list of names. The servers of a
+        list are started or stopped in parallel.
   username:
     required: true
     description:
@@ -33,6 +43,61 @@ options:
     default: "/opt/IBM/WebSphere"
     description:
       - Path to installation location of WAS
+  timeout:
+    required: false
+    description:
+      - Seconds after which startServer.sh or stopServer.sh is killed, its
+        process group gets SIGTERM and 10 seconds later SIGKILL. The task
+        then fails with timed_out set and the output read so far. By
+        default there is no timeout.
+  parallelism:
+    required: false
+    default: 4
+    description:
+      - Number of servers started or stopped at the same time
+  profile:
+    required: false
+    description:
+      - Name of the profile of the servers, by default the profile has the
+        name of the server
+  wait_for:
+    required: false
+    default: "script"
+    choices: ["script", "ready"]
+    description:
+      - With script a start is done when startServer.sh returns. With ready
+        profiles/<profile>/logs/<server>/SystemOut.log is followed until the
+        server writes WSVR0001I open for e-business, a WSVR0009E startup
+        error fails the server right away. A server that already runs is not
+        waited for.
+  ready_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds from the start until a server has to be ready when wait_for
+        is ready
+  stop_timeout:
+    required: false
+    description:
+      - Seconds a server gets to stop. stopServer.sh is run with -timeout and
+        killed when it takes 30 seconds longer, so that it can report the
+        timeout itself. By default stopServer.sh waits as long as the server
+        takes, or until timeout.
+  force:
+    required: false
+    default: false
+    choices: [true, false]
+    description:
+      - Kill a server that still runs when stopServer.sh failed or ran into
+        stop_timeout. The process from its pid file gets SIGTERM and 10
+        seconds later SIGKILL.
+  javacore:
+    required: false
+    default: false
+    choices: [true, false]
+    description:
+      - Make a server write a javacore with SIGQUIT before it is killed,
+        to find out where it hung
 """
 
 RETURN = """
@@ -51,92 +116,285 @@ stderr:
     returned: failure, when needed
     type: string
     sample: "Some command execution error output"
+servers:
+    description: result of every server with its name, status (started,
+                 stopped or null when it can not be told) and pid before the
+                 task, changed, failed, msg, and the elapsed seconds and the
+                 output of the last script when a script ran
+    returned: in all cases
+    type: list
+    sample: [{"name": "server1", "status": "stopped", "pid": null, "changed": true, "failed": false,
+              "msg": "server1 started successfully", "elapsed": 42.17,
+              "stdout": "ADMU3000I: Server server1 open for e-business"}]
+stop_steps:
+    description: steps taken to stop a server, returned for every server in
+                 servers, with step (stopServer.sh, javacore, SIGTERM or
+                 SIGKILL), elapsed seconds and rc, timed_out, file or stopped
+    returned: when a server was stopped and for a single server
+    type: list
+    sample: [{"step": "stopServer.sh", "rc": -15, "timed_out": true, "elapsed": 120.02},
+             {"step": "javacore", "file": "/opt/IBM/WebSphere/AppServer/profiles/AppSrv01/javacore.20161018.120201.4242.0001.txt", "elapsed": 1.2},
+             {"step": "SIGTERM", "stopped": true, "elapsed": 3.4}]
+ready_seconds:
+    description: seconds from the start until the server wrote WSVR0001I, also
+                 returned for every server in servers
+    returned: when wait_for is ready and a single server is ready
+    type: float
+    sample: 97.4
+elapsed:
+    description: seconds it took to start or stop all servers
+    returned: in all cases
+    type: float
+    sample: 45.3
+timed_out:
+    description: whether the script was killed because it ran into the timeout
+    returned: when it timed out
+    type: bool
 """
 
 
 def main():
     """
-    Main module function that stops or starts and Application Server
+    Main module function that stops or starts Application Servers
 
     :return: Ansible module JSON state
     """
     module = AnsibleModule(
         argument_spec=dict(
-            state=dict(default='started', choices=['started', 'stopped']),
-            name=dict(required=True),
+            state=dict(default='started', choices=['started', 'stopped', 'restarted']),
+            name=dict(required=True, type='list'),
             username=dict(required=True),
             password=dict(required=True),
-            wasdir=dict(required=True)
-        )
+            wasdir=dict(required=True),
+            timeout=dict(required=False, type='int'),
+            parallelism=dict(required=False, default=4, type='int'),
+            profile=dict(required=False),
+            wait_for=dict(required=False, default='script', choices=['script', 'ready']),
+            ready_timeout=dict(required=False, default=DEFAULT_READY_TIMEOUT, type='int'),
+            stop_timeout=dict(required=False, type='int'),
+            force=dict(required=False, default=False, type='bool'),
+            javacore=dict(required=False, default=False, type='bool')
+        ),
+        supports_check_mode=True
     )
 
     state = module.params['state']
-    name = module.params['name']
+    names = []
+    for name in module.params['name']:
+        if name not in names:
+            names.append(name)
     username = module.params['username']
     password = module.params['password']
     wasdir = module.params['wasdir']
+    parallelism = module.params['parallelism']
+    profile = module.params['profile']
+    wait_for = module.params['wait_for']
+    ready_timeout = module.params['ready_timeout']
+    stop_timeout = module.params['stop_timeout']
+    force = module.params['force']
+    action = dict(started='start', stopped='stop', restarted='restart')[state]
 
     if not os.path.exists(wasdir):
         module.fail_json(msg="{0} does not exists".format(wasdir))
+    if parallelism < 1:
+        module.fail_json(msg="parallelism must be at least 1")
 
-    if state == 'stopped':
-        child = subprocess.Popen(
-            ["{0}/bin/stopServer.sh {1} "
-             "-profileName {1} "
-             "-username {2} "
-             "-password {3}".format(
-                wasdir,
-                name,
-                username,
-                password
-             )],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            if not stderr_value.find("appears to be stopped") < 0:
-                module.fail_json(
-                    msg="{0} stop failed".format(name),
-                    stdout=stdout_value,
-                    stderr=stderr_value
-                )
-        module.exit_json(
-            changed=True,
-            msg="{0} stopped successfully".format(name),
-            stdout=stdout_value
-        )
+    wait_ready = state in ('started', 'restarted') and wait_for == 'ready'
+    profiles = {}
+    registry = os.path.join(wasdir, PROFILE_REGISTRY)
+    if os.path.isfile(registry):
+        try:
+            profiles = parse_profile_registry(registry)
+        except ElementTree.ParseError:
+            # manageprofiles.sh may be rewriting the file right now
+            pass
+
+    def profile_path(profile_name):
+        """
+        Returns the directory of a profile
+
+        :param profile_name: Name of the profile
+        :return: Path of the profile directory
+        """
+        found = profiles.get(profile_name)
+        if found and found['path']:
+            return found['path']
+        return os.path.join(wasdir, 'profiles', profile_name)
+
+    def run_script(name, profile_name, script_action, options='', timeout=None):
+        """
+        Runs startServer.sh or stopServer.sh for one Application Server
 
-    if state == 'started':
-        child = subprocess.Popen(
-            ["{0}/bin/startServer.sh {1} "
-             "-profileName {1} "
-             "-username {2} "
-             "-password {3}".format(
+        :param name: Name of the server
+        :param profile_name: Name of the profile
+        :param script_action: start or stop
+        :param options: Further options of the script
+        :param timeout: Seconds after which the script is killed, by default the timeout option
+        :return: CommandResult
+        """
+        return run_command(
+            "{0}/bin/{1}Server.sh {2} "
+            "-profileName {3} "
+            "-username {4} "
+            "-password {5}{6}".format(
                 wasdir,
+                script_action,
                 name,
+                profile_name,
                 username,
-                password
-             )],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            module.fail_json(
-                msg="{0} start failed".format(name),
-                stdout=stdout_value,
-                stderr=stderr_value
-            )
-        module.exit_json(
-            changed=True,
-            msg="{0} started successfully".format(name),
-            stdout=stdout_value
+                password,
+                options
+            ),
+            timeout=timeout or module.params['timeout']
         )
 
+    def stop(server, profile_name):
+        """
+        Stops one Application Server. With stop_timeout the server gets that
+        long to stop, with force it is killed if it still runs afterwards.
+
+        :param server: Result of the server, updated with the outcome and the steps taken
+        :param profile_name: Name of the profile
+        :return: None
+        """
+        name = server['name']
+        started = time.time()
+        if stop_timeout:
+            result = run_script(name, profile_name, 'stop', " -timeout {0}".format(stop_timeout),
+                                stop_timeout + STOP_TIMEOUT_MARGIN)
+        else:
+            result = run_script(name, profile_name, 'stop')
+        server.update(result.as_dict())
+        server['stop_steps'] = [dict(step='stopServer.sh', rc=result.rc, timed_out=result.timed_out,
+                                     elapsed=round(time.time() - started, 3))]
+        if not result.timed_out and "appears to be stopped" in result.stdout + result.stderr:
+            # ADMU0509I, the server was not running
+            server.update(msg="{0} is already stopped".format(name))
+            return
+        if result.rc == 0:
+            server.update(changed=True, msg="{0} stopped successfully".format(name))
+            return
+        path = profile_path(profile_name)
+        status, pid = server_status(path, name)
+        if status == 'stopped':
+            server.update(changed=True, msg="{0} stopped, stopServer.sh failed with {1}".format(name, result.rc))
+        elif force and pid:
+            steps = kill_server(path, name, pid, DEFAULT_KILL_GRACE, module.params['javacore'])
+            server['stop_steps'].extend(steps)
+            signals = [step['step'] for step in steps if step['step'] in ('SIGTERM', 'SIGKILL')]
+            outcome = "timed out" if result.timed_out else "failed with {0}".format(result.rc)
+            if server_status(path, name)[0] != 'stopped':
+                server.update(failed=True, msg="{0} still runs after SIGKILL".format(name))
+            elif signals:
+                server.update(changed=True, msg="{0} was killed with {1} after stopServer.sh {2}".format(
+                    name, signals[-1], outcome))
+            else:
+                # The server exited before it was signalled
+                server.update(changed=True, msg="{0} stopped after stopServer.sh {1}".format(name, outcome))
+        else:
+            server.update(failed=True, msg=result.failure_msg("{0} stop failed".format(name)))
+
+    def start(server, profile_name):
+        """
+        Starts one Application Server and waits until it is ready if wait_for is ready
+
+        :param server: Result of the server, updated with the outcome
+        :param profile_name: Name of the profile
+        :return: None
+        """
+        name = server['name']
+        if wait_ready:
+            log = system_out_log(profile_path(profile_name), name)
+            # Only messages written after the start count
+            position = log_position(log)
+        started = time.time()
+        result = run_script(name, profile_name, 'start')
+        server.update(result.as_dict())
+        if not result.timed_out and "ADMU3027E" in result.stdout + result.stderr:
+            # An instance of the server is already running
+            server.update(msg="{0} is already started".format(name))
+            return
+        if result.rc != 0:
+            server.update(failed=True, msg=result.failure_msg("{0} start failed".format(name)))
+            return
+        server.update(changed=True, msg="{0} {1} successfully".format(name, state))
+        if not wait_ready:
+            return
+        ready = wait_for_log(log, position, started + ready_timeout - time.time())
+        server.update(ready=ready['state'] == 'ready', ready_line=ready['line'])
+        if ready['state'] == 'ready':
+            server['ready_seconds'] = round(time.time() - started, 3)
+            server['msg'] = "{0} {1} successfully and was ready after {2} seconds".format(
+                name, state, server['ready_seconds'])
+        elif ready['state'] == 'failed':
+            server.update(failed=True, msg="{0} failed to start: {1}".format(name, ready['line']))
+        else:
+            server.update(failed=True, msg="{0} was not ready after {1} seconds, {2} shows no WSVR0001I".format(
+                name, ready_timeout, log))
+
+    def control(name):
+        """
+        Starts, stops or restarts one Application Server. A server that is
+        already in the wanted state is left alone.
+
+        :param name: Name of the server
+        :return: Dictionary with the name, status before, outcome, message,
+                 elapsed time and output of the last script
+        """
+        profile_name = profile or name
+        status, pid = server_status(profile_path(profile_name), name)
+        server = dict(name=name, status=status, pid=pid, changed=False, failed=False)
+        if status == state:
+            server['msg'] = "{0} is already {1}".format(name, state)
+            return server
+        if module.check_mode:
+            server.update(changed=True, msg="{0} would be {1}".format(name, state))
+            return server
+        started = time.time()
+        if state in ('stopped', 'restarted') and status != 'stopped':
+            stop(server, profile_name)
+        if state in ('started', 'restarted') and not server['failed']:
+            restarted = server['changed']
+            start(server, profile_name)
+            server['changed'] = server['changed'] or restarted
+        server['elapsed'] = round(time.time() - started, 3)
+        return server
+
+    started = time.time()
+    servers = run_parallel(control, names, parallelism)
+    elapsed = round(time.time() - started, 3)
+    failed = [server['name'] for server in servers if server['failed']]
+    changed = len([server for server in servers if server['changed']])
+
+    if len(servers) == 1:
+        # A single server keeps returning the output of its script at the top level
+        msg = servers[0]['msg']
+        output = dict((key, value) for key, value in servers[0].items()
+                      if key not in ('name', 'changed', 'failed', 'msg', 'elapsed', 'status', 'pid',
+                                     'ready', 'ready_line'))
+    else:
+        if failed:
+            msg = "{0} {1} failed".format(", ".join(failed), action)
+        elif not changed:
+            msg = "{0} servers are already {1}".format(len(servers), state)
+        elif module.check_mode:
+            msg = "{0} of {1} servers would be {2}".format(changed, len(servers), state)
+        elif wait_ready and changed:
+            msg = "{0} of {1} servers {2} successfully and were ready after {3} seconds".format(
+                changed, len(servers), state,
+                max([server['ready_seconds'] for server in servers if 'ready_seconds' in server]))
+        else:
+            msg = "{0} of {1} servers {2} successfully".format(changed, len(servers), state)
+        output = {}
+    if failed:
+        module.fail_json(msg=msg, servers=servers, elapsed=elapsed, **output)
+    module.exit_json(changed=changed > 0, msg=msg, servers=servers, elapsed=elapsed, **output)
+
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_process import DEFAULT_KILL_GRACE, run_command, run_parallel
+from ansible.module_utils.websphere_profile import PROFILE_REGISTRY, parse_profile_registry
+from ansible.module_utils.websphere_server import DEFAULT_READY_TIMEOUT, STOP_TIMEOUT_MARGIN, kill_server, log_position, \
+    server_status, system_out_log, wait_for_log
 if __name__ == '__main__':
     main()
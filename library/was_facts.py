@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+
+
+DOCUMENTATION = """
+---
+module: was_facts
+author: "Amir Mofasser <amir.mofasser@gmail.com>"
+short_description: This is an Ansible module for gathering the cell topology of a WAS profile
+description:
+  - This module reads the nodes, servers, clusters and ports of the cells in
+    the configuration repository of a WAS profile
+  - The XML files under config/cells are parsed directly, no wsadmin or
+    other JVM is started
+  - Parsed files are cached by mtime and size, a run only parses the files
+    that changed since the previous run
+options:
+  wasdir:
+    required: false
+    default: "/opt/IBM/WebSphere"
+    description:
+      - Path to installation location of WAS
+  name:
+    required: false
+    description:
+      - Name of the profile, its path is looked up in the profile registry of
+        the installation. Either name or profile_path is required.
+  profile_path:
+    required: false
+    description:
+      - Path of the profile directory
+  cell_name:
+    required: false
+    description:
+      - Only gather the facts of this cell
+  cache:
+    required: false
+    default: true
+    description:
+      - Keep the parsed files in .ansible_was_facts.json in the profile directory.
+        In check mode the cache is read but not written.
+"""
+
+RETURN = """
+ansible_facts:
+    description: websphere_cells, a dictionary of cell name to its nodes and clusters
+    returned: success
+    type: dict
+    sample: {
+        "websphere_cells": {
+            "was_cell": {
+                "name": "was_cell",
+                "type": "DISTRIBUTED",
+                "nodes": {
+                    "node1": {
+                        "name": "node1",
+                        "host": "was1.example.com",
+                        "servers": {
+                            "server1": {
+                                "name": "server1",
+                                "type": "APPLICATION_SERVER",
+                                "cluster": "cluster1",
+                                "ports": {"WC_defaulthost": 9080, "SOAP_CONNECTOR_ADDRESS": 8880},
+                                "initial_heap_size": 512,
+                                "maximum_heap_size": 2048
+                            }
+                        }
+                    }
+                },
+                "clusters": {
+                    "cluster1": {
+                        "name": "cluster1",
+                        "members": [{"server": "server1", "node": "node1", "weight": 2}]
+                    }
+                }
+            }
+        }
+    }
+parsed:
+    description: number of files parsed and number of files taken from the cache
+    returned: success
+    type: dict
+    sample: {"parsed": 2, "cached": 41}
+"""
+
+CACHE_FILE = ".ansible_was_facts.json"
+
+
+def main():
+    """
+    Main module function that gathers the cell topology of a WAS profile
+
+    :return: Ansible module JSON state
+    """
+    module = AnsibleModule(
+        argument_spec=dict(
+            wasdir=dict(required=False, default="/opt/IBM/WebSphere"),
+            name=dict(required=False),
+            profile_path=dict(required=False),
+            cell_name=dict(required=False),
+            cache=dict(required=False, default=True, type="bool")
+        ),
+        required_one_of=[["name", "profile_path"]],
+        supports_check_mode=True
+    )
+
+    wasdir = module.params["wasdir"]
+    name = module.params["name"]
+    profile_path = module.params["profile_path"]
+    if not profile_path:
+        profile = find_profile(wasdir, name, module)
+        if profile is None:
+            module.fail_json(msg="Profile {0} does not exist in {1}".format(name, wasdir))
+        # manageprofiles.sh only lists the names of the profiles
+        profile_path = profile["path"] or "{0}/profiles/{1}".format(wasdir, name)
+    cell_name = module.params["cell_name"]
+
+    if not os.path.isdir(os.path.join(profile_path, "config", "cells")):
+        module.fail_json(msg="{0} has no configuration repository".format(profile_path))
+
+    cache_file = os.path.join(profile_path, CACHE_FILE) if module.params["cache"] else None
+    cells, stats = profile_topology(profile_path, cache_file, [cell_name] if cell_name else None,
+                                    save=not module.check_mode)
+    if cell_name and cell_name not in cells:
+        module.fail_json(msg="{0} has no cell {1}".format(profile_path, cell_name))
+
+    module.exit_json(
+        changed=False,
+        ansible_facts=dict(websphere_cells=cells),
+        parsed=stats
+    )
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_config import profile_topology
+from ansible.module_utils.websphere_profile import find_profile
+if __name__ == "__main__":
+    main()
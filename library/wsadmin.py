@@ -1,7 +1,8 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import subprocess
+import shlex
+import tempfile
 import platform
 import datetime
 
@@ -13,7 +14,10 @@ author: "Amir Mofasser <amir.mofasser@gmail.com>"
 short_description: This is an Ansible module for running Jython scripts using wsadmin
 description:
   - This is an Ansible module for running Jython scripts using wsadmin
-  - This module is NOT stateful
+  - This module is NOT stateful, except with config
+  - Scripts return data to the module by calling ansible_result(value),
+    which wsadmin defines through a -profile. Every value, a number,
+    string, list or dictionary, is returned as a record in result.
 options:
   wasdir:
     required: false
@@ -48,14 +52,134 @@ options:
     description:
       - WAS user password
   script:
-    required: true
+    required: false
     description:
-      - Full or relative path to script
+      - Full or relative path to script, one of script, steps or config is required
   params:
     required: false
     default: " "
     description:
       - Script parameters
+  steps:
+    required: false
+    description:
+      - List of scripts and Jython commands run one after the other in a
+        single wsadmin process. A step is either the path of a script or a
+        dictionary with a script or a command, optional args (a list or a
+        string) and an optional name.
+  stop_on_failure:
+    required: false
+    default: true
+    description:
+      - Skip the remaining steps after a step failed. The module fails if
+        any step failed either way.
+  config:
+    required: false
+    description:
+      - List of configuration objects with their desired attributes. The
+        module reads the current values with one AdminConfig.show per
+        object, modifies only the attributes that differ, and then saves
+        and synchronizes the nodes once. Nothing is saved or synchronized
+        when everything is up to date. Check mode reports the changes
+        without applying them.
+      - An object is a dictionary with containment, an AdminConfig.getid
+        path like /Node:node1/Server:server1/, and optionally type and
+        name to select the child object of that type with that name,
+        attributes, a dictionary of attribute values, properties, a
+        dictionary of custom properties, and properties_attribute, the
+        attribute holding the custom properties (default properties,
+        systemProperties for a JVM)
+  sync:
+    required: false
+    default: true
+    description:
+      - Synchronize the active nodes after config saved changes
+  deferred:
+    required: false
+    default: false
+    description:
+      - Defer the save and the node synchronization of config to a later
+        task with flush=true, which can be used as a handler. In a worker
+        the changes stay unsaved in its workspace, otherwise they are saved
+        but the synchronization is left to the flush. Either way the change
+        is recorded in a pending-sync marker next to the worker state file.
+      - A worker with unsaved changes does not exit on idle. If it is gone
+        anyway, for example killed after a timeout, the flush fails and
+        lists the lost changes instead of flushing the empty workspace of a
+        new worker.
+  flush:
+    required: false
+    default: false
+    description:
+      - Save the workspace of the worker if it has changes and synchronize
+        the nodes whose repository is not in sync with the cell, then clear
+        the pending-sync marker. Nothing is started when no deferred
+        changes are pending.
+  timeout:
+    required: false
+    description:
+      - Seconds after which wsadmin is killed, its process group gets
+        SIGTERM and 10 seconds later SIGKILL. A worker that does not answer
+        in time is killed the same way. The task then fails with timed_out
+        set and the output read so far. By default there is no timeout.
+  logdir:
+    required: false
+    default: "~/.ansible/wsadmin/logs"
+    description:
+      - Directory of the log files that keep the complete output of every
+        wsadmin started by the module. The path is returned in log. A worker
+        keeps no log.
+  java_shareclasses:
+    required: false
+    description:
+      - Name of an IBM J9 shared class cache for the wsadmin JVM, passed as
+        -Xshareclasses. wsadmin starts about twice as fast with a warm cache.
+        %u in the name is replaced with the user name.
+  java_shareclasses_dir:
+    required: false
+    default: "~/.ansible/wsadmin/javasharedresources"
+    description:
+      - Directory of the shared class cache, created if it does not exist
+  java_quickstart:
+    required: false
+    default: false
+    description:
+      - Start the wsadmin JVM with -Xquickstart, which compiles less and
+        starts faster
+  java_initial_heap:
+    required: false
+    description:
+      - Initial heap size of the wsadmin JVM, for example 64m
+  java_max_heap:
+    required: false
+    description:
+      - Maximum heap size of the wsadmin JVM, for example 256m
+  jython_cache_dir:
+    required: false
+    description:
+      - Directory in which Jython caches the package index of the WebSphere
+        jars (python.cachedir), created if it does not exist. Keeping it
+        between runs saves scanning the jars on every start.
+  worker:
+    required: false
+    default: false
+    description:
+      - Run the script in a persistent wsadmin worker for this host, port
+        and user instead of starting a new wsadmin. The worker is started if
+        none is running yet and exits after worker_idle_timeout seconds
+        without requests. Other modules, like profile_nodeagent, use a
+        running worker when there is one. The java_ options only take effect
+        when the worker is started.
+  worker_dir:
+    required: false
+    default: "~/.ansible/wsadmin"
+    description:
+      - Directory of the worker state files
+  worker_idle_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds without requests after which the worker exits
 """
 
 RETURN = """
@@ -65,7 +189,8 @@ msg:
     type: string
     sample: "Script executed successfully: test.py"
 stdout:
-    description: output from running a command
+    description: output from running a command, without a worker of the generated code for steps, config
+                 and flush only the result lines and the last 100 lines around them, the rest is in log
     returned: success or failure, when needed
     type: string
     sample: "Some command execution output"
@@ -74,9 +199,84 @@ stderr:
     returned: failure, when needed
     type: string
     sample: "Some command execution error output"
+result:
+    description: the values the script passed to ansible_result, in the order of the calls
+    returned: when script or steps is given
+    type: list
+    sample: [{"datasource": "jdbc/app", "created": true}]
+steps:
+    description: name, rc, stdout, result, elapsed seconds and status (ok, failed or skipped) of every step
+    returned: when steps is given
+    type: list
+    sample: [{"name": "create.py", "rc": 0, "stdout": "", "result": [], "elapsed": 1.2, "status": "ok"}]
+changes:
+    description: object, attribute, old and new value of every changed attribute
+    returned: when config is given
+    type: list
+    sample: [{"object": "/Node:node1/Server:server1/JavaVirtualMachine=*", "attribute": "maximumHeapSize",
+              "old": "256", "new": "1024"}]
+saved:
+    description: whether the configuration was saved
+    returned: when config is given
+    type: bool
+synced:
+    description: whether the active nodes were synchronized
+    returned: when config is given
+    type: bool
+pending:
+    description: the pending-sync marker for deferred config, the number of flushed changes for flush
+    returned: when deferred or flush is true
+    type: string
+lost:
+    description: number of deferred changes lost with the worker that held them
+    returned: when flush failed because that worker is gone
+    type: int
+synced_nodes:
+    description: nodes synchronized by flush
+    returned: when flush is true
+    type: list
+    sample: ["node1"]
+timed_out:
+    description: whether wsadmin was killed because it ran into the timeout
+    returned: when it timed out
+    type: bool
+signals:
+    description: signals sent to the process group of wsadmin or the worker
+    returned: when it timed out
+    type: list
+    sample: ["SIGTERM"]
+log:
+    description: log file with the complete output of wsadmin
+    returned: when wsadmin ran without a worker
+    type: string
+    sample: "/root/.ansible/wsadmin/logs/host1_wsadmin_20160720-101530.log"
+worker:
+    description: state file of the worker the script ran in
+    returned: when worker is true
+    type: string
+    sample: "/root/.ansible/wsadmin/localhost_8879_wasadmin.worker"
 """
 
 
+def normalize_step(step):
+    """
+    Normalizes a step given either as the path of a script or as a dictionary
+    with a script or a command and optionally args and name
+
+    :param step: Step as given to the module
+    :return: Tuple of kind (script or command), script or command, list of arguments and name
+    """
+    if not isinstance(step, dict):
+        step = dict(script=step)
+    if ("script" in step) == ("command" in step):
+        raise ValueError("every step needs either a script or a command: {0}".format(step))
+    kind = "script" if "script" in step else "command"
+    args = step.get("args") or []
+    if not isinstance(args, list):
+        args = shlex.split(str(args))
+    return kind, str(step[kind]), args, step.get("name") or str(step[kind])
+
+
 def main():
     """
     Main module function that runs a wsadmin script
@@ -90,9 +290,24 @@ def main():
             port=dict(default="8879", required=False),
             username=dict(required=True),
             password=dict(required=True),
-            script=dict(required=True),
-            params=dict(default=" ", required=False)
-        )
+            script=dict(required=False),
+            params=dict(default=" ", required=False),
+            steps=dict(required=False, type="list"),
+            stop_on_failure=dict(default=True, type="bool"),
+            config=dict(required=False, type="list"),
+            sync=dict(default=True, type="bool"),
+            deferred=dict(default=False, type="bool"),
+            flush=dict(default=False, type="bool"),
+            timeout=dict(required=False, type="int"),
+            logdir=dict(default="~/.ansible/wsadmin/logs", required=False),
+            worker=dict(default=False, type="bool"),
+            worker_dir=dict(default=DEFAULT_WORKER_DIR, required=False),
+            worker_idle_timeout=dict(default=DEFAULT_IDLE_TIMEOUT, type="int"),
+            **java_argument_spec()
+        ),
+        mutually_exclusive=[["script", "steps", "config", "flush"]],
+        required_one_of=[["script", "steps", "config", "flush"]],
+        supports_check_mode=True
     )
 
     params = module.params["params"]
@@ -102,45 +317,319 @@ def main():
     username = module.params["username"]
     password = module.params["password"]
     script = module.params["script"]
+    timeout = module.params["timeout"]
+    java_args = java_options(module.params)
 
     if not os.path.exists(wasdir):
         module.fail_json(msg="{0} does not exists".format(wasdir))
 
-    child = subprocess.Popen(
-        ["{0}/bin/wsadmin.sh -lang jython "
-         "-conntype SOAP "
-         "-host {1} "
-         "-port {2} "
-         "-username {3} "
-         "-password {4} "
-         "-f {5} "
-         "{6}".format(
-            wasdir,
-            host,
-            port,
-            username,
-            password,
-            script,
-            params
-         )],
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    stdout_value, stderr_value = child.communicate()
-    if child.returncode != 0:
+    state_file = worker_state_file(module.params["worker_dir"], host, port, username)
+
+    def run_in_worker(code):
+        """
+        Runs Jython code in the worker, starting the worker if none is running
+
+        :param code: Jython code
+        :return: Tuple of return code and output
+        """
+        try:
+            try:
+                return worker_execute(state_file, code, timeout)
+            except WorkerUnavailable:
+                start_worker(wasdir, host, port, username, password, state_file,
+                             module.params["worker_idle_timeout"], java_args=java_args)
+                return worker_execute(state_file, code, timeout)
+        except WorkerTimeout as e:
+            module.fail_json(
+                msg="wsadmin worker timed out: {0}".format(e),
+                timed_out=True,
+                signals=kill_worker(state_file),
+                worker=state_file
+            )
+        except (WorkerUnavailable, WorkerError) as e:
+            module.fail_json(msg="wsadmin worker failed: {0}".format(e), worker=state_file)
+
+    def run_wsadmin(script_file, script_params="", collector=None, tail_lines=OUTPUT_TAIL_LINES):
+        """
+        Runs a script in a new wsadmin, reading the ansible_result records
+        while the output streams in. The complete output goes to the log,
+        of the rest of the output only the marker lines and the last lines
+        around them are kept.
+
+        :param script_file: Path of the script
+        :param script_params: Script parameters
+        :param collector: ResultCollector for the records or None to leave them in stdout
+        :param tail_lines: Lines to keep in front of and between the marker lines, None to keep all
+        :return: Tuple of return code, stdout and stderr
+        """
+        tail = OutputTail(tail_lines, collector)
+        result = run_command(
+            "{0}/bin/wsadmin.sh -lang jython "
+            "-conntype SOAP "
+            "-host {1} "
+            "-port {2} "
+            "-username {3} "
+            "-password {4} "
+            "{5} "
+            "-profile {6} "
+            "-f {7} "
+            "{8}".format(
+                wasdir,
+                host,
+                port,
+                username,
+                password,
+                java_args,
+                result_profile(module.params["worker_dir"]),
+                script_file,
+                script_params
+            ),
+            log=log,
+            line_filter=tail.feed,
+            timeout=timeout,
+            secrets=[password]
+        )
+        output = dict(result.as_dict(), stdout=tail.output())
+        if result.timed_out:
+            module.fail_json(
+                msg=result.failure_msg("wsadmin failed"),
+                result=collector.records if collector is not None else [],
+                **output
+            )
+        return result.rc, output["stdout"], result.stderr
+
+    def run_code(code, collector=None):
+        """
+        Runs generated Jython code in the worker or else in a new wsadmin
+
+        :param code: Jython code
+        :param collector: ResultCollector for the records or None to leave them in stdout
+        :return: Tuple of return code, stdout and stderr
+        """
+        if module.params["worker"]:
+            rc, output = run_in_worker(code)
+            if collector is not None:
+                output = collector.filter(output)
+            return rc, output, ""
+        fd, driver = tempfile.mkstemp(prefix="ansible_wsadmin_", suffix=".py")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(code)
+            return run_wsadmin(driver, collector=collector)
+        finally:
+            os.remove(driver)
+
+    if module.params["worker"]:
+        log = None
+        extra = dict(worker=state_file)
+    else:
+        log = log_file(os.path.expanduser(module.params["logdir"]), "wsadmin")
+        extra = dict(log=log)
+    pending_file = pending_sync_file(state_file)
+
+    if module.params["flush"]:
+        pending = read_pending(pending_file)
+        if not pending and not (module.params["worker"] and read_worker_state(state_file) is not None):
+            module.exit_json(changed=False, msg="No deferred changes to flush", pending=0)
+        lost = lost_pending(pending, worker_identity(state_file))
+        if lost:
+            # A new worker would flush an empty workspace and report success
+            if not module.check_mode:
+                clear_pending(pending_file, [change for change in pending if change not in lost])
+            module.fail_json(
+                msg="The wsadmin worker that held {0} unsaved deferred changes is gone, they were lost "
+                    "and have to be applied again: {1}".format(
+                        len(lost), "; ".join([change["reason"] for change in lost])),
+                pending=len(pending),
+                lost=len(lost),
+                **extra
+            )
+        if module.check_mode:
+            module.exit_json(
+                changed=len(pending) > 0,
+                msg="{0} deferred changes would be flushed".format(len(pending)),
+                pending=len(pending)
+            )
+        rc, stdout_value, stderr_value = run_code(flush_code(module.params["sync"]))
+        result = parse_result(stdout_value, FLUSH_MARKER)
+        if result is None:
+            module.fail_json(
+                msg="wsadmin failed to flush the deferred changes",
+                rc=rc,
+                stdout=stdout_value,
+                stderr=stderr_value,
+                **extra
+            )
+        if result["errors"]:
+            module.fail_json(
+                msg="wsadmin flush failed: {0}".format("; ".join(result["errors"])),
+                saved=bool(result["saved"]),
+                synced_nodes=result["synced"],
+                **extra
+            )
+        clear_pending(pending_file)
+        module.exit_json(
+            changed=bool(result["saved"] or result["synced"]),
+            msg="Flushed {0} deferred changes".format(len(pending)),
+            pending=len(pending),
+            saved=bool(result["saved"]),
+            synced_nodes=result["synced"],
+            in_sync_nodes=result["in_sync"],
+            **extra
+        )
+
+    if module.params["config"]:
+        try:
+            entries = [config_entry(entry) for entry in module.params["config"]]
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+        deferred = module.params["deferred"]
+        rc, stdout_value, stderr_value = run_code(config_code(
+            entries,
+            module.check_mode,
+            module.params["sync"] and not deferred,
+            # Only a worker keeps the unsaved workspace until the flush
+            not (deferred and module.params["worker"])
+        ))
+        result = parse_result(stdout_value, CONFIG_MARKER)
+        if result is None:
+            module.fail_json(
+                msg="wsadmin failed to read the configuration",
+                rc=rc,
+                stdout=stdout_value,
+                stderr=stderr_value,
+                **extra
+            )
+        changes = result["changes"]
+        if result["errors"]:
+            module.fail_json(
+                msg="wsadmin configuration failed: {0}".format("; ".join(result["errors"])),
+                changes=changes,
+                **extra
+            )
+        if module._diff:
+            before = {}
+            after = {}
+            for change in changes:
+                before.setdefault(change["object"], {})[change["attribute"]] = change["old"]
+                after.setdefault(change["object"], {})[change["attribute"]] = change["new"]
+            extra["diff"] = dict(before=before, after=after)
+        if deferred and changes and not module.check_mode:
+            mark_pending(pending_file, "{0} attributes of {1}".format(
+                len(changes), ", ".join(sorted(set([change["object"] for change in changes])))
+            ), worker_identity(state_file) if module.params["worker"] else None)
+            extra["pending"] = pending_file
+        module.exit_json(
+            changed=len(changes) > 0,
+            msg="{0} attributes changed".format(len(changes)) if changes else "Configuration is up to date",
+            changes=changes,
+            saved=bool(result["saved"]),
+            synced=bool(result["synced"]),
+            **extra
+        )
+
+    if module.check_mode:
+        module.exit_json(changed=False, skipped=True, msg="check mode is only supported with config")
+
+    if module.params["steps"]:
+        try:
+            steps = [normalize_step(step) for step in module.params["steps"]]
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+        rc, stdout_value, stderr_value = run_code(
+            steps_code([step[:3] for step in steps], module.params["stop_on_failure"])
+        )
+        results = parse_steps(stdout_value)
+        if not results:
+            module.fail_json(
+                msg="wsadmin failed before running the first step",
+                rc=rc,
+                stdout=stdout_value,
+                stderr=stderr_value
+            )
+        step_results = []
+        records = []
+        for index, (kind, value, args, name) in enumerate(steps):
+            step_result = dict(name=name, rc=None, stdout="", result=[], elapsed=0, status="skipped")
+            if index < len(results):
+                collector = ResultCollector()
+                step_result.update(results[index])
+                step_result["stdout"] = collector.filter(results[index]["stdout"])
+                step_result["result"] = collector.records
+                step_result["status"] = "ok" if results[index]["rc"] == 0 else "failed"
+                records.extend(collector.records)
+            step_results.append(step_result)
+        extra["result"] = records
+        if not module.params["worker"]:
+            extra["stderr"] = stderr_value
+        failed = [step for step in step_results if step["status"] == "failed"]
+        if failed:
+            module.fail_json(
+                changed=True,
+                msg="wsadmin step failed: {0}".format(failed[0]["name"]),
+                steps=step_results,
+                **extra
+            )
+        if len(results) < len(steps):
+            module.fail_json(
+                changed=True,
+                msg="wsadmin exited after {0} of {1} steps".format(len(results), len(steps)),
+                steps=step_results,
+                stdout=stdout_value,
+                **extra
+            )
+        module.exit_json(
+            changed=True,
+            msg="{0} steps executed successfully".format(len(steps)),
+            steps=step_results,
+            **extra
+        )
+
+    collector = ResultCollector()
+    if module.params["worker"]:
+        rc, output, stderr_value = run_code(script_code(script, shlex.split(params)), collector)
+        if rc != 0:
+            module.fail_json(
+                msg="Failed executing wsadmin script: {0}".format(script),
+                rc=rc,
+                stdout=output,
+                result=collector.records,
+                worker=state_file
+            )
+        module.exit_json(
+            changed=True,
+            msg="Script executed successfully: {0}".format(script),
+            stdout=output,
+            result=collector.records,
+            worker=state_file
+        )
+
+    # Playbooks search the output of their own scripts, so keep all of it
+    rc, stdout_value, stderr_value = run_wsadmin(script, params, collector, tail_lines=None)
+    if rc != 0:
         module.fail_json(
             msg="Failed executing wsadmin script: {0}".format(script),
             stdout=stdout_value,
-            stderr=stderr_value
+            stderr=stderr_value,
+            result=collector.records,
+            log=log
         )
     module.exit_json(
         changed=True,
         msg="Script executed successfully: {0}".format(script),
-        stdout=stdout_value
+        stdout=stdout_value,
+        result=collector.records,
+        log=log
     )
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_process import log_file, run_command
+from ansible.module_utils.websphere_wsadmin import DEFAULT_IDLE_TIMEOUT, DEFAULT_WORKER_DIR, OUTPUT_TAIL_LINES, \
+    OutputTail, ResultCollector, WorkerError, WorkerTimeout, WorkerUnavailable, CONFIG_MARKER, FLUSH_MARKER, \
+    config_code, config_entry, \
+    clear_pending, flush_code, java_argument_spec, java_options, kill_worker, lost_pending, mark_pending, parse_result, \
+    parse_steps, pending_sync_file, read_pending, read_worker_state, result_profile, script_code, start_worker, \
+    steps_code, worker_execute, worker_identity, worker_state_file
 if __name__ == "__main__":
     main()
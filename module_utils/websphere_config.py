@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for the configuration repository of a WebSphere profile.
+
+The cell topology (nodes, servers, clusters and their ports) is kept in XML
+files under config/cells/<cell>/ of every profile. Reading them directly
+answers questions that otherwise need wsadmin or manageprofiles.sh, and
+therefore a JVM. The documents use a namespace per file type, elements are
+matched on their local name only.
+
+Parsed files are cached in a JSON file together with their mtime and size,
+so only the files that changed since the last run are parsed again.
+"""
+import os
+import json
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+
+CONFIG_CACHE_VERSION = 1
+
+
+def local_name(tag):
+    """
+    Strips the namespace from an element tag
+
+    :param tag: Tag of the form {namespace}name or name
+    :return: Local name
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def children(element, name):
+    """
+    Returns the child elements with a local name
+
+    :param element: Parent element
+    :param name: Local name of the children
+    :return: List of elements
+    """
+    return [child for child in element if local_name(child.tag) == name]
+
+
+def to_int(value):
+    if value is not None and value.isdigit():
+        return int(value)
+    return value
+
+
+def parse_cell(root):
+    """
+    Parses cell.xml
+
+    :param root: Root element
+    :return: Dictionary with name and type of the cell
+    """
+    return dict(name=root.get("name"), type=root.get("cellType"))
+
+
+def parse_serverindex(root):
+    """
+    Parses nodes/<node>/serverindex.xml
+
+    :param root: Root element
+    :return: Dictionary with the host name and the servers of the node with their ports
+    """
+    servers = {}
+    for entry in children(root, "serverEntries"):
+        ports = {}
+        for endpoint in children(entry, "specialEndpoints"):
+            for end_point in children(endpoint, "endPoint"):
+                ports[endpoint.get("endPointName")] = to_int(end_point.get("port"))
+        servers[entry.get("serverName")] = dict(type=entry.get("serverType"), ports=ports)
+    return dict(host=root.get("hostName"), servers=servers)
+
+
+def parse_server(root):
+    """
+    Parses nodes/<node>/servers/<server>/server.xml
+
+    :param root: Root element
+    :return: Dictionary with the name, cluster and JVM heap sizes of the server
+    """
+    server = dict(name=root.get("name"), cluster=root.get("clusterName"),
+                  initial_heap_size=None, maximum_heap_size=None)
+    for element in root.iter():
+        if local_name(element.tag) == "jvmEntries":
+            server["initial_heap_size"] = to_int(element.get("initialHeapSize"))
+            server["maximum_heap_size"] = to_int(element.get("maximumHeapSize"))
+            break
+    return server
+
+
+def parse_cluster(root):
+    """
+    Parses clusters/<cluster>/cluster.xml
+
+    :param root: Root element
+    :return: Dictionary with the name and the members of the cluster
+    """
+    members = []
+    for member in children(root, "members"):
+        members.append(dict(
+            server=member.get("memberName"),
+            node=member.get("nodeName"),
+            weight=to_int(member.get("weight"))
+        ))
+    return dict(name=root.get("name"), members=members)
+
+
+class ConfigReader(object):
+    """
+    Parses configuration files through a cache of the parsed results, which
+    is keyed by path and invalidated by the mtime and size of the file
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.files = {}
+        self.used = set()
+        self.stats = dict(parsed=0, cached=0)
+        if cache_file:
+            try:
+                with open(cache_file) as f:
+                    cache = json.load(f)
+                if cache.get("version") == CONFIG_CACHE_VERSION:
+                    self.files = cache.get("files", {})
+            except (IOError, OSError, ValueError):
+                pass
+
+    def read(self, path, parser):
+        """
+        Returns the parsed content of a file
+
+        :param path: Path of the XML file
+        :param parser: Function that turns the root element into a dictionary
+        :return: Parsed content or None if the file does not exist or is not valid XML
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp = [stat.st_mtime, stat.st_size]
+        self.used.add(path)
+        entry = self.files.get(path)
+        if entry is not None and entry["stamp"] == stamp:
+            self.stats["cached"] += 1
+            return entry["data"]
+        try:
+            data = parser(ElementTree.parse(path).getroot())
+        except ElementTree.ParseError:
+            # WebSphere may be rewriting the file right now
+            return None
+        self.files[path] = dict(stamp=stamp, data=data)
+        self.stats["parsed"] += 1
+        return data
+
+    def save(self):
+        """
+        Writes the cache if any file was parsed, dropping the files that were
+        not read. Failures are ignored since the cache is only an optimization.
+
+        :return: None
+        """
+        if not self.cache_file or (not self.stats["parsed"] and set(self.files) == self.used):
+            return
+        files = dict((path, entry) for path, entry in self.files.items() if path in self.used)
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.cache_file),
+                                            dir=os.path.dirname(self.cache_file))
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(dict(version=CONFIG_CACHE_VERSION, files=files), f)
+            os.rename(tmp_path, self.cache_file)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _subdirs(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted([name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))])
+
+
+def cell_topology(reader, cell_dir):
+    """
+    Reads the nodes, servers and clusters of a cell
+
+    :param reader: ConfigReader
+    :param cell_dir: config/cells/<cell> directory of a profile
+    :return: Dictionary of the cell facts
+    """
+    cell = reader.read(os.path.join(cell_dir, "cell.xml"), parse_cell) or {}
+    cell = dict(name=cell.get("name") or os.path.basename(cell_dir), type=cell.get("type"),
+                nodes={}, clusters={})
+    nodes_dir = os.path.join(cell_dir, "nodes")
+    for node_name in _subdirs(nodes_dir):
+        node_dir = os.path.join(nodes_dir, node_name)
+        index = reader.read(os.path.join(node_dir, "serverindex.xml"), parse_serverindex) or {}
+        servers = {}
+        for server_name, entry in (index.get("servers") or {}).items():
+            servers[server_name] = dict(entry, name=server_name, cluster=None,
+                                        initial_heap_size=None, maximum_heap_size=None)
+        for server_name in _subdirs(os.path.join(node_dir, "servers")):
+            server = reader.read(os.path.join(node_dir, "servers", server_name, "server.xml"), parse_server)
+            if server is None:
+                continue
+            servers.setdefault(server_name, dict(name=server_name, type=None, ports={}))
+            servers[server_name].update(
+                cluster=server["cluster"],
+                initial_heap_size=server["initial_heap_size"],
+                maximum_heap_size=server["maximum_heap_size"]
+            )
+        cell["nodes"][node_name] = dict(name=node_name, host=index.get("host"), servers=servers)
+    clusters_dir = os.path.join(cell_dir, "clusters")
+    for cluster_name in _subdirs(clusters_dir):
+        cluster = reader.read(os.path.join(clusters_dir, cluster_name, "cluster.xml"), parse_cluster)
+        if cluster is not None:
+            cell["clusters"][cluster_name] = cluster
+    return cell
+
+
+def profile_topology(profile_path, cache_file=None, cells=None, save=True):
+    """
+    Reads the topology of every cell in the configuration repository of a profile
+
+    :param profile_path: Profile directory
+    :param cache_file: Cache of parsed files or None to parse every file
+    :param cells: List of cell names to read or None for all cells
+    :param save: Write the cache back, False only reads it
+    :return: Tuple of a dictionary of cell name to cell facts and the parse statistics
+    """
+    reader = ConfigReader(cache_file)
+    cells_dir = os.path.join(profile_path, "config", "cells")
+    topology = {}
+    for cell_name in _subdirs(cells_dir):
+        if cells is None or cell_name in cells:
+            topology[cell_name] = cell_topology(reader, os.path.join(cells_dir, cell_name))
+    if save:
+        reader.save()
+    return topology, reader.stats
+
+
+def same_host(name, other):
+    """
+    Compares two host names, a short name matches the fully qualified name
+    it is the first label of
+
+    :param name: Host name
+    :param other: Host name
+    :return: True if the names denote the same host
+    """
+    name, other = (name or "").lower(), (other or "").lower()
+    if name == other:
+        return True
+    if "." in name and "." in other:
+        return False
+    return name.split(".")[0] == other.split(".")[0]
+
+
+def dmgr_nodes(profile_path, dmgr_host, dmgr_port):
+    """
+    Lists the nodes of a cell from the configuration repository of its
+    deployment manager. The deployment manager profile holds the master
+    copy, addNode.sh and removeNode.sh update it before they return.
+
+    :param profile_path: Profile directory
+    :param dmgr_host: Host name of the deployment manager
+    :param dmgr_port: SOAP port of the deployment manager
+    :return: Sorted list of node names or None if the profile is not the
+             deployment manager listening on that host and port
+    """
+    reader = ConfigReader()
+    cells_dir = os.path.join(profile_path, "config", "cells")
+    for cell_name in _subdirs(cells_dir):
+        nodes_dir = os.path.join(cells_dir, cell_name, "nodes")
+        nodes = []
+        found = False
+        for node_name in _subdirs(nodes_dir):
+            index = reader.read(os.path.join(nodes_dir, node_name, "serverindex.xml"), parse_serverindex)
+            if index is None:
+                continue
+            nodes.append(node_name)
+            for server in index["servers"].values():
+                if server["type"] == "DEPLOYMENT_MANAGER" and same_host(index["host"], dmgr_host) and \
+                        str(server["ports"].get("SOAP_CONNECTOR_ADDRESS")) == str(dmgr_port):
+                    found = True
+        if found:
+            return nodes
+    return None
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+File system helpers shared by the WebSphere modules.
+
+An installation tree of WebSphere has 60-100k files, which shutil.rmtree
+removes one at a time. The tree is instead renamed to a tombstone, which
+frees the installation directory immediately, and then removed by a pool
+of worker threads. A directory that can not be renamed, for example a mount
+point, is emptied in place by the same pool.
+
+The shared resources directories of several installations on one host are
+deduplicated through a content addressed artifact store.
+"""
+import os
+import json
+import errno
+import fcntl
+import shutil
+import datetime
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+from ansible.module_utils.websphere_im import parse_version, split_offering, version_matches
+from ansible.module_utils.websphere_repo import file_digest
+
+
+DEFAULT_REMOVE_WORKERS = 8
+
+
+def tombstone(path):
+    """
+    Atomically renames a path to a hidden tombstone next to it
+
+    :param path: Path to rename
+    :return: Path of the tombstone
+    """
+    path = os.path.normpath(path)
+    target = os.path.join(
+        os.path.dirname(path),
+        ".{0}.tombstone-{1}".format(
+            os.path.basename(path),
+            datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
+        )
+    )
+    os.rename(path, target)
+    return target
+
+
+def _list_dir(path):
+    """
+    Lists a directory without following symlinks
+
+    :param path: Directory
+    :return: Tuple of the lists of file paths and directory paths
+    """
+    files = []
+    dirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            else:
+                files.append(entry.path)
+    else:
+        for name in os.listdir(path):
+            entry = os.path.join(path, name)
+            if os.path.isdir(entry) and not os.path.islink(entry):
+                dirs.append(entry)
+            else:
+                files.append(entry)
+    return files, dirs
+
+
+def remove_tree(path, workers=DEFAULT_REMOVE_WORKERS, keep_root=False):
+    """
+    Removes a directory tree using a pool of worker threads. The workers
+    unlink the files of one directory at a time and queue its sub directories,
+    the emptied directories are removed deepest first afterwards.
+
+    :param path: Directory to remove
+    :param workers: Number of worker threads, at least 1
+    :param keep_root: Only remove the contents of the directory
+    :return: Number of removed files
+    """
+    if workers < 1:
+        raise ValueError("remove_tree needs at least one worker")
+    pending = queue.Queue()
+    lock = threading.Lock()
+    dirs = [path]
+    errors = []
+    removed = [0]
+
+    def worker():
+        while True:
+            directory = pending.get()
+            try:
+                if directory is None:
+                    return
+                files, subdirs = _list_dir(directory)
+                for name in files:
+                    os.unlink(name)
+                with lock:
+                    removed[0] += len(files)
+                    dirs.extend(subdirs)
+                for subdir in subdirs:
+                    pending.put(subdir)
+            except OSError as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                pending.task_done()
+
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    pending.put(path)
+    pending.join()
+    for thread in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    if keep_root:
+        dirs.remove(path)
+    # A sub directory always has a longer path than its parent
+    for directory in sorted(dirs, key=len, reverse=True):
+        os.rmdir(directory)
+    return removed[0]
+
+
+def remove_installation(path, workers=DEFAULT_REMOVE_WORKERS):
+    """
+    Removes an installation directory, through a tombstone if it can be
+    renamed and otherwise in place. A mount point can neither be renamed
+    (EBUSY) nor moved to another file system (EXDEV), it is emptied and kept.
+
+    :param path: Installation directory
+    :param workers: Number of worker threads
+    :return: Tuple of the number of removed files and the path that was removed
+    """
+    try:
+        removed = tombstone(path)
+    except OSError:
+        return remove_tree(path, workers, keep_root=os.path.ismount(path)), path
+    return remove_tree(removed, workers), removed
+
+
+STORE_INDEX_FILE = "index.json"
+STORE_INDEX_VERSION = 2
+STORE_OBJECTS_DIR = "objects"
+STORE_MODES = ["reflink", "copy", "hardlink"]
+FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    """
+    Clones a file with the FICLONE ioctl so both files share their extents
+    """
+    with open(source, "rb") as src:
+        with open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, target)
+
+
+def link_file(source, target, mode):
+    """
+    Atomically replaces target with a copy, a reflink or a hardlink of source
+
+    :param source: Existing file
+    :param target: File to create or replace
+    :param mode: copy, reflink or hardlink
+    :return: None
+    """
+    tmp_path = "{0}.link-{1}".format(target, os.getpid())
+    try:
+        if mode == "reflink":
+            _reflink(source, tmp_path)
+        elif mode == "hardlink":
+            os.link(source, tmp_path)
+        else:
+            shutil.copy2(source, tmp_path)
+        os.rename(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def tree_files(tree):
+    """
+    Lists the files of a directory tree
+
+    :param tree: Directory
+    :return: Set of the paths of the files relative to the directory
+    """
+    files = set()
+    for root, dirs, names in os.walk(tree):
+        for name in names:
+            files.add(os.path.relpath(os.path.join(root, name), tree))
+    return files
+
+
+class ArtifactStore(object):
+    """
+    Content addressed store for the artifacts Installation Manager keeps in
+    its shared resources directories (im_shared). Every distinct artifact is
+    stored once under objects/ by its SHA-256 digest.
+
+    The index remembers the digest, size and mtime of every file of the
+    shared resources directories it has seen, so unchanged files are not
+    hashed again, and a manifest per installed offering of the (relative
+    path, digest) pairs the installation added. A new shared resources
+    directory is only seeded with the manifests of the offerings it is
+    about to get.
+
+    reflink shares the extents of the files copy-on-write. A store on a file
+    system without reflinks raises OSError instead of quietly falling back to
+    copy, which would keep a second full copy of every artifact. copy only
+    seeds from the store and saves no space. hardlink shares the inodes, so a
+    file Installation Manager rewrites in place changes the stored object
+    and every other directory linked to it; stored objects are verified
+    against their digest before they are reused in that mode.
+    """
+
+    def __init__(self, path, mode="reflink"):
+        self.path = path
+        self.objects = os.path.join(path, STORE_OBJECTS_DIR)
+        if not os.path.isdir(self.objects):
+            os.makedirs(self.objects)
+        self.mode = mode
+        if mode == "reflink" and not self._reflink_supported():
+            raise OSError(errno.EOPNOTSUPP, "{0} does not support reflinks, artifact_store_mode=hardlink shares "
+                          "the artifacts on this file system and copy only seeds im_shared".format(path))
+        self.lock = None
+        self.index = {}
+
+    def _reflink_supported(self):
+        source = os.path.join(self.objects, ".reflink-{0}".format(os.getpid()))
+        try:
+            with open(source, "w") as f:
+                f.write("reflink")
+            _reflink(source, source + ".clone")
+            return True
+        except (IOError, OSError):
+            return False
+        finally:
+            for path in (source, source + ".clone"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def __enter__(self):
+        self.lock = open(os.path.join(self.path, ".lock"), "w")
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        try:
+            with open(os.path.join(self.path, STORE_INDEX_FILE)) as f:
+                self.index = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.index = {}
+        if self.index.get("version") != STORE_INDEX_VERSION:
+            # The objects stay, they are found again by their digest
+            self.index = dict(version=STORE_INDEX_VERSION, trees={}, manifests={})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            index_path = os.path.join(self.path, STORE_INDEX_FILE)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(self.index, f)
+            os.rename(index_path + ".tmp", index_path)
+        finally:
+            fcntl.flock(self.lock, fcntl.LOCK_UN)
+            self.lock.close()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def _verified(self, digest):
+        """
+        Checks a stored object against its digest in hardlink mode, removing
+        an object that was changed through one of its links
+
+        :param digest: Digest of the object
+        :return: True if the object can be reused
+        """
+        target = self.object_path(digest)
+        if not os.path.exists(target):
+            return False
+        if self.mode == "hardlink" and file_digest(target) != digest:
+            os.remove(target)
+            return False
+        return True
+
+    def _store(self, path, digest, stats):
+        """
+        Stores a file under its digest, or replaces it with a link to the
+        stored object if the store already has it and the mode shares files
+        """
+        target = self.object_path(digest)
+        if not self._verified(digest):
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            link_file(path, target, self.mode)
+            stats["stored"] += 1
+        elif self.mode != "copy" and not os.path.samefile(path, target):
+            link_file(target, path, self.mode)
+            stats["linked"] += 1
+            stats["saved_bytes"] += os.path.getsize(target)
+        else:
+            stats["unchanged"] += 1
+
+    def add_tree(self, tree, manifests=None, added=None):
+        """
+        Imports the files of a shared resources directory into the store.
+        Files whose size and mtime match the index are not hashed again.
+
+        :param tree: Shared resources directory
+        :param manifests: Offerings, as id_version, whose manifest is the
+                          files the installation added
+        :param added: Relative paths of the files the installation added,
+                      None for all files
+        :return: Dictionary of statistics
+        """
+        stats = dict(mode=self.mode, stored=0, linked=0, unchanged=0, failed=0, saved_bytes=0)
+        known = self.index["trees"].get(os.path.realpath(tree), {})
+        entries = {}
+        manifest = []
+        for relpath in sorted(tree_files(tree)):
+            path = os.path.join(tree, relpath)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entry = known.get(relpath)
+            if entry and entry[1:] == [stat.st_size, stat.st_mtime] and os.path.exists(self.object_path(entry[0])):
+                stats["unchanged"] += 1
+                digest = entry[0]
+            else:
+                digest = file_digest(path)
+                if entry and entry[0] != digest and os.path.exists(self.object_path(entry[0])) \
+                        and os.path.samefile(path, self.object_path(entry[0])):
+                    # Rewritten in place through a hardlink, the object changed with it
+                    os.remove(self.object_path(entry[0]))
+                try:
+                    self._store(path, digest, stats)
+                except (IOError, OSError):
+                    # Hardlinks across file systems leave the file as it is
+                    stats["failed"] += 1
+                    continue
+                stat = os.stat(path)
+            entries[relpath] = [digest, stat.st_size, stat.st_mtime]
+            if added is None or relpath in added:
+                manifest.append([relpath, digest])
+        self.index["trees"][os.path.realpath(tree)] = entries
+        for offering in manifests or []:
+            self.index["manifests"][offering] = manifest
+        return stats
+
+    def manifest(self, offering_id, version=None):
+        """
+        Finds the manifest of an offering, the newest one matching the version
+
+        :param offering_id: Offering id
+        :param version: Version or leading part of it, None for any version
+        :return: Offering as id_version or None if there is no manifest
+        """
+        found = []
+        for offering in self.index["manifests"]:
+            manifest_id, manifest_version = split_offering(offering)[:2]
+            if manifest_id == offering_id and manifest_version and \
+                    (version is None or version_matches(manifest_version, version)):
+                found.append(offering)
+        if not found:
+            return None
+        return sorted(found, key=lambda offering: parse_version(split_offering(offering)[1]))[-1]
+
+    def seed_tree(self, tree, offerings):
+        """
+        Links the stored artifacts of the manifests of the offerings that a
+        shared resources directory does not have yet into it, so Installation
+        Manager does not download them again
+
+        :param tree: Shared resources directory
+        :param offerings: Offerings as id_version, from manifest
+        :return: Dictionary of statistics
+        """
+        stats = dict(mode=self.mode, seeded=0, failed=0, invalid=0)
+        for offering in offerings:
+            for relpath, digest in self.index["manifests"].get(offering, []):
+                path = os.path.join(tree, relpath)
+                if os.path.lexists(path) or not os.path.exists(self.object_path(digest)):
+                    continue
+                try:
+                    if not self._verified(digest):
+                        stats["invalid"] += 1
+                        continue
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    link_file(self.object_path(digest), path, self.mode)
+                    stats["seeded"] += 1
+                except (IOError, OSError):
+                    stats["failed"] += 1
+        return stats
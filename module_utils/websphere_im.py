@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the IBM Installation Manager based modules (ibmim, ibmwas
+and ibmxs) for finding out which packages are installed on a host.
+
+Installation Manager keeps its inventory in the agent data location
+(installed.xml and installRegistry.xml). Reading those files answers
+"is offering X at version Y installed in directory Z" in milliseconds,
+whereas "imcl listInstalledPackages" starts a whole Eclipse JVM. imcl is
+only used when the registry files can not be found.
+
+The parsed inventory is cached in a JSON file in the agent data location
+and reused for as long as the registry files keep their mtime and size, so
+a converged play does not even parse the registry again.
+"""
+import os
+import re
+import json
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_process import LIST_TIMEOUT, check_timeout, run_command
+
+DEFAULT_APPDATA_LOCATION = "/var/ibm/InstallationManager"
+REGISTRY_FILES = ["installed.xml", "installRegistry.xml"]
+INVENTORY_CACHE_FILE = ".ansible_websphere_inventory.json"
+INVENTORY_CACHE_VERSION = 1
+
+
+def im_appdata_location(ibmim):
+    """
+    Returns the agent data location of an Installation Manager installation
+
+    :param ibmim: IBM Installation Manager installation directory
+    :return: Path to the agent data location
+    """
+    config_ini = os.path.join(ibmim, "eclipse", "configuration", "config.ini")
+    if os.path.isfile(config_ini):
+        with open(config_ini) as f:
+            for line in f:
+                key, sep, value = line.partition("=")
+                if sep and key.strip() == "cic.appDataLocation":
+                    value = value.strip().replace("\\:", ":")
+                    if value.startswith("@user.home"):
+                        value = os.path.expanduser("~") + value[len("@user.home"):]
+                    return value
+    if os.geteuid() != 0:
+        return os.path.expanduser("~/var/ibm/InstallationManager")
+    return DEFAULT_APPDATA_LOCATION
+
+
+def normalize_location(path):
+    """
+    Normalizes an installation directory so that paths can be compared
+
+    :param path: Installation directory
+    :return: Normalized path
+    """
+    return os.path.normpath(os.path.realpath(os.path.expanduser(path)))
+
+
+def parse_installed_xml(path):
+    """
+    Parses installed.xml from the Installation Manager agent data location
+
+    :param path: Path to installed.xml
+    :return: List of installed packages
+    """
+    packages = []
+    root = ElementTree.parse(path).getroot()
+    for location in root.iter("location"):
+        for package in location.iter("package"):
+            packages.append(dict(
+                id=package.get("id"),
+                version=package.get("version"),
+                name=package.get("name"),
+                location=location.get("path")
+            ))
+    return packages
+
+
+def parse_install_registry_xml(path):
+    """
+    Parses installRegistry.xml from the Installation Manager agent data location
+
+    :param path: Path to installRegistry.xml
+    :return: List of installed packages
+    """
+    packages = []
+    root = ElementTree.parse(path).getroot()
+    for profile in root.iter("profile"):
+        location = None
+        for prop in profile.iter("property"):
+            if prop.get("name") == "installLocation":
+                location = prop.get("value")
+        for offering in profile.iter("offering"):
+            packages.append(dict(
+                id=offering.get("id"),
+                version=offering.get("version"),
+                name=offering.get("name"),
+                location=location
+            ))
+    return packages
+
+
+def read_registry(appdata):
+    """
+    Reads the installed packages from the Installation Manager registry files
+
+    :param appdata: Installation Manager agent data location
+    :return: List of installed packages or None if no registry file exists
+    """
+    installed_xml = os.path.join(appdata, "installed.xml")
+    install_registry_xml = os.path.join(appdata, "installRegistry.xml")
+    try:
+        if os.path.isfile(installed_xml):
+            return parse_installed_xml(installed_xml)
+        if os.path.isfile(install_registry_xml):
+            return parse_install_registry_xml(install_registry_xml)
+    except ElementTree.ParseError:
+        # Installation Manager may be rewriting the file right now
+        pass
+    return None
+
+
+def imcl_installed_packages(ibmim, module=None):
+    """
+    Lists the installed packages by running imcl listInstalledPackages
+
+    :param ibmim: IBM Installation Manager installation directory
+    :param module: Ansible module failed when imcl times out, without one CommandTimeout is raised
+    :return: List of installed packages
+    """
+    result = run_command(
+        "{0}/eclipse/tools/imcl listInstalledPackages -long".format(ibmim),
+        tail_lines=None,
+        line_filter=lambda line: line if " : " in line else None,
+        timeout=LIST_TIMEOUT
+    )
+    check_timeout(result, "imcl listInstalledPackages failed", module)
+    packages = []
+    for line in result.stdout.splitlines():
+        fields = [field.strip() for field in line.split(" : ")]
+        if len(fields) < 2:
+            continue
+        offering_id, version = split_offering(fields[1])[:2]
+        packages.append(dict(
+            id=offering_id,
+            version=version,
+            name=fields[2] if len(fields) > 2 else None,
+            location=fields[0]
+        ))
+    return packages
+
+
+def registry_fingerprint(appdata):
+    """
+    Returns the mtime and size of the Installation Manager registry files
+
+    :param appdata: Installation Manager agent data location
+    :return: Dictionary of registry file name to [mtime, size]
+    """
+    fingerprint = {}
+    for name in REGISTRY_FILES:
+        try:
+            stat = os.stat(os.path.join(appdata, name))
+        except OSError:
+            continue
+        fingerprint[name] = [stat.st_mtime, stat.st_size]
+    return fingerprint
+
+
+def read_inventory_cache(appdata, fingerprint):
+    """
+    Reads the cached inventory if it was built from the same registry files
+
+    :param appdata: Installation Manager agent data location
+    :param fingerprint: Current fingerprint of the registry files
+    :return: List of installed packages or None if the cache is stale
+    """
+    try:
+        with open(os.path.join(appdata, INVENTORY_CACHE_FILE)) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if cache.get("version") != INVENTORY_CACHE_VERSION or cache.get("fingerprint") != fingerprint:
+        return None
+    return cache.get("packages")
+
+
+def write_inventory_cache(appdata, fingerprint, packages):
+    """
+    Atomically writes the inventory cache. Failures are ignored since the
+    cache is only an optimization.
+
+    :param appdata: Installation Manager agent data location
+    :param fingerprint: Fingerprint of the registry files the inventory was read from
+    :param packages: List of installed packages
+    :return: None
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=INVENTORY_CACHE_FILE, dir=appdata)
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(dict(
+                version=INVENTORY_CACHE_VERSION,
+                fingerprint=fingerprint,
+                packages=packages
+            ), f)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, os.path.join(appdata, INVENTORY_CACHE_FILE))
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def installed_packages(ibmim, module=None):
+    """
+    Returns the packages installed by an Installation Manager
+
+    :param ibmim: IBM Installation Manager installation directory
+    :param module: Ansible module failed when imcl has to list the packages and times out
+    :return: List of installed packages
+    """
+    appdata = im_appdata_location(ibmim)
+    fingerprint = registry_fingerprint(appdata)
+    if not fingerprint:
+        return imcl_installed_packages(ibmim, module)
+    packages = read_inventory_cache(appdata, fingerprint)
+    if packages is None:
+        packages = read_registry(appdata)
+        if packages is None:
+            return imcl_installed_packages(ibmim, module)
+        write_inventory_cache(appdata, fingerprint, packages)
+    return packages
+
+
+def split_offering(offering):
+    """
+    Splits an offering specification of the form id[_version][,feature,...]
+
+    :param offering: Offering specification
+    :return: Tuple of offering id, version (or None) and list of features
+    """
+    parts = offering.split(",")
+    features = [feature.strip() for feature in parts[1:] if feature.strip()]
+    offering_id, sep, version = parts[0].strip().partition("_")
+    return offering_id, version or None, features
+
+
+def parse_offering_spec(spec):
+    """
+    Parses an offering given either as a string of the form
+    id[_version][,feature,...] or as a dictionary with the keys id, version
+    and features
+
+    :param spec: Offering specification
+    :return: Tuple of offering id, version (or None) and list of features
+    :raises ValueError: If a dictionary has no id
+    """
+    if isinstance(spec, dict):
+        if not spec.get("id"):
+            raise ValueError("offering {0} has no id".format(spec))
+        features = spec.get("features") or []
+        if not isinstance(features, list):
+            features = [feature.strip() for feature in str(features).split(",") if feature.strip()]
+        version = spec.get("version")
+        return str(spec["id"]), str(version) if version else None, features
+    return split_offering(spec)
+
+
+def offering_specs(value):
+    """
+    Normalizes the offering option into a list of offering specifications.
+    A string is a single offering, so the features after its commas are
+    kept together with it.
+
+    :param value: String, dictionary or list of strings and dictionaries
+    :return: List of offering specifications
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def imcl_offering(offering_id, version=None, features=None):
+    """
+    Formats an offering the way imcl expects it on the command line
+
+    :param offering_id: Offering id
+    :param version: Version or None for the latest version
+    :param features: List of features or None for the default features
+    :return: Offering argument of the form id[_version][,feature,...]
+    """
+    offering = offering_id
+    if version:
+        offering = "{0}_{1}".format(offering, version)
+    if features:
+        offering = "{0},{1}".format(offering, ",".join(features))
+    return offering
+
+
+def parse_version(version):
+    """
+    Converts an Installation Manager version string into a comparable tuple
+
+    :param version: Version string, for example 8.5.5009.20160225_0435
+    :return: Tuple of version components
+    """
+    components = []
+    for part in re.split(r"[._-]", version):
+        if part.isdigit():
+            components.append((0, int(part)))
+        else:
+            components.append((1, part))
+    return tuple(components)
+
+
+def version_matches(installed, wanted):
+    """
+    Checks if an installed version satisfies the wanted version. A wanted
+    version matches when it is equal to or a leading part of the installed
+    one. The last component of the wanted version may be the leading part of
+    a component, as IM folds the fix pack into the modification level: 8.5.5
+    matches 8.5.5009.20160225_0435 (8.5.5 fix pack 9).
+
+    :param installed: Installed version
+    :param wanted: Wanted version
+    :return: True if the version matches
+    """
+    installed_parts = re.split(r"[._-]", installed)
+    wanted_parts = re.split(r"[._-]", wanted)
+    if len(wanted_parts) > len(installed_parts):
+        return False
+    count = len(wanted_parts) - 1
+    if parse_version(".".join(installed_parts[:count])) != parse_version(".".join(wanted_parts[:count])):
+        return False
+    return installed_parts[count].startswith(wanted_parts[count])
+
+
+def find_installed(packages, offering_id=None, version=None, location=None):
+    """
+    Finds installed packages matching an offering id, version and location
+
+    :param packages: List of installed packages
+    :param offering_id: Offering id or None for any offering
+    :param version: Version or None for any version
+    :param location: Installation directory or None for any directory
+    :return: List of matching packages
+    """
+    if location is not None:
+        location = normalize_location(location)
+    found = []
+    for package in packages:
+        if offering_id is not None and package["id"] != offering_id:
+            continue
+        if version is not None and not version_matches(package["version"] or "", version):
+            continue
+        if location is not None and (not package["location"] or
+                                     normalize_location(package["location"]) != location):
+            continue
+        found.append(package)
+    return found
+
+
+def offering_installed(ibmim, offering, location=None, packages=None, module=None):
+    """
+    Checks if an offering is installed
+
+    :param ibmim: IBM Installation Manager installation directory
+    :param offering: Offering specification of the form id[_version]
+    :param location: Installation directory or None for any directory
+    :param packages: Already loaded list of installed packages
+    :param module: Ansible module failed when imcl has to list the packages and times out
+    :return: True for installed or False for not installed
+    """
+    if packages is None:
+        packages = installed_packages(ibmim, module)
+    offering_id, version = split_offering(offering)[:2]
+    return len(find_installed(packages, offering_id, version, location)) > 0
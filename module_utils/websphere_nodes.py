@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the node lists of deployment managers, used by the modules that
+need to know whether a node is part of a cell.
+
+Listing the nodes through wsadmin costs a JVM start and a login on the
+deployment manager. When many nodes federate at the same time almost all of
+those logins return the same list. The list is kept in a JSON file per
+deployment manager together with the time it was read, and trusted for a
+number of seconds. The cache directory may be shared by several hosts:
+files are replaced atomically and changes are made under a lock file.
+"""
+import os
+import json
+import time
+import fcntl
+import tempfile
+
+
+DEFAULT_NODE_CACHE_DIR = "~/.ansible/websphere/nodes"
+DEFAULT_NODE_CACHE_TTL = 300
+NODE_CACHE_VERSION = 1
+
+
+def node_cache_file(cache_dir, dmgr_host, dmgr_port):
+    """
+    Returns the cache file of a deployment manager
+
+    :param cache_dir: Cache directory
+    :param dmgr_host: Host name of the deployment manager
+    :param dmgr_port: SOAP port of the deployment manager
+    :return: Path of the cache file
+    """
+    return os.path.join(os.path.expanduser(cache_dir), "{0}_{1}.json".format(dmgr_host.lower(), dmgr_port))
+
+
+def _load(cache_file):
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if cache.get("version") != NODE_CACHE_VERSION or not isinstance(cache.get("nodes"), list):
+        return None
+    return cache
+
+
+def _store(cache_file, cache):
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(cache_file), dir=os.path.dirname(cache_file))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, cache_file)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _locked(cache_file, change):
+    """
+    Runs a change of the cache file under its lock file. Failures are ignored
+    since the cache is only an optimization.
+
+    :param cache_file: Path of the cache file
+    :param change: Function called with the current cache or None, it returns
+                   the new cache or None to leave the file alone
+    :return: None
+    """
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        lock = open(cache_file + ".lock", "a")
+    except (IOError, OSError):
+        return
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache = change(_load(cache_file))
+        if cache is not None:
+            _store(cache_file, cache)
+    except (IOError, OSError):
+        pass
+    finally:
+        lock.close()
+
+
+def read_node_cache(cache_file, ttl):
+    """
+    Reads a cached node list if it is younger than the TTL
+
+    :param cache_file: Path of the cache file
+    :param ttl: Seconds the list is trusted
+    :return: Dictionary with nodes, source and age of the list or None if
+             there is no fresh list
+    """
+    cache = _load(cache_file)
+    if cache is None:
+        return None
+    age = time.time() - cache.get("time", 0)
+    if age < 0 or age >= ttl:
+        return None
+    return dict(nodes=cache["nodes"], source=cache.get("source"), age=round(age, 1))
+
+
+def write_node_cache(cache_file, nodes, source):
+    """
+    Replaces the cached node list of a deployment manager
+
+    :param cache_file: Path of the cache file
+    :param nodes: List of node names
+    :param source: Where the list was read from, for example config or wsadmin
+    :return: None
+    """
+    _locked(cache_file, lambda cache: dict(
+        version=NODE_CACHE_VERSION,
+        time=time.time(),
+        source=source,
+        nodes=sorted(nodes)
+    ))
+
+
+def update_node_cache(cache_file, added=None, removed=None):
+    """
+    Adds or removes a node in a cached node list after addNode.sh or
+    removeNode.sh, keeping the time the list was read. Without a cached list
+    nothing is written.
+
+    :param cache_file: Path of the cache file
+    :param added: Name of a node that was federated
+    :param removed: Name of a node that was removed
+    :return: None
+    """
+    def change(cache):
+        if cache is None:
+            return None
+        nodes = set(cache["nodes"])
+        if added:
+            nodes.add(added)
+        if removed:
+            nodes.discard(removed)
+        cache["nodes"] = sorted(nodes)
+        return cache
+    _locked(cache_file, change)
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+Process runner shared by the WebSphere modules.
+
+imcl and manageprofiles.sh can print tens of megabytes. Instead of holding
+all of it in memory with communicate() and returning it in the module
+result, the output is streamed into a log file on the host while only the
+last lines of stdout and stderr are kept in bounded ring buffers.
+
+Every command runs in a process group of its own. When it runs into its
+timeout the whole group, including the JVMs started by the WebSphere shell
+scripts, gets SIGTERM and, if it is still running after a grace period,
+SIGKILL. The output read until then is returned.
+
+Log files are only readable by their owner, and secrets like the admin
+password are masked in the command line written to them.
+
+Helpers that list something with a command, like imcl listInstalledPackages,
+give it LIST_TIMEOUT seconds. They fail the module passed to them when it
+times out, or raise CommandTimeout without one.
+
+run_parallel runs independent commands, for example the start scripts of
+several servers, in a pool of threads.
+"""
+import io
+import os
+import re
+import sys
+import time
+import codecs
+import datetime
+import signal
+import platform
+import threading
+import subprocess
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+DEFAULT_TAIL_LINES = 100
+DEFAULT_KILL_GRACE = 10
+LIST_TIMEOUT = 300
+SECRET_MASK = "********"
+READ_SIZE = 64 * 1024
+PROGRESS_RE = re.compile(r"(\d{1,3})\s?%")
+
+
+if sys.version_info[0] >= 3:
+    NEW_SESSION = dict(start_new_session=True)
+else:
+    # preexec_fn is not safe with threads, but Python 2 has nothing else
+    NEW_SESSION = dict(preexec_fn=os.setsid)
+
+
+def log_file(logdir, name):
+    """
+    Returns a new log file path in the log directory, creating the directory
+    if needed
+
+    :param logdir: Log directory
+    :param name: Short name of the operation, for example wasnd
+    :return: Path of the log file
+    """
+    if not os.path.isdir(logdir):
+        os.makedirs(logdir)
+    return os.path.join(logdir, "{0}_{1}_{2}.log".format(
+        platform.node(),
+        name,
+        datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    ))
+
+
+class CommandResult(object):
+    """
+    Outcome of a command run with run_command
+    """
+
+    def __init__(self, rc, stdout, stderr, log, elapsed, progress=None, timeout=None, signals=None):
+        self.rc = rc
+        self.stdout = stdout
+        self.stderr = stderr
+        self.log = log
+        self.elapsed = elapsed
+        self.progress = progress
+        self.timeout = timeout
+        self.signals = signals or []
+        self.timed_out = bool(self.signals)
+
+    def as_dict(self):
+        """
+        :return: Dictionary of the output fields to return from a module
+        """
+        result = dict(stdout=self.stdout, stderr=self.stderr, log=self.log)
+        if self.progress is not None:
+            result["progress"] = self.progress
+        if self.timed_out:
+            result.update(timed_out=True, rc=self.rc, signals=self.signals)
+        return result
+
+    def failure_msg(self, msg):
+        """
+        :param msg: Message for a failed command
+        :return: The message, telling that the command was killed if it timed out
+        """
+        if self.timed_out:
+            return "{0}: timed out after {1} seconds and was killed with {2}".format(
+                msg, self.timeout, self.signals[-1])
+        return msg
+
+
+class CommandTimeout(Exception):
+    """
+    Raised when a command run by a helper timed out, with its CommandResult
+    """
+
+    def __init__(self, msg, result):
+        Exception.__init__(self, msg)
+        self.result = result
+
+
+def check_timeout(result, msg, module=None):
+    """
+    Fails the module, or raises CommandTimeout without one, if a command timed out
+
+    :param result: CommandResult
+    :param msg: Message for the failure
+    :param module: Ansible module or None
+    :return: None
+    """
+    if not result.timed_out:
+        return
+    if module is None:
+        raise CommandTimeout(result.failure_msg(msg), result)
+    module.fail_json(msg=result.failure_msg(msg), **result.as_dict())
+
+
+class _StreamReader(threading.Thread):
+    """
+    Reads a pipe in chunks, writes it to the log and keeps the last lines
+    """
+
+    def __init__(self, pipe, log, log_lock, tail_lines, started, progress, line_filter=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pipe = pipe
+        self.log = log
+        self.log_lock = log_lock
+        self.lines = deque(maxlen=tail_lines)
+        self.partial = ""
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.started = started
+        self.progress = progress
+        self.line_filter = line_filter
+
+    def _track_progress(self, text):
+        for match in PROGRESS_RE.finditer(text):
+            percent = int(match.group(1))
+            if percent <= 100 and (not self.progress or percent > self.progress[-1]["percent"]):
+                self.progress.append(dict(
+                    percent=percent,
+                    elapsed=round(time.time() - self.started, 1)
+                ))
+
+    def _keep(self, lines):
+        if self.line_filter is None:
+            self.lines.extend(lines)
+            return
+        for line in lines:
+            line = self.line_filter(line)
+            if line is not None:
+                self.lines.append(line)
+
+    def run(self):
+        fd = self.pipe.fileno()
+        while True:
+            chunk = os.read(fd, READ_SIZE)
+            text = self.decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                break
+            if self.log is not None:
+                with self.log_lock:
+                    # run_command lets go of the readers of killed commands
+                    if self.log is not None:
+                        self.log.write(text)
+            if self.progress is not None:
+                # IM prints its progress on a single line, so look at the
+                # text as it arrives instead of waiting for complete lines
+                self._track_progress(text)
+            lines = (self.partial + text).split("\n")
+            self.partial = lines.pop()
+            self._keep(lines)
+        if self.partial:
+            self._keep([self.partial])
+        self.pipe.close()
+
+    def tail(self):
+        return "\n".join(self.lines)
+
+
+def _wait(child, readers, deadline):
+    """
+    Waits for a command to exit and for its output to be read
+
+    :param child: Popen object
+    :param readers: Stream readers of the command
+    :param deadline: Time to give up at or None to wait forever
+    :return: True if the command finished before the deadline
+    """
+    for reader in readers:
+        reader.join(None if deadline is None else max(0, deadline - time.time()))
+        if reader.is_alive():
+            return False
+    if deadline is None:
+        child.wait()
+        return True
+    while child.poll() is None:
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def _kill_group(child, readers, grace):
+    """
+    Sends SIGTERM to the process group of a command and SIGKILL if the
+    command is still running after the grace period
+
+    :param child: Popen object
+    :param readers: Stream readers of the command
+    :param grace: Seconds to wait after each signal
+    :return: List of the names of the signals sent
+    """
+    sent = []
+    for signum, name in ((signal.SIGTERM, "SIGTERM"), (signal.SIGKILL, "SIGKILL")):
+        try:
+            os.killpg(child.pid, signum)
+        except OSError:
+            # The group is gone, only a process outside of it still holds the pipes
+            break
+        sent.append(name)
+        if _wait(child, readers, time.time() + grace):
+            break
+    return sent
+
+
+def mask_secrets(text, secrets):
+    """
+    Replaces secrets in a text with a mask
+
+    :param text: Text, for example a command line
+    :param secrets: List of secrets, empty values are ignored
+    :return: Text with every secret replaced by SECRET_MASK
+    """
+    for secret in secrets or []:
+        if secret:
+            text = text.replace(str(secret), SECRET_MASK)
+    return text
+
+
+def open_log(log):
+    """
+    Opens a log file for appending, creating it readable only by its owner
+
+    :param log: Path of the log file
+    :return: Text file object
+    """
+    return io.open(os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), "a", encoding="utf-8")
+
+
+def run_command(cmd, log=None, tail_lines=DEFAULT_TAIL_LINES, progress=False, cwd=None, line_filter=None,
+                timeout=None, stdin_data=None, kill_grace=DEFAULT_KILL_GRACE, secrets=None):
+    """
+    Runs a shell command, streaming its output to a log file and keeping only
+    the last lines of stdout and stderr in memory
+
+    :param cmd: Shell command line
+    :param log: Path of the log file or None to keep no log
+    :param tail_lines: Number of lines of stdout and stderr to keep, None to keep all
+    :param progress: Track progress percentages printed by the command
+    :param cwd: Working directory of the command
+    :param line_filter: Function called with every line of stdout as it is
+                        read, it returns the line to keep or None to drop it
+    :param timeout: Seconds after which the process group of the command is
+                    killed, None or 0 to wait forever
+    :param stdin_data: Text to write to stdin of the command, for example the
+                       answer to a prompt, otherwise stdin is /dev/null
+    :param kill_grace: Seconds between SIGTERM and SIGKILL
+    :param secrets: Values masked in the command line written to the log, for example passwords
+    :return: CommandResult
+    """
+    started = time.time()
+    log_handle = None
+    if log is not None:
+        log_handle = open_log(log)
+        log_handle.write(u"# {0}\n".format(mask_secrets(cmd, secrets)))
+    log_lock = threading.Lock()
+    devnull = open(os.devnull)
+    try:
+        child = subprocess.Popen(
+            [cmd],
+            shell=True,
+            stdin=devnull if stdin_data is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            **NEW_SESSION
+        )
+    finally:
+        devnull.close()
+    progress_data = [] if progress else None
+    readers = [
+        _StreamReader(child.stdout, log_handle, log_lock, tail_lines, started, progress_data, line_filter),
+        _StreamReader(child.stderr, log_handle, log_lock, tail_lines, started, None)
+    ]
+    signals = []
+    try:
+        for reader in readers:
+            reader.start()
+        if stdin_data is not None:
+            try:
+                child.stdin.write(stdin_data.encode("utf-8"))
+                child.stdin.close()
+            except (IOError, OSError):
+                # The command exited without reading its input
+                pass
+        if not _wait(child, readers, started + timeout if timeout else None):
+            signals = _kill_group(child, readers, kill_grace)
+        rc = child.poll()
+        if rc is None:
+            rc = -signal.SIGKILL
+    finally:
+        if log_handle is not None:
+            with log_lock:
+                if signals:
+                    log_handle.write(u"\n# timed out after {0} seconds, sent {1}\n".format(
+                        timeout, ", ".join(signals)))
+                for reader in readers:
+                    reader.log = None
+                log_handle.close()
+    if progress_data is not None:
+        progress_data = dict(
+            percent=progress_data[-1]["percent"] if progress_data else 0,
+            history=progress_data
+        )
+    return CommandResult(
+        rc,
+        readers[0].tail(),
+        readers[1].tail(),
+        log,
+        round(time.time() - started, 3),
+        progress_data,
+        timeout,
+        signals
+    )
+
+
+def run_parallel(function, items, workers):
+    """
+    Calls a function for every item in a pool of worker threads
+
+    :param function: Function called with one item
+    :param items: List of items
+    :param workers: Maximum number of calls running at the same time
+    :return: List of the return values in the order of the items
+    """
+    results = [None] * len(items)
+    pending = queue.Queue()
+    lock = threading.Lock()
+    errors = []
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
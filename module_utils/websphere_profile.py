@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the profile modules for finding out which WebSphere
+profiles exist.
+
+WebSphere keeps the list of profiles in properties/profileRegistry.xml of
+the installation. Reading it takes milliseconds, whereas
+"manageprofiles.sh -listProfiles" starts a JVM. manageprofiles.sh is only
+used when the registry can not be read.
+"""
+import os
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_process import LIST_TIMEOUT, check_timeout, run_command
+
+
+PROFILE_REGISTRY = os.path.join("properties", "profileRegistry.xml")
+
+
+def parse_profile_registry(path):
+    """
+    Parses profileRegistry.xml. Reservation tickets, profiles that are still
+    being created, are left out.
+
+    :param path: Path to profileRegistry.xml
+    :return: Dictionary of profile name to name, path, template and is_default
+    """
+    profiles = {}
+    for profile in ElementTree.parse(path).getroot().iter("profile"):
+        if profile.get("isAReservationTicket") == "true":
+            continue
+        profiles[profile.get("name")] = dict(
+            name=profile.get("name"),
+            path=profile.get("path"),
+            template=profile.get("template"),
+            is_default=profile.get("isDefault") == "true"
+        )
+    return profiles
+
+
+def manageprofiles_profiles(wasdir, module=None):
+    """
+    Lists the profiles by running manageprofiles.sh -listProfiles, which
+    prints them as [name1, name2]
+
+    :param wasdir: Path to installation location of WAS
+    :param module: Ansible module failed when manageprofiles.sh times out, without one CommandTimeout is raised
+    :return: Dictionary of profile name to name, path, template and is_default,
+             only the name is known
+    """
+    result = run_command(
+        "{0}/bin/manageprofiles.sh -listProfiles".format(wasdir),
+        tail_lines=None,
+        line_filter=lambda line: line if line.strip().startswith("[") else None,
+        timeout=LIST_TIMEOUT
+    )
+    check_timeout(result, "manageprofiles.sh -listProfiles failed", module)
+    profiles = {}
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if not (line.startswith("[") and line.endswith("]")):
+            continue
+        for name in line[1:-1].split(","):
+            name = name.strip()
+            if name:
+                profiles[name] = dict(name=name, path=None, template=None, is_default=None)
+    return profiles
+
+
+def registered_profiles(wasdir, module=None):
+    """
+    Returns the profiles of a WebSphere installation
+
+    :param wasdir: Path to installation location of WAS
+    :param module: Ansible module failed when manageprofiles.sh has to list the profiles and times out
+    :return: Dictionary of profile name to name, path, template and is_default
+    """
+    registry = os.path.join(wasdir, PROFILE_REGISTRY)
+    if os.path.isfile(registry):
+        try:
+            return parse_profile_registry(registry)
+        except ElementTree.ParseError:
+            # manageprofiles.sh may be rewriting the file right now
+            pass
+    return manageprofiles_profiles(wasdir, module)
+
+
+def find_profile(wasdir, name, module=None):
+    """
+    Finds a profile by its exact name
+
+    :param wasdir: Path to installation location of WAS
+    :param name: Profile name
+    :param module: Ansible module failed when manageprofiles.sh has to list the profiles and times out
+    :return: Dictionary with name, path, template and is_default or None if the profile does not exist
+    """
+    return registered_profiles(wasdir, module).get(name)
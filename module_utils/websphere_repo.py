@@ -0,0 +1,688 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for working with IBM Installation Manager repositories.
+
+A remote repository (HTTP URL or shared directory) can be staged into a
+local or shared cache directory so that a large rollout downloads every
+artifact only once. The mirror keeps a checksum index of every staged
+artifact with its size and mtime in the mirror. A cached artifact whose size
+and mtime still match is reused as is, otherwise it is validated against the
+recorded SHA-256. Artifacts are only fetched again when the source artifact
+changed its size or modification stamp. Over HTTP only the repository
+metadata files are stamped with a HEAD request, the other artifacts have
+versioned names and are never rewritten in place.
+
+The offerings and fixes a repository provides are indexed from its
+repository.xml, or from the artifact names in its Offerings and Fixes
+directories if it has none, which lets check mode and parameter validation
+answer "which version would be installed" without starting Installation
+Manager. The index is cached, for an HTTP repository
+until the ETag or Last-Modified of its repository.config changes.
+"""
+import io
+import os
+import re
+import json
+import fcntl
+import shutil
+import hashlib
+import time
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from urlparse import urljoin, urlparse
+except ImportError:
+    from urllib.parse import urljoin, urlparse
+
+from ansible.module_utils.urls import fetch_url
+from ansible.module_utils.websphere_im import parse_version, split_offering, version_matches
+from ansible.module_utils.websphere_process import run_command
+
+
+MIRROR_INDEX_FILE = ".ansible_mirror_index.json"
+MIRROR_INDEX_VERSION = 1
+REPOSITORY_INDEX_VERSION = 2
+# Seconds the index of an HTTP repository is reused when the server sends
+# neither an ETag nor a Last-Modified header for repository.config
+REPOSITORY_INDEX_TTL = 300
+ARTIFACT_RE = re.compile(r"^(?P<id>[^_/]+)_(?P<version>[^/]+)\.jar$")
+CHUNK_SIZE = 1024 * 1024
+HREF_RE = re.compile(r'href\s*=\s*["\']([^"\'#?]+)["\']', re.IGNORECASE)
+# Files of a repository which change in place when offerings are added
+METADATA_FILES = ("repository.config", "repository.xml")
+# Artifacts named in the XML metadata of an offering or fix jar, relative to the repository
+ARTIFACT_PATH_RE = re.compile(r'["\'>]((?:native|plugins|features|files)/[^"\'<>\s]+)["\'<]')
+
+
+class RepositoryError(Exception):
+    pass
+
+
+def is_remote_repository(repo):
+    """
+    Checks if a repository is served over HTTP(S)
+
+    :param repo: URL or path of the repository
+    :return: True for HTTP(S) repositories
+    """
+    return urlparse(repo).scheme in ("http", "https")
+
+
+def parse_repository_config(content):
+    """
+    Parses the key=value pairs of a repository.config file
+
+    :param content: Content of repository.config
+    :return: Dictionary of properties
+    """
+    properties = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, sep, value = line.partition("=")
+        if sep:
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def parse_repository_xml(content):
+    """
+    Parses the offerings and fixes listed in a repository.xml file
+
+    :param content: Content of repository.xml
+    :return: Dictionary with the offering and fix ids mapped to lists of versions
+    """
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError as e:
+        raise RepositoryError("repository.xml is not valid: {0}".format(e))
+    listed = dict(offerings={}, fixes={})
+    for element in root.iter():
+        kind = dict(offering="offerings", fix="fixes").get(element.tag.rsplit("}", 1)[-1].lower())
+        if kind and element.get("id") and element.get("version"):
+            versions = listed[kind].setdefault(element.get("id"), [])
+            if element.get("version") not in versions:
+                versions.append(element.get("version"))
+    return listed
+
+
+def jar_artifacts(content):
+    """
+    Lists the artifacts the XML metadata of an offering or fix jar names
+
+    :param content: Content of the jar
+    :return: Sorted list of the artifact paths relative to the repository
+    """
+    artifacts = set()
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as jar:
+            for name in jar.namelist():
+                if name.endswith(".xml"):
+                    artifacts.update(ARTIFACT_PATH_RE.findall(jar.read(name).decode("utf-8", "replace")))
+    except (zipfile.BadZipfile, IOError, OSError) as e:
+        raise RepositoryError("the offering metadata is not valid: {0}".format(e))
+    return sorted(artifacts)
+
+
+def file_digest(path):
+    """
+    Computes the SHA-256 digest of a file
+
+    :param path: Path of the file
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(CHUNK_SIZE)
+    return digest.hexdigest()
+
+
+class HttpSource(object):
+    """
+    Repository served over HTTP(S). Artifacts are enumerated from the
+    repository metadata, the directory listings of the web server are only
+    used for repositories without a repository.xml.
+    """
+
+    # Listings are generated by the web server and carry no validators
+    STAMPED = ("repository.config", "repository.xml")
+
+    def __init__(self, module, url):
+        self.module = module
+        self.url = url if url.endswith("/") else url + "/"
+
+    def _open(self, url, method="GET"):
+        response, info = fetch_url(self.module, url, method=method)
+        if info["status"] != 200:
+            raise RepositoryError("{0} {1} failed with status {2}: {3}".format(
+                method, url, info["status"], info.get("msg")
+            ))
+        return response, info
+
+    def read(self, relpath):
+        response = self._open(urljoin(self.url, relpath))[0]
+        return response.read()
+
+    def stamp(self, relpath):
+        """
+        :return: ETag and Last-Modified of a file, None if it does not exist, an
+                 empty string if the server sends neither or does not answer
+                 the HEAD request
+        """
+        info = fetch_url(self.module, urljoin(self.url, relpath), method="HEAD")[1]
+        if info["status"] == 404:
+            return None
+        if info["status"] != 200 or not info.get("etag") and not info.get("last-modified"):
+            return ""
+        return "{0}|{1}".format(info.get("etag"), info.get("last-modified"))
+
+    def listdir(self, directory):
+        """
+        :return: Tuple of the relative paths of the files and sub directories of a directory
+        """
+        if directory and not directory.endswith("/"):
+            directory += "/"
+        listing = self.read(directory)
+        if not isinstance(listing, str):
+            listing = listing.decode("utf-8", "replace")
+        files = []
+        dirs = []
+        for href in HREF_RE.findall(listing):
+            url = urljoin(urljoin(self.url, directory), href)
+            if not url.startswith(self.url) or len(url) <= len(urljoin(self.url, directory)):
+                continue
+            relpath = url[len(self.url):]
+            if relpath.endswith("/"):
+                if relpath not in dirs:
+                    dirs.append(relpath)
+            elif relpath not in files:
+                files.append(relpath)
+        return files, dirs
+
+    def listed_files(self):
+        """
+        :return: Relative paths of all files found through the directory listings
+        """
+        files = []
+        pending = [""]
+        while pending:
+            names, dirs = self.listdir(pending.pop())
+            pending.extend(dirs)
+            files.extend(names)
+        return files
+
+    def files(self, contents=None):
+        """
+        :param contents: Artifacts of the offering and fix jars seen before,
+                         updated with the jars read
+        :return: Dictionary of relative path to a stamp identifying the artifact version
+        """
+        relpaths = _metadata_files(self, contents)
+        if relpaths is None:
+            relpaths = self.listed_files()
+        files = {}
+        for relpath in relpaths:
+            if os.path.basename(relpath) not in METADATA_FILES:
+                # The name of an artifact changes with its content
+                files[relpath] = ""
+                continue
+            info = self._open(urljoin(self.url, relpath), method="HEAD")[1]
+            files[relpath] = "{0}|{1}|{2}".format(
+                info.get("content-length"), info.get("etag"), info.get("last-modified")
+            )
+        return files
+
+    def copy(self, relpath, fileobj):
+        response = self._open(urljoin(self.url, relpath))[0]
+        chunk = response.read(CHUNK_SIZE)
+        while chunk:
+            fileobj.write(chunk)
+            chunk = response.read(CHUNK_SIZE)
+
+
+class DirectorySource(object):
+    """
+    Repository in a local or shared (for example NFS) directory
+    """
+
+    STAMPED = ("repository.config", "repository.xml", "Offerings", "Fixes")
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, relpath):
+        with open(os.path.join(self.path, relpath), "rb") as f:
+            return f.read()
+
+    def listdir(self, directory):
+        """
+        :return: Tuple of the relative paths of the files and sub directories of a directory
+        """
+        files = []
+        dirs = []
+        for name in os.listdir(os.path.join(self.path, directory)):
+            relpath = os.path.join(directory, name)
+            if os.path.isdir(os.path.join(self.path, relpath)):
+                dirs.append(relpath)
+            else:
+                files.append(relpath)
+        return files, dirs
+
+    def stamp(self, relpath):
+        """
+        :return: Modification stamp of a file or directory, None if it does not exist
+        """
+        try:
+            stat = os.stat(os.path.join(self.path, relpath))
+        except OSError:
+            return None
+        return "{0}|{1}".format(stat.st_size, stat.st_mtime)
+
+    def files(self, contents=None):
+        """
+        :param contents: Unused, a directory is always listed
+        :return: Dictionary of relative path to a stamp identifying the artifact version
+        """
+        files = {}
+        for root, dirs, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files[os.path.relpath(path, self.path)] = "{0}|{1}".format(stat.st_size, stat.st_mtime)
+        return files
+
+    def copy(self, relpath, fileobj):
+        with open(os.path.join(self.path, relpath), "rb") as f:
+            shutil.copyfileobj(f, fileobj, CHUNK_SIZE)
+
+
+def mirror_path(cache_dir, repo):
+    """
+    Returns the directory a repository is mirrored to
+
+    :param cache_dir: Repository cache directory
+    :param repo: URL or path of the repository
+    :return: Path of the mirror
+    """
+    name = re.sub(r"[^A-Za-z0-9.-]+", "_", repo.rstrip("/")).strip("_")
+    return os.path.join(cache_dir, name)
+
+
+def _stage(source, relpath, target):
+    """
+    Copies an artifact into the mirror and returns its SHA-256 digest
+    """
+    path = os.path.join(target, relpath)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    digest = hashlib.sha256()
+
+    class DigestWriter(object):
+        def __init__(self, f):
+            self.f = f
+
+        def write(self, data):
+            digest.update(data)
+            self.f.write(data)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".staging", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            source.copy(relpath, DigestWriter(f))
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest()
+
+
+def mirror_repository(module, repo, cache_dir):
+    """
+    Stages a repository into the cache directory. Only artifacts which are
+    new, changed at the source or fail validation against the checksum index
+    are copied. Only artifacts whose size or mtime in the mirror differs from
+    the index are hashed. Concurrent runs against a shared cache are
+    serialized with a lock file.
+
+    :param module: Ansible module, used for HTTP requests
+    :param repo: URL or path of the repository
+    :param cache_dir: Repository cache directory
+    :return: Tuple of the mirror path and a dictionary of transfer statistics
+    """
+    source = repository_source(module, repo)
+    try:
+        parse_repository_config(source.read("repository.config").decode("utf-8", "replace"))
+    except (IOError, OSError, RepositoryError) as e:
+        raise RepositoryError("{0} is not an Installation Manager repository: {1}".format(repo, e))
+
+    target = mirror_path(cache_dir, repo)
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    lock = open(target + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index_path = os.path.join(target, MIRROR_INDEX_FILE)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if index.get("version") != MIRROR_INDEX_VERSION:
+                index = {}
+        except (IOError, OSError, ValueError):
+            index = {}
+        artifacts = index.get("artifacts", {})
+        contents = index.get("contents", {})
+
+        stats = dict(copied=0, reused=0, verified=0, removed=0)
+        remote = source.files(contents)
+        for relpath, stamp in sorted(remote.items()):
+            path = os.path.join(target, relpath)
+            cached = artifacts.get(relpath)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if cached and cached["stamp"] == stamp and stat is not None:
+                if cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime:
+                    stats["reused"] += 1
+                    continue
+                # Changed in the mirror since it was staged, or staged
+                # before sizes and mtimes were recorded
+                stats["verified"] += 1
+                if file_digest(path) == cached["sha256"]:
+                    cached.update(size=stat.st_size, mtime=stat.st_mtime)
+                    stats["reused"] += 1
+                    continue
+            digest = _stage(source, relpath, target)
+            stat = os.stat(path)
+            artifacts[relpath] = dict(stamp=stamp, sha256=digest, size=stat.st_size, mtime=stat.st_mtime)
+            stats["copied"] += 1
+        for relpath in list(artifacts):
+            if relpath not in remote:
+                if os.path.isfile(os.path.join(target, relpath)):
+                    os.remove(os.path.join(target, relpath))
+                del artifacts[relpath]
+                stats["removed"] += 1
+        for relpath in list(contents):
+            if relpath not in remote:
+                del contents[relpath]
+
+        fd, tmp_path = tempfile.mkstemp(prefix=MIRROR_INDEX_FILE, dir=target)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(dict(version=MIRROR_INDEX_VERSION, repository=repo, artifacts=artifacts,
+                               contents=contents), f)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, index_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+    return target, stats
+
+
+def repository_source(module, repo):
+    """
+    Returns the source object for a repository URL or path
+    """
+    if is_remote_repository(repo):
+        return HttpSource(module, repo)
+    return DirectorySource(repo)
+
+
+def _repository_dirs(source, directory=""):
+    """
+    Returns the (sub) repositories of a repository, following the children
+    of composite repositories
+    """
+    properties = parse_repository_config(
+        source.read(os.path.join(directory, "repository.config")).decode("utf-8", "replace")
+    )
+    dirs = [directory]
+    if properties.get("LayoutPolicy") == "Composite":
+        for key, value in sorted(properties.items()):
+            if key.startswith("repository.url.") and "://" not in value and not value.startswith("/"):
+                child = os.path.normpath(os.path.join(directory, value))
+                dirs.extend(_repository_dirs(source, "" if child == "." else child))
+    return dirs
+
+
+def _listed_versions(source, directory):
+    """
+    Returns the offerings and fixes the repository.xml of a (sub) repository
+    lists, None if it has no valid repository.xml
+    """
+    try:
+        return parse_repository_xml(source.read(os.path.join(directory, "repository.xml")))
+    except (IOError, OSError, RepositoryError):
+        return None
+
+
+def _metadata_files(source, contents=None):
+    """
+    Lists the files of a repository without directory listings: the
+    repository.config of every (sub) repository, and for every repository
+    that is not composite its repository.xml, the offering and fix jars the
+    repository.xml lists and the artifacts the metadata of those jars names.
+    Jars have versioned names, the artifacts of a jar found in contents are
+    not read again.
+
+    :param source: Repository source
+    :param contents: Dictionary of jar path to its artifacts, updated with the jars read
+    :return: List of relative paths, None if a (sub) repository has no repository.xml
+    """
+    if contents is None:
+        contents = {}
+    files = []
+    for directory in _repository_dirs(source):
+        config = os.path.join(directory, "repository.config")
+        files.append(config)
+        properties = parse_repository_config(source.read(config).decode("utf-8", "replace"))
+        if properties.get("LayoutPolicy") == "Composite":
+            continue
+        listed = _listed_versions(source, directory)
+        if listed is None:
+            return None
+        files.append(os.path.join(directory, "repository.xml"))
+        for kind, subdir in (("offerings", "Offerings"), ("fixes", "Fixes")):
+            for artifact_id, versions in sorted(listed[kind].items()):
+                for version in versions:
+                    jar = os.path.join(directory, subdir, "{0}_{1}.jar".format(artifact_id, version))
+                    if jar not in contents:
+                        contents[jar] = jar_artifacts(source.read(jar))
+                    files.append(jar)
+                    files.extend(os.path.join(directory, relpath) for relpath in contents[jar])
+    return sorted(set(files))
+
+
+def _index_repository(source, dirs):
+    """
+    Builds the index of offering and fix versions from the repository.xml of
+    every (sub) repository, or from the artifact names if it has none
+    """
+    index = dict(offerings={}, fixes={})
+    for directory in dirs:
+        listed = _listed_versions(source, directory)
+        if listed is not None:
+            for kind in ("offerings", "fixes"):
+                for artifact_id, versions in listed[kind].items():
+                    known = index[kind].setdefault(artifact_id, [])
+                    known.extend(version for version in versions if version not in known)
+            continue
+        for kind, subdir in (("offerings", "Offerings"), ("fixes", "Fixes")):
+            try:
+                names = source.listdir(os.path.join(directory, subdir))[0]
+            except (IOError, OSError, RepositoryError):
+                continue
+            for name in names:
+                match = ARTIFACT_RE.match(os.path.basename(name))
+                if match:
+                    versions = index[kind].setdefault(match.group("id"), [])
+                    if match.group("version") not in versions:
+                        versions.append(match.group("version"))
+    for kind in ("offerings", "fixes"):
+        for versions in index[kind].values():
+            versions.sort(key=parse_version)
+    return index
+
+
+def repository_index(module, repo, cache_dir=None):
+    """
+    Returns the index of the offerings and fixes available in a repository.
+    The index is cached in the cache directory. The index of a local
+    repository is rebuilt when repository.config or an Offerings or Fixes
+    directory changes, the index of an HTTP repository when the ETag or
+    Last-Modified of a repository.config changes, or after
+    REPOSITORY_INDEX_TTL seconds if the server sends neither.
+
+    :param module: Ansible module, used for HTTP requests
+    :param repo: URL or path of the repository
+    :param cache_dir: Directory for the index cache, defaults to the temp directory
+    :return: Dictionary with the offering and fix ids mapped to sorted lists of versions
+    """
+    source = repository_source(module, repo)
+    if cache_dir is None:
+        cache_dir = tempfile.gettempdir()
+    cache_file = mirror_path(cache_dir, repo) + ".index.json"
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if cache.get("version") != REPOSITORY_INDEX_VERSION:
+            cache = None
+    except (IOError, OSError, ValueError):
+        cache = None
+
+    def repository_dirs():
+        try:
+            return _repository_dirs(source)
+        except (IOError, OSError, RepositoryError) as e:
+            raise RepositoryError("{0} is not an Installation Manager repository: {1}".format(repo, e))
+
+    def index_stamps(dirs):
+        stamps = {}
+        for directory in dirs:
+            for relpath in source.STAMPED:
+                stamps[os.path.join(directory, relpath)] = source.stamp(os.path.join(directory, relpath))
+        return stamps
+
+    if isinstance(source, HttpSource) and cache is not None:
+        # Reading the repository.config of every (sub) repository again would
+        # cost as much as the HEAD requests validating the cache
+        dirs = cache["dirs"]
+    else:
+        dirs = repository_dirs()
+    stamps = index_stamps(dirs)
+    if cache is not None and cache["dirs"] == dirs and cache["stamps"] == stamps and \
+            ("" not in stamps.values() or time.time() - cache["created"] < REPOSITORY_INDEX_TTL):
+        return cache["index"]
+    if isinstance(source, HttpSource) and cache is not None:
+        dirs = repository_dirs()
+        stamps = index_stamps(dirs)
+
+    index = _index_repository(source, dirs)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Concurrent runs share the cache directory, each writes its own file
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(cache_file), dir=cache_dir)
+    except (IOError, OSError):
+        return index
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(dict(version=REPOSITORY_INDEX_VERSION, dirs=dirs, stamps=stamps, created=time.time(),
+                           index=index), f)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, cache_file)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return index
+
+
+def available_versions(index, offering_id, version=None):
+    """
+    Returns the versions of an offering available in a repository
+
+    :param index: Repository index
+    :param offering_id: Offering id
+    :param version: Version or leading part of a version to filter on
+    :return: Sorted list of matching versions
+    """
+    versions = index["offerings"].get(offering_id, [])
+    if version is not None:
+        versions = [available for available in versions if version_matches(available, version)]
+    return versions
+
+
+def latest_version(index, offering_id, version=None):
+    """
+    Returns the version Installation Manager would install from a repository
+
+    :param index: Repository index
+    :param offering_id: Offering id
+    :param version: Version or leading part of a version to filter on
+    :return: Latest matching version or None if the repository does not have it
+    """
+    versions = available_versions(index, offering_id, version)
+    if versions:
+        return versions[-1]
+    return None
+
+
+def resolve_offerings(index, offerings):
+    """
+    Resolves the versions Installation Manager would install for a list of
+    offerings
+
+    :param index: Repository index
+    :param offerings: List of (id, version, features) tuples
+    :return: Tuple of a dictionary of offering id to version and a list of
+             the offerings the repository does not provide
+    """
+    resolved = {}
+    unavailable = []
+    for offering_id, version, features in offerings:
+        latest = latest_version(index, offering_id, version)
+        if latest is None:
+            unavailable.append(dict(
+                offering=offering_id,
+                version=version,
+                available=available_versions(index, offering_id)
+            ))
+        else:
+            resolved[offering_id] = latest
+    return resolved, unavailable
+
+
+def imcl_repository_index(ibmim, repo):
+    """
+    Builds the offering index of a repository with imcl listAvailablePackages,
+    for repositories which can not be indexed directly
+
+    :param ibmim: IBM Installation Manager installation directory
+    :param repo: URL or path of the repository
+    :return: Repository index
+    """
+    result = run_command("{0}/eclipse/tools/imcl listAvailablePackages -repositories {1}".format(
+        ibmim,
+        repo
+    ), tail_lines=None)
+    if result.rc != 0:
+        raise RepositoryError("listing {0} failed: {1}".format(repo, result.stderr or result.stdout))
+    index = dict(offerings={}, fixes={})
+    for line in result.stdout.splitlines():
+        offering_id, version = split_offering(line.strip())[:2]
+        if version:
+            index["offerings"].setdefault(offering_id, []).append(version)
+    for versions in index["offerings"].values():
+        versions.sort(key=parse_version)
+    return index
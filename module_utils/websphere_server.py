@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the modules that start and stop application servers.
+
+startServer.sh returns as soon as the server process is up, long before the
+applications are started. The server writes WSVR0001I "open for e-business"
+to its SystemOut.log when it is ready, so the log is followed from the
+offset it had before the start until that message or a startup error shows
+up. On Linux the log directory is watched with inotify, other platforms poll
+the log.
+
+Whether a server runs is found out without a script: a started server
+writes its process id to logs/<server>/<server>.pid, and /proc/<pid>/cmdline
+tells whether that process still is the server or the pid file is stale.
+A server that hangs while it stops is killed through the same pid, after
+an optional javacore.
+"""
+import os
+import re
+import time
+import glob
+import errno
+import signal
+import select
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+
+READY_RE = re.compile(r"\bWSVR000[12]I\b")
+FAILURE_RE = re.compile(r"\bWSVR0009E\b")
+DEFAULT_READY_TIMEOUT = 600
+# Seconds stopServer.sh gets beyond its own -timeout before it is killed
+STOP_TIMEOUT_MARGIN = 30
+POLL_INTERVAL = 0.5
+JAVACORE_WAIT = 10
+READ_SIZE = 64 * 1024
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def system_out_log(profile_path, server):
+    """
+    Returns the path of the SystemOut.log of a server
+
+    :param profile_path: Profile directory
+    :param server: Name of the server
+    :return: Path of the log
+    """
+    return os.path.join(profile_path, "logs", server, "SystemOut.log")
+
+
+def server_pid_file(profile_path, server):
+    """
+    Returns the path of the pid file of a server
+
+    :param profile_path: Profile directory
+    :param server: Name of the server
+    :return: Path of the pid file
+    """
+    return os.path.join(profile_path, "logs", server, "{0}.pid".format(server))
+
+
+def server_status(profile_path, server):
+    """
+    Finds out whether a server is running. The process in the pid file has
+    to be the server, its command line ends with the config directory of
+    the profile, the cell, the node and the server name.
+
+    :param profile_path: Profile directory
+    :param server: Name of the server
+    :return: Tuple of started, stopped or None if there is no /proc to tell, and the pid
+    """
+    if not os.path.isdir("/proc/self"):
+        return None, None
+    try:
+        with open(server_pid_file(profile_path, server)) as f:
+            pid = int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return "stopped", None
+    try:
+        with open("/proc/{0}/cmdline".format(pid), "rb") as f:
+            args = [arg.decode("utf-8", "replace") for arg in f.read().split(b"\0") if arg]
+    except (IOError, OSError):
+        return "stopped", None
+    config_dir = os.path.realpath(os.path.join(profile_path, "config"))
+    if server in args and config_dir in [os.path.realpath(arg) for arg in args if arg.startswith("/")]:
+        return "started", pid
+    # The pid was reused by another process
+    return "stopped", None
+
+
+def log_position(path):
+    """
+    Returns the position to follow a log from
+
+    :param path: Path of the log
+    :return: Tuple of the inode and the size of the log, (None, 0) if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, 0
+    return stat.st_ino, stat.st_size
+
+
+class _Inotify(object):
+    """
+    Watches a directory for files being written, created or moved into it
+    """
+
+    def __init__(self, directory):
+        if ctypes is None or not hasattr(os, "uname") or os.uname()[0] != "Linux":
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, directory.encode("utf-8"), IN_MODIFY | IN_CREATE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "inotify_add_watch failed for {0}".format(directory))
+
+    def wait(self, timeout):
+        """
+        Waits until a file in the directory changes
+
+        :param timeout: Seconds to wait at most
+        :return: None
+        """
+        if select.select([self.fd], [], [], max(0, timeout))[0]:
+            # The events only say that something changed, the log is read anyway
+            try:
+                while os.read(self.fd, READ_SIZE):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller(object):
+    """
+    Stand-in for _Inotify that just sleeps
+    """
+
+    def wait(self, timeout):
+        time.sleep(max(0, min(timeout, POLL_INTERVAL)))
+
+    def close(self):
+        pass
+
+
+def wait_for_log(path, position, timeout, ready_re=READY_RE, failure_re=FAILURE_RE):
+    """
+    Follows a log from a position until a line matches the ready or the
+    failure pattern. A log that was rotated, it has another inode or got
+    shorter, is read from its start.
+
+    :param path: Path of the log
+    :param position: Tuple of inode and offset as returned by log_position
+    :param timeout: Seconds to wait at most
+    :param ready_re: Pattern of the line that tells the server is ready
+    :param failure_re: Pattern of a line that tells the server failed to start
+    :return: Dictionary with the state ready, failed or timeout, the matching
+             line and whether inotify was used
+    """
+    deadline = time.time() + timeout
+    inode, offset = position
+    partial = b""
+    try:
+        watcher = _Inotify(os.path.dirname(path))
+    except OSError:
+        # No inotify or the log directory does not exist yet
+        watcher = _Poller()
+    try:
+        while True:
+            current_inode, size = log_position(path)
+            if current_inode is not None:
+                if current_inode != inode or size < offset:
+                    inode, offset, partial = current_inode, 0, b""
+                if size > offset:
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        data = f.read(size - offset)
+                    offset += len(data)
+                    lines = (partial + data).split(b"\n")
+                    partial = lines.pop()
+                    for line in lines:
+                        line = line.decode("utf-8", "replace").rstrip()
+                        if failure_re.search(line):
+                            return dict(state="failed", line=line, inotify=isinstance(watcher, _Inotify))
+                        if ready_re.search(line):
+                            return dict(state="ready", line=line, inotify=isinstance(watcher, _Inotify))
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return dict(state="timeout", line=None, inotify=isinstance(watcher, _Inotify))
+            # Wake up now and then in case an event was missed or the
+            # directory was created after the start
+            watcher.wait(min(remaining, 5))
+            if isinstance(watcher, _Poller) and os.path.isdir(os.path.dirname(path)):
+                try:
+                    watcher = _Inotify(os.path.dirname(path))
+                except OSError:
+                    pass
+    finally:
+        watcher.close()
+
+
+def wait_for_stop(profile_path, server, timeout):
+    """
+    Waits until a server no longer runs
+
+    :param profile_path: Profile directory
+    :param server: Name of the server
+    :param timeout: Seconds to wait at most
+    :return: True if the server stopped
+    """
+    deadline = time.time() + timeout
+    while server_status(profile_path, server)[0] == "started":
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def take_javacore(profile_path, pid, timeout=JAVACORE_WAIT):
+    """
+    Makes the IBM JVM of a server write a javacore with SIGQUIT, which does
+    not stop the server, and waits for the file in the profile directory
+
+    :param profile_path: Profile directory, the working directory of the server
+    :param pid: Process id of the server
+    :param timeout: Seconds to wait for the javacore
+    :return: Path of the javacore or None if none showed up
+    """
+    pattern = os.path.join(profile_path, "javacore.*.{0}.*.txt".format(pid))
+    before = set(glob.glob(pattern))
+    os.kill(pid, signal.SIGQUIT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        written = sorted(set(glob.glob(pattern)) - before)
+        if written:
+            return written[-1]
+        time.sleep(0.2)
+    return None
+
+
+def kill_server(profile_path, server, pid, grace, javacore=False):
+    """
+    Kills a server that did not stop, with SIGTERM first and SIGKILL if it
+    still runs after the grace period
+
+    :param profile_path: Profile directory
+    :param server: Name of the server
+    :param pid: Process id of the server
+    :param grace: Seconds to wait for the server to exit after each signal
+    :param javacore: Take a javacore before the server is killed
+    :return: List of the steps taken, dictionaries with step, elapsed and
+             stopped or file for the javacore
+    """
+    steps = []
+    try:
+        if javacore:
+            started = time.time()
+            steps.append(dict(step="javacore", file=take_javacore(profile_path, pid),
+                              elapsed=round(time.time() - started, 3)))
+        for signum, name in ((signal.SIGTERM, "SIGTERM"), (signal.SIGKILL, "SIGKILL")):
+            started = time.time()
+            os.kill(pid, signum)
+            stopped = wait_for_stop(profile_path, server, grace)
+            steps.append(dict(step=name, stopped=stopped, elapsed=round(time.time() - started, 3)))
+            if stopped:
+                break
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+        # The server exited on its own in the meantime
+    return steps
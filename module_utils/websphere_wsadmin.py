@@ -0,0 +1,1315 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent wsadmin worker shared by the WebSphere modules.
+
+Every wsadmin.sh run boots a JVM, connects to the deployment manager and
+goes through the security handshake, which takes 20-60 seconds. A worker is
+a wsadmin process that stays connected and runs the Jython code it receives
+on a socket bound to 127.0.0.1, until it has been idle for a while.
+
+A worker is identified by a state file per host, port and user name. The
+file is only readable by its owner and holds the port and a random token
+the worker checks on every request. A request is the token on the first
+line followed by the Jython code, the response is the return code on the
+first line followed by the output of the code.
+
+Deferred config changes live in the unsaved workspace of a worker. The
+worker does not exit on idle while its workspace has changes, and the
+pending-sync marker records which worker holds them, so a flush notices
+when that worker is gone and the changes with it.
+
+wsadmin is started with a -profile that defines ansible_result(value).
+Scripts call it to return data to the module, it prints the value as a JSON
+record on a line of its own, which the module collects while it reads the
+output instead of searching the output afterwards.
+"""
+import os
+import re
+import ast
+import json
+import time
+import hashlib
+import fcntl
+import errno
+import signal
+import socket
+import sys
+import subprocess
+from collections import deque
+
+DEFAULT_WORKER_DIR = "~/.ansible/wsadmin"
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_START_TIMEOUT = 300
+CONNECT_TIMEOUT = 5
+WORKER_SCRIPT_FILE = "wsadmin_worker.py"
+RESULT_PROFILE_FILE = "ansible_result.py"
+DEFAULT_SHARECLASSES_DIR = "~/.ansible/wsadmin/javasharedresources"
+# Lines of output OutputTail keeps in front of and between marker lines
+OUTPUT_TAIL_LINES = 100
+if sys.version_info[0] >= 3:
+    NEW_SESSION = dict(start_new_session=True)
+else:
+    # preexec_fn is not safe with threads, but Python 2 has nothing else
+    NEW_SESSION = dict(preexec_fn=os.setsid)
+
+# Runs inside wsadmin, so everything below has to stay compatible with Jython 2.1
+JYTHON_HELPERS = r"""
+import sys
+import time
+import traceback
+
+ADMIN_OBJECTS = ["AdminApp", "AdminConfig", "AdminControl", "AdminTask", "Help"]
+PROFILE_FUNCTIONS = ["ansible_result"]
+
+
+def exit_code(code):
+    if code is None:
+        return 0
+    try:
+        return int(code)
+    except:
+        return 1
+
+
+def admin_namespace():
+    namespace = {"__name__": "__main__"}
+    for name in ADMIN_OBJECTS + PROFILE_FUNCTIONS:
+        if globals().has_key(name):
+            namespace[name] = globals()[name]
+    return namespace
+"""
+
+# Loaded with wsadmin -profile. Jython 2.1 has no json module, so values are
+# encoded by hand, anything that is not a number, a list or a dictionary is
+# returned as its string
+RESULT_PROFILE = r"""
+import sys
+import types
+
+ANSIBLE_RESULT_MARKER = "@@ansible-result@@ "
+ANSIBLE_JSON_ESCAPES = {'"': '\\"', "\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def ansible_json_string(text):
+    chars = []
+    for c in text:
+        if ANSIBLE_JSON_ESCAPES.has_key(c):
+            chars.append(ANSIBLE_JSON_ESCAPES[c])
+        elif c < " " or c > "~":
+            code = ord(c)
+            if code > 0xFFFF:
+                code = code - 0x10000
+                chars.append("\\u%04x\\u%04x" % (0xD800 + (code >> 10), 0xDC00 + (code & 0x3FF)))
+            else:
+                chars.append("\\u%04x" % code)
+        else:
+            chars.append(c)
+    return '"' + "".join(chars) + '"'
+
+
+def ansible_json(value):
+    value_type = type(value)
+    if value is None:
+        return "null"
+    if value_type is getattr(types, "BooleanType", None):
+        if value:
+            return "true"
+        return "false"
+    if value_type in (types.IntType, types.LongType):
+        return str(value)
+    if value_type is types.FloatType:
+        return repr(value)
+    if value_type in (types.ListType, types.TupleType):
+        return "[" + ",".join(map(ansible_json, value)) + "]"
+    if value_type is types.DictType:
+        items = []
+        for key, item in value.items():
+            items.append(ansible_json_string(str(key)) + ":" + ansible_json(item))
+        return "{" + ",".join(items) + "}"
+    return ansible_json_string(str(value))
+
+
+def ansible_result(value):
+    sys.stdout.write(ANSIBLE_RESULT_MARKER + ansible_json(value) + "\n")
+"""
+
+WORKER_SCRIPT = JYTHON_HELPERS + r"""
+import StringIO
+from java.io import File, FileOutputStream, OutputStreamWriter, InputStreamReader, BufferedReader
+from java.net import ServerSocket, InetAddress, SocketTimeoutException
+from java.security import SecureRandom
+from java.lang import Long
+
+
+def new_token():
+    random = SecureRandom()
+    token = ""
+    for i in range(4):
+        token = token + Long.toHexString(random.nextLong())
+    return token
+
+
+def write_state(path, port, token):
+    writer = OutputStreamWriter(FileOutputStream(path), "UTF-8")
+    writer.write("%d %s\n" % (port, token))
+    writer.close()
+
+
+def read_request(connection):
+    reader = BufferedReader(InputStreamReader(connection.getInputStream(), "UTF-8"))
+    token = reader.readLine()
+    lines = []
+    line = reader.readLine()
+    while line is not None:
+        lines.append(line)
+        line = reader.readLine()
+    return token, "\n".join(lines) + "\n"
+
+
+def execute(code):
+    namespace = admin_namespace()
+    output = StringIO.StringIO()
+    saved_stdout = sys.stdout
+    saved_argv = sys.argv
+    sys.stdout = output
+    rc = 0
+    try:
+        try:
+            exec code in namespace
+        except SystemExit, e:
+            rc = exit_code(e.code)
+        except:
+            rc = 1
+            traceback.print_exc(None, output)
+    finally:
+        sys.stdout = saved_stdout
+        sys.argv = saved_argv
+    return rc, output.getvalue()
+
+
+def respond(connection, rc, output):
+    writer = OutputStreamWriter(connection.getOutputStream(), "UTF-8")
+    writer.write("%d\n" % rc)
+    writer.write(output)
+    writer.flush()
+    connection.close()
+
+
+def serve(state_file, idle_timeout):
+    server = ServerSocket(0, 50, InetAddress.getByName("127.0.0.1"))
+    server.setSoTimeout(idle_timeout * 1000)
+    token = new_token()
+    write_state(state_file, server.getLocalPort(), token)
+    running = 1
+    while running:
+        try:
+            connection = server.accept()
+        except SocketTimeoutException:
+            # Deferred changes only exist in the workspace, keep them for the flush
+            if str(AdminConfig.hasChanges()) in ("1", "true"):
+                continue
+            break
+        try:
+            connection.setSoTimeout(60000)
+            request_token, code = read_request(connection)
+            if request_token != token:
+                connection.close()
+            elif code.strip() == "#shutdown":
+                running = 0
+                respond(connection, 0, "")
+            else:
+                rc, output = execute(code)
+                respond(connection, rc, output)
+        except:
+            try:
+                connection.close()
+            except:
+                pass
+    server.close()
+    File(state_file).delete()
+
+
+serve(sys.argv[0], int(sys.argv[1]))
+"""
+
+# Expects STEPS, a list of (kind, script or command, arguments) tuples, and
+# STOP_ON_FAILURE to be defined in front of it
+STEPS_DRIVER = JYTHON_HELPERS + r"""
+
+def run_step(kind, value, args):
+    namespace = admin_namespace()
+    saved_argv = sys.argv
+    sys.argv = args
+    rc = 0
+    try:
+        try:
+            if kind == "script":
+                execfile(value, namespace)
+            else:
+                exec value in namespace
+        except SystemExit, e:
+            rc = exit_code(e.code)
+        except:
+            rc = 1
+            traceback.print_exc(None, sys.stdout)
+    finally:
+        sys.argv = saved_argv
+    return rc
+
+
+index = 0
+for kind, value, args in STEPS:
+    print "@@ansible-step-begin@@ %d" % index
+    started = time.time()
+    rc = run_step(kind, value, args)
+    sys.stdout.write("\n@@ansible-step-end@@ %s\n" % repr({"rc": rc, "elapsed": round(time.time() - started, 3)}))
+    index = index + 1
+    if rc != 0 and STOP_ON_FAILURE:
+        break
+"""
+# Expects DESIRED, a list of config object entries, CHECK_MODE, SAVE and SYNC
+# to be defined in front of it
+CONFIG_DRIVER = JYTHON_HELPERS + r"""
+
+def first_line(text):
+    lines = text.splitlines()
+    if lines:
+        return lines[0].strip()
+    return ""
+
+
+def show_attributes(object_id):
+    # AdminConfig.show prints one [name value] pair per line
+    attributes = {}
+    for line in AdminConfig.show(object_id).splitlines():
+        line = line.strip()
+        if len(line) < 2 or line[0] != "[" or line[-1] != "]":
+            continue
+        line = line[1:-1]
+        space = line.find(" ")
+        if space < 0:
+            attributes[line] = ""
+        else:
+            value = line[space + 1:]
+            if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+                value = value[1:-1]
+            attributes[line[:space]] = value
+    return attributes
+
+
+def resolve(entry):
+    scope = first_line(AdminConfig.getid(entry["containment"]))
+    if not scope:
+        raise ValueError("no configuration object %s" % entry["containment"])
+    if not entry["type"]:
+        return scope
+    matches = []
+    for candidate in AdminConfig.list(entry["type"], scope).splitlines():
+        candidate = candidate.strip()
+        if candidate and (not entry["name"] or AdminConfig.showAttribute(candidate, "name") == entry["name"]):
+            matches.append(candidate)
+    if len(matches) != 1:
+        raise ValueError("%d objects of type %s match %s" % (len(matches), entry["type"], entry["label"]))
+    return matches[0]
+
+
+def custom_properties(object_id, attribute):
+    properties = {}
+    value = AdminConfig.showAttribute(object_id, attribute).strip()
+    if value[:1] == "[" and value[-1:] == "]":
+        value = value[1:-1]
+    for property_id in value.split():
+        current = show_attributes(property_id)
+        properties[current.get("name")] = (property_id, current.get("value", ""))
+    return properties
+
+
+def plan(entry, changes):
+    object_id = resolve(entry)
+    current = show_attributes(object_id)
+    modify = []
+    for name, value in entry["attributes"]:
+        if current.get(name) != value:
+            modify.append([name, value])
+            changes.append({"object": entry["label"], "attribute": name, "old": current.get(name), "new": value})
+    modify_properties = []
+    create_properties = []
+    if entry["properties"]:
+        existing = custom_properties(object_id, entry["properties_attribute"])
+        for name, value in entry["properties"]:
+            attribute = "%s.%s" % (entry["properties_attribute"], name)
+            if not existing.has_key(name):
+                create_properties.append([["name", name], ["value", value]])
+                changes.append({"object": entry["label"], "attribute": attribute, "old": None, "new": value})
+            elif existing[name][1] != value:
+                modify_properties.append((existing[name][0], value))
+                changes.append({"object": entry["label"], "attribute": attribute, "old": existing[name][1], "new": value})
+    return object_id, entry["properties_attribute"], modify, modify_properties, create_properties
+
+
+def apply_plans(plans):
+    for object_id, properties_attribute, modify, modify_properties, create_properties in plans:
+        if modify:
+            AdminConfig.modify(object_id, modify)
+        for property_id, value in modify_properties:
+            AdminConfig.modify(property_id, [["value", value]])
+        for attributes in create_properties:
+            AdminConfig.create("Property", object_id, attributes, properties_attribute)
+
+
+result = {"changes": [], "errors": [], "saved": 0, "synced": 0}
+plans = []
+for entry in DESIRED:
+    try:
+        plans.append(plan(entry, result["changes"]))
+    except:
+        result["errors"].append("%s: %s" % (entry["label"], sys.exc_info()[1]))
+if result["changes"] and not result["errors"] and not CHECK_MODE:
+    # Deferred changes of earlier tasks may be waiting in the workspace
+    had_changes = str(AdminConfig.hasChanges()) in ("1", "true")
+    try:
+        apply_plans(plans)
+        if SAVE:
+            AdminConfig.save()
+            result["saved"] = 1
+    except:
+        # Leave nothing half applied in the workspace of a worker
+        if not had_changes:
+            AdminConfig.reset()
+        result["errors"].append("apply: %s" % sys.exc_info()[1])
+    if result["saved"] and SYNC:
+        dmgr = AdminControl.completeObjectName("type=DeploymentManager,*")
+        if dmgr:
+            AdminControl.invoke(dmgr, "syncActiveNodes", "true")
+            result["synced"] = 1
+print "@@ansible-config@@ " + repr(result)
+"""
+CONFIG_MARKER = "@@ansible-config@@ "
+
+# Expects SYNC to be defined in front of it
+FLUSH_DRIVER = JYTHON_HELPERS + r"""
+
+def node_of(object_name):
+    for key in object_name.split(":")[-1].split(","):
+        if key[:5] == "node=":
+            return key[5:]
+    return object_name
+
+
+result = {"saved": 0, "synced": [], "in_sync": [], "errors": []}
+try:
+    if str(AdminConfig.hasChanges()) in ("1", "true"):
+        AdminConfig.save()
+        result["saved"] = 1
+except:
+    result["errors"].append("save: %s" % sys.exc_info()[1])
+if SYNC and not result["errors"]:
+    # NodeSync compares the repository epochs of the node and the cell
+    for node_sync in AdminControl.queryNames("type=NodeSync,*").splitlines():
+        node_sync = node_sync.strip()
+        if not node_sync:
+            continue
+        node = node_of(node_sync)
+        try:
+            if str(AdminControl.invoke(node_sync, "isNodeSynchronized")) == "true":
+                result["in_sync"].append(node)
+            else:
+                AdminControl.invoke(node_sync, "sync")
+                result["synced"].append(node)
+        except:
+            result["errors"].append("%s: %s" % (node, sys.exc_info()[1]))
+print "@@ansible-flush@@ " + repr(result)
+"""
+
+# Expects RESTART, a dictionary with the cluster, the batch size and the
+# failure threshold as (number, is_percent) pairs, the timeouts and the
+# check_applications and dry_run flags, to be defined in front of it. The
+# members of a batch are stopped and launched in Java threads.
+CLUSTER_RESTART_DRIVER = JYTHON_HELPERS + r"""
+from java.lang import Runnable, Thread
+
+
+class Invoker(Runnable):
+    def __init__(self, object_name, operation, argument):
+        self.object_name = object_name
+        self.operation = operation
+        self.argument = argument
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            if self.argument is None:
+                self.result = str(AdminControl.invoke(self.object_name, self.operation))
+            else:
+                self.result = str(AdminControl.invoke(self.object_name, self.operation, self.argument))
+        except:
+            self.error = str(sys.exc_info()[1])
+
+
+def invoke_all(calls):
+    invokers = []
+    threads = []
+    for object_name, operation, argument in calls:
+        invoker = Invoker(object_name, operation, argument)
+        thread = Thread(invoker)
+        thread.start()
+        invokers.append(invoker)
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return invokers
+
+
+def count_of(amount, total):
+    value, percent = amount
+    if percent:
+        value = (total * value + 99) / 100
+    return value
+
+
+def cluster_members(cluster):
+    cluster_id = AdminConfig.getid("/ServerCluster:%s/" % cluster)
+    if not cluster_id:
+        return None
+    members = []
+    for member in AdminConfig.list("ClusterMember", cluster_id).splitlines():
+        member = member.strip()
+        if member:
+            members.append({"node": AdminConfig.showAttribute(member, "nodeName"),
+                            "server": AdminConfig.showAttribute(member, "memberName"),
+                            "status": "skipped", "error": None})
+    return members
+
+
+def server_mbean(member):
+    return AdminControl.completeObjectName("type=Server,node=%s,process=%s,*" % (member["node"], member["server"]))
+
+
+def not_ready(member):
+    mbean = server_mbean(member)
+    if not mbean:
+        return ["server"]
+    if str(AdminControl.getAttribute(mbean, "state")) != "STARTED":
+        return ["server"]
+    stopped = []
+    for application in member["applications"]:
+        if not AdminControl.completeObjectName("type=Application,name=%s,node=%s,process=%s,*" % (
+                application, member["node"], member["server"])):
+            stopped.append(application)
+    return stopped
+
+
+def elapsed(started):
+    return round(time.time() - started, 3)
+
+
+def restart_batch(batch):
+    started = time.time()
+    calls = []
+    stopping = []
+    for member in batch:
+        member["status"] = "failed"
+        mbean = server_mbean(member)
+        if mbean:
+            calls.append((mbean, "stop", None))
+            stopping.append(member)
+    invokers = invoke_all(calls)
+    for index in range(len(stopping)):
+        if invokers[index].error:
+            stopping[index]["error"] = "stop: " + invokers[index].error
+    deadline = started + RESTART["stop_timeout"]
+    running = batch[:]
+    while running:
+        for member in running[:]:
+            if not server_mbean(member):
+                member["stop_seconds"] = elapsed(started)
+                running.remove(member)
+        if running and time.time() >= deadline:
+            break
+        if running:
+            time.sleep(1)
+    for member in running:
+        member["error"] = "did not stop within %d seconds" % RESTART["stop_timeout"]
+
+    started = time.time()
+    calls = []
+    launching = []
+    for member in batch:
+        if member in running:
+            continue
+        agent = AdminControl.completeObjectName("type=NodeAgent,node=%s,*" % member["node"])
+        if not agent:
+            member["error"] = "the node agent of %s is not running" % member["node"]
+            continue
+        calls.append((agent, "launchProcess", member["server"]))
+        launching.append(member)
+    invokers = invoke_all(calls)
+    waiting = []
+    for index in range(len(launching)):
+        member = launching[index]
+        member["start_seconds"] = elapsed(started)
+        if invokers[index].error:
+            member["error"] = "launchProcess: " + invokers[index].error
+        elif invokers[index].result != "true":
+            member["error"] = "launchProcess returned " + str(invokers[index].result)
+        else:
+            waiting.append(member)
+
+    deadline = started + RESTART["ready_timeout"]
+    while waiting:
+        for member in waiting[:]:
+            pending = not_ready(member)
+            if not pending:
+                member["ready_seconds"] = elapsed(started)
+                member["status"] = "ok"
+                member["error"] = None
+                waiting.remove(member)
+            else:
+                member["not_ready"] = pending
+        if waiting and time.time() >= deadline:
+            break
+        if waiting:
+            time.sleep(1)
+    for member in waiting:
+        member["error"] = "not ready within %d seconds: %s" % (RESTART["ready_timeout"], ", ".join(member["not_ready"]))
+
+
+summary = {"cluster": RESTART["cluster"], "batches": 0, "aborted": 0, "error": None}
+members = cluster_members(RESTART["cluster"])
+if members is None:
+    summary["error"] = "cluster %s does not exist" % RESTART["cluster"]
+    members = []
+cell = AdminControl.getCell()
+for member in members:
+    member["applications"] = []
+    if RESTART["check_applications"]:
+        target = "WebSphere:cell=%s,node=%s,server=%s" % (cell, member["node"], member["server"])
+        for application in AdminApp.list(target).splitlines():
+            if application.strip():
+                member["applications"].append(application.strip())
+size = max(1, count_of(RESTART["batch_size"], len(members)))
+threshold = count_of(RESTART["failure_threshold"], len(members))
+failures = 0
+index = 0
+while index < len(members):
+    batch = members[index:index + size]
+    summary["batches"] = summary["batches"] + 1
+    for member in batch:
+        member["batch"] = summary["batches"]
+    if RESTART["dry_run"]:
+        for member in batch:
+            member["status"] = "planned"
+    elif not summary["aborted"]:
+        started = time.time()
+        restart_batch(batch)
+        for member in batch:
+            member["elapsed"] = elapsed(started)
+            if member["status"] != "ok":
+                failures = failures + 1
+        if failures > threshold:
+            summary["aborted"] = 1
+    for member in batch:
+        if member.has_key("not_ready"):
+            del member["not_ready"]
+        print "@@ansible-restart@@ " + repr(member)
+    index = index + size
+summary["failures"] = failures
+print "@@ansible-restart-done@@ " + repr(summary)
+"""
+# Prefix of every marker line the generated code prints
+MARKER_PREFIX = "@@ansible-"
+RESTART_MARKER = "@@ansible-restart@@ "
+RESTART_DONE_MARKER = "@@ansible-restart-done@@ "
+FLUSH_MARKER = "@@ansible-flush@@ "
+RESULT_MARKER = "@@ansible-result@@ "
+STEP_MARKER_RE = re.compile(r"^@@ansible-step-(begin|end)@@ (.*)$", re.M)
+
+
+class WorkerUnavailable(Exception):
+    """
+    Raised when there is no worker to send the code to, nothing has been run
+    """
+
+
+class WorkerError(Exception):
+    """
+    Raised when a worker fails to start or to answer a request
+    """
+
+
+class WorkerTimeout(WorkerError):
+    """
+    Raised when a worker does not answer a request in time, it may still be running the code
+    """
+
+
+def java_argument_spec():
+    """
+    Returns the module options for tuning the wsadmin client JVM, shared by
+    the modules that run wsadmin
+
+    :return: Dictionary of option name to argument spec
+    """
+    return dict(
+        java_shareclasses=dict(required=False),
+        java_shareclasses_dir=dict(required=False, default=DEFAULT_SHARECLASSES_DIR),
+        java_quickstart=dict(required=False, default=False, type="bool"),
+        java_initial_heap=dict(required=False),
+        java_max_heap=dict(required=False),
+        jython_cache_dir=dict(required=False)
+    )
+
+
+def java_options(params):
+    """
+    Returns the -javaoption arguments of wsadmin.sh for the options from
+    java_argument_spec, creating the cache directories so the next wsadmin
+    finds a warm cache
+
+    :param params: Module parameters
+    :return: wsadmin.sh arguments, empty if no option is set
+    """
+    options = []
+    if params.get("java_shareclasses"):
+        # A J9 class cache keeps the loaded and compiled classes of wsadmin between runs
+        cache_dir = os.path.expanduser(params.get("java_shareclasses_dir") or DEFAULT_SHARECLASSES_DIR)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        options.append("-Xshareclasses:name={0},cacheDir={1}".format(params["java_shareclasses"], cache_dir))
+    if params.get("java_quickstart"):
+        options.append("-Xquickstart")
+    if params.get("java_initial_heap"):
+        options.append("-Xms{0}".format(params["java_initial_heap"]))
+    if params.get("java_max_heap"):
+        options.append("-Xmx{0}".format(params["java_max_heap"]))
+    if params.get("jython_cache_dir"):
+        # Jython caches the package index of the WebSphere jars here
+        cache_dir = os.path.expanduser(params["jython_cache_dir"])
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        options.append("-Dpython.cachedir={0}".format(cache_dir))
+    return " ".join(["-javaoption {0}".format(option) for option in options])
+
+
+def worker_state_file(worker_dir, host, port, username):
+    """
+    Returns the state file of the worker for a deployment manager and user
+
+    :param worker_dir: Directory of the worker state files
+    :param host: Deployment manager host name
+    :param port: Deployment manager SOAP port
+    :param username: WAS user name
+    :return: Path of the state file
+    """
+    return os.path.join(
+        os.path.expanduser(worker_dir),
+        "{0}_{1}_{2}.worker".format(host, port, username)
+    )
+
+
+def read_worker_state(state_file):
+    """
+    Reads the port and token of a running worker
+
+    :param state_file: State file of the worker
+    :return: Tuple of port and token or None if no worker is running
+    """
+    try:
+        with open(state_file) as f:
+            fields = f.read().split()
+    except (IOError, OSError):
+        return None
+    if len(fields) != 2 or not fields[0].isdigit():
+        # The worker has not finished starting yet
+        return None
+    return int(fields[0]), fields[1]
+
+
+def script_code(script, args):
+    """
+    Returns Jython code that runs a script file the way wsadmin -f does
+
+    :param script: Path of the script
+    :param args: List of script arguments
+    :return: Jython code
+    """
+    return "import sys\nsys.argv = {0!r}\nexecfile({1!r})\n".format(
+        [str(arg) for arg in args],
+        os.path.abspath(script)
+    )
+
+
+def steps_code(steps, stop_on_failure=True):
+    """
+    Returns Jython code that runs several scripts and commands one after the
+    other, printing markers around the output of every step
+
+    :param steps: List of (kind, script or command, arguments) tuples, kind is script or command
+    :param stop_on_failure: Skip the remaining steps after a failed step
+    :return: Jython code
+    """
+    return "STEPS = {0!r}\nSTOP_ON_FAILURE = {1}\n{2}".format(
+        [(kind, os.path.abspath(value) if kind == "script" else value, [str(arg) for arg in args])
+         for kind, value, args in steps],
+        int(bool(stop_on_failure)),
+        STEPS_DRIVER
+    )
+
+
+def parse_steps(output):
+    """
+    Splits the output of the code from steps_code into the results of the steps
+
+    :param output: Output of wsadmin or a worker
+    :return: List of dictionaries with rc, elapsed and stdout of the steps that ran
+    """
+    results = []
+    begin = None
+    for match in STEP_MARKER_RE.finditer(output):
+        if match.group(1) == "begin":
+            begin = match.end() + 1
+        elif begin is not None:
+            result = ast.literal_eval(match.group(2))
+            # Drop the newline printed in front of the end marker
+            result["stdout"] = output[begin:max(begin, match.start() - 1)]
+            results.append(result)
+            begin = None
+    return results
+
+
+def config_value(value):
+    """
+    Formats a desired attribute value the way AdminConfig.show prints it
+
+    :param value: Value from the playbook
+    :return: String value
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def config_entry(entry):
+    """
+    Normalizes a desired config object given as a dictionary with
+    containment (an AdminConfig.getid path), optional type and name to
+    select a child object of that type, attributes and custom properties
+
+    :param entry: Config object as given to the module
+    :return: Dictionary for the config driver
+    """
+    if not isinstance(entry, dict) or not entry.get("containment"):
+        raise ValueError("every config entry needs a containment path: {0}".format(entry))
+    label = entry["containment"]
+    if entry.get("type"):
+        label = "{0}{1}={2}".format(label, entry["type"], entry.get("name") or "*")
+    return dict(
+        label=label,
+        containment=str(entry["containment"]),
+        type=str(entry.get("type") or ""),
+        name=str(entry.get("name") or ""),
+        attributes=sorted([[str(k), config_value(v)] for k, v in (entry.get("attributes") or {}).items()]),
+        properties=sorted([[str(k), config_value(v)] for k, v in (entry.get("properties") or {}).items()]),
+        properties_attribute=str(entry.get("properties_attribute") or "properties")
+    )
+
+
+def config_code(entries, check_mode=False, sync=True, save=True):
+    """
+    Returns Jython code that reads the config objects, applies the attributes
+    that differ, saves once and synchronizes the nodes once
+
+    :param entries: List of config entries from config_entry
+    :param check_mode: Only compute the changes
+    :param sync: Synchronize the nodes after saving
+    :param save: Save the changes, otherwise they stay in the workspace
+    :return: Jython code
+    """
+    return "DESIRED = {0!r}\nCHECK_MODE = {1}\nSAVE = {2}\nSYNC = {3}\n{4}".format(
+        entries,
+        int(bool(check_mode)),
+        int(bool(save)),
+        int(bool(save and sync)),
+        CONFIG_DRIVER
+    )
+
+
+def flush_code(sync=True):
+    """
+    Returns Jython code that saves the workspace if it has changes and
+    synchronizes the nodes that are not in sync with the cell
+
+    :param sync: Synchronize the nodes
+    :return: Jython code
+    """
+    return "SYNC = {0}\n{1}".format(int(bool(sync)), FLUSH_DRIVER)
+
+
+def parse_amount(value):
+    """
+    Parses a number of cluster members given either as a count or as a
+    percentage of the members, for example 2 or 25%
+
+    :param value: Amount from the playbook
+    :return: Tuple of the number and whether it is a percentage
+    """
+    text = str(value).strip()
+    percent = text.endswith("%")
+    if percent:
+        text = text[:-1].strip()
+    if not text.isdigit() or (percent and int(text) > 100):
+        raise ValueError("{0} is neither a count nor a percentage".format(value))
+    return int(text), percent
+
+
+def cluster_restart_code(cluster, batch_size, failure_threshold, stop_timeout, ready_timeout,
+                         check_applications=True, dry_run=False):
+    """
+    Returns Jython code that restarts the members of a cluster batch by
+    batch, waiting for a batch to be ready before the next one is stopped
+
+    :param cluster: Name of the cluster
+    :param batch_size: Members restarted at the same time, from parse_amount
+    :param failure_threshold: Failed members tolerated before the restart stops, from parse_amount
+    :param stop_timeout: Seconds to wait for the members of a batch to stop
+    :param ready_timeout: Seconds to wait for the members of a batch to be ready after the launch
+    :param check_applications: Wait for the applications of the members to be started as well
+    :param dry_run: Only plan the batches
+    :return: Jython code
+    """
+    return "RESTART = {0!r}\n{1}".format(dict(
+        cluster=str(cluster),
+        # Jython 2.1 has no True and False
+        batch_size=(batch_size[0], int(bool(batch_size[1]))),
+        failure_threshold=(failure_threshold[0], int(bool(failure_threshold[1]))),
+        stop_timeout=int(stop_timeout),
+        ready_timeout=int(ready_timeout),
+        check_applications=int(bool(check_applications)),
+        dry_run=int(bool(dry_run))
+    ), CLUSTER_RESTART_DRIVER)
+
+
+def parse_records(output, marker):
+    """
+    Finds all the records printed with a marker, for example by the code
+    from cluster_restart_code
+
+    :param output: Output of wsadmin
+    :param marker: RESTART_MARKER
+    :return: List of dictionaries
+    """
+    return [ast.literal_eval(line[len(marker):]) for line in output.splitlines() if line.startswith(marker)]
+
+
+def parse_result(output, marker):
+    """
+    Finds the result printed by the code from config_code or flush_code
+
+    :param output: Output of wsadmin or a worker
+    :param marker: CONFIG_MARKER or FLUSH_MARKER
+    :return: Dictionary of the result or None if there is no result
+    """
+    for line in output.splitlines():
+        if line.startswith(marker):
+            return ast.literal_eval(line[len(marker):])
+    return None
+
+
+class ResultCollector(object):
+    """
+    Collects the records scripts print with ansible_result from the output
+    of wsadmin, one line at a time
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def feed(self, line):
+        """
+        Takes the record out of a line of output
+
+        :param line: Line of output without the line break
+        :return: The rest of the line or None if the line only held a record
+        """
+        index = line.find(RESULT_MARKER)
+        if index < 0:
+            return line
+        try:
+            self.records.append(json.loads(line[index + len(RESULT_MARKER):]))
+        except ValueError:
+            return line
+        return line[:index] or None
+
+    def filter(self, output):
+        """
+        Takes the records out of the complete output of a worker request or a step
+
+        :param output: Output
+        :return: Output without the records
+        """
+        lines = [self.feed(line) for line in output.split("\n")]
+        return "\n".join([line for line in lines if line is not None])
+
+
+class OutputTail(object):
+    """
+    Keeps the marker lines of the output of wsadmin and the last lines of
+    the output in front of and between them, so that a chatty script does
+    not pile up its whole output in memory
+    """
+
+    def __init__(self, tail_lines=OUTPUT_TAIL_LINES, collector=None):
+        self.tail_lines = tail_lines
+        self.collector = collector
+        self.markers = []
+        self.segments = [deque(maxlen=tail_lines)]
+
+    def feed(self, line):
+        """
+        Takes a line of output, as line_filter of run_command
+
+        :param line: Line of output without the line break
+        :return: None, the lines are kept here instead
+        """
+        if self.collector is not None:
+            line = self.collector.feed(line)
+            if line is None:
+                return None
+        if line.startswith(MARKER_PREFIX):
+            self.markers.append(line)
+            self.segments.append(deque(maxlen=self.tail_lines))
+        else:
+            self.segments[-1].append(line)
+        return None
+
+    def output(self):
+        """
+        :return: The kept lines in the order wsadmin printed them
+        """
+        lines = list(self.segments[0])
+        for marker, segment in zip(self.markers, self.segments[1:]):
+            lines.append(marker)
+            lines.extend(segment)
+        return "\n".join(lines)
+
+
+def write_private_file(path, content):
+    """
+    Replaces a file that only its owner can read, unless it has the content already
+
+    :param path: Path of the file
+    :param content: Content
+    :return: Path of the file
+    """
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return path
+    except (IOError, OSError):
+        pass
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), 0o700)
+    fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.rename(path + ".tmp", path)
+    return path
+
+
+def result_profile(worker_dir=DEFAULT_WORKER_DIR):
+    """
+    Writes the wsadmin profile that defines ansible_result
+
+    :param worker_dir: Directory of the worker state files
+    :return: Path of the profile, to pass to wsadmin -profile
+    """
+    return write_private_file(os.path.join(os.path.expanduser(worker_dir), RESULT_PROFILE_FILE), RESULT_PROFILE)
+
+
+def pending_sync_file(state_file):
+    """
+    Returns the pending-sync marker that belongs to a worker state file. It
+    lists the deferred changes a flush still has to save or synchronize.
+
+    :param state_file: State file of the worker
+    :return: Path of the marker
+    """
+    return re.sub(r"\.worker$", "", state_file) + ".pending"
+
+
+def worker_identity(state_file):
+    """
+    Returns an identity of the running worker that does not reveal its token.
+    A killed worker leaves its state file behind, so the worker has to
+    accept a connection as well.
+
+    :param state_file: State file of the worker
+    :return: Hex digest of the token or None if no worker is running
+    """
+    state = read_worker_state(state_file)
+    if state is None:
+        return None
+    try:
+        # The worker drops a connection without its token
+        socket.create_connection(("127.0.0.1", state[0]), CONNECT_TIMEOUT).close()
+    except socket.error:
+        return None
+    return hashlib.sha256(state[1].encode("utf-8")).hexdigest()[:16]
+
+
+def mark_pending(marker, reason, worker=None):
+    """
+    Records a deferred change in the pending-sync marker
+
+    :param marker: Path of the marker
+    :param reason: Description of the change
+    :param worker: Identity of the worker holding the unsaved change, None if it was saved
+    :return: None
+    """
+    if not os.path.isdir(os.path.dirname(marker)):
+        os.makedirs(os.path.dirname(marker), 0o700)
+    fd = os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    with os.fdopen(fd, "a") as f:
+        f.write(json.dumps(dict(time=time.time(), reason=reason, worker=worker)) + "\n")
+
+
+def lost_pending(changes, worker):
+    """
+    Finds the deferred changes that were held by a worker that is gone
+
+    :param changes: Deferred changes from read_pending
+    :param worker: Identity of the running worker or None
+    :return: List of the lost changes
+    """
+    return [change for change in changes if change.get("worker") and change["worker"] != worker]
+
+
+def clear_pending(marker, keep=None):
+    """
+    Rewrites the pending-sync marker with the changes that are still pending,
+    removing it if there are none
+
+    :param marker: Path of the marker
+    :param keep: List of the changes to keep
+    :return: None
+    """
+    if keep:
+        fd = os.open(marker + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            for change in keep:
+                f.write(json.dumps(change) + "\n")
+        os.rename(marker + ".tmp", marker)
+    elif os.path.exists(marker):
+        os.remove(marker)
+
+
+def read_pending(marker):
+    """
+    :param marker: Path of the pending-sync marker
+    :return: List of the deferred changes
+    """
+    try:
+        with open(marker) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def worker_execute(state_file, code, timeout=None):
+    """
+    Runs Jython code in a worker
+
+    :param state_file: State file of the worker
+    :param code: Jython code
+    :param timeout: Seconds to wait for the result or None to wait forever
+    :return: Tuple of return code and output of the code
+    """
+    state = read_worker_state(state_file)
+    if state is None:
+        raise WorkerUnavailable("no worker is running for {0}".format(state_file))
+    port, token = state
+    try:
+        connection = socket.create_connection(("127.0.0.1", port), CONNECT_TIMEOUT)
+    except socket.error as e:
+        if e.errno == errno.ECONNREFUSED:
+            # The worker went away without removing its state file
+            try:
+                os.remove(state_file)
+            except OSError:
+                pass
+        raise WorkerUnavailable("worker on port {0} is not reachable: {1}".format(port, e))
+    try:
+        connection.settimeout(timeout)
+        connection.sendall(u"{0}\n{1}".format(token, code).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except socket.timeout:
+        raise WorkerTimeout("worker on port {0} did not answer within {1} seconds".format(port, timeout))
+    except socket.error as e:
+        raise WorkerError("worker on port {0} failed: {1}".format(port, e))
+    finally:
+        connection.close()
+    rc, sep, output = b"".join(chunks).decode("utf-8", "replace").partition("\n")
+    if not sep or not rc.lstrip("-").isdigit():
+        raise WorkerError("worker on port {0} closed the connection without a result".format(port))
+    return int(rc), output
+
+
+def stop_worker(state_file):
+    """
+    Asks a worker to exit
+
+    :param state_file: State file of the worker
+    :return: True if a worker was stopped
+    """
+    try:
+        worker_execute(state_file, "#shutdown\n", CONNECT_TIMEOUT)
+    except (WorkerUnavailable, WorkerError):
+        return False
+    return True
+
+
+def _group_exited(pgid, timeout):
+    """
+    :param pgid: Process group id
+    :param timeout: Seconds to wait
+    :return: True if every process of the group exited within the timeout
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            # Reaps the worker if this process started it
+            os.waitpid(pgid, os.WNOHANG)
+        except OSError:
+            pass
+        try:
+            os.killpg(pgid, 0)
+        except OSError:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def kill_worker(state_file, grace=CONNECT_TIMEOUT):
+    """
+    Kills the process group of a worker that does not answer, with SIGTERM
+    and then SIGKILL, and removes its state file
+
+    :param state_file: State file of the worker
+    :param grace: Seconds to wait after each signal
+    :return: List of the names of the signals sent
+    """
+    sent = []
+    try:
+        with open(state_file + ".pid") as f:
+            pid = int(f.read())
+    except (IOError, OSError, ValueError):
+        return sent
+    # Without a state file the worker is gone and the pid may be reused
+    if read_worker_state(state_file) is not None:
+        for signum, name in ((signal.SIGTERM, "SIGTERM"), (signal.SIGKILL, "SIGKILL")):
+            try:
+                os.killpg(pid, signum)
+            except OSError:
+                break
+            sent.append(name)
+            if _group_exited(pid, grace):
+                break
+    for path in (state_file, state_file + ".pid"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return sent
+
+
+def start_worker(wasdir, host, port, username, password, state_file,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_START_TIMEOUT, java_args=""):
+    """
+    Starts a worker unless one is running already, and waits until it accepts
+    requests. The worker runs in its own session so it outlives the module.
+
+    :param wasdir: Path to installation location of WAS
+    :param host: Deployment manager host name
+    :param port: Deployment manager SOAP port
+    :param username: WAS user name
+    :param password: WAS user password
+    :param state_file: State file of the worker
+    :param idle_timeout: Seconds without requests after which the worker exits
+    :param timeout: Seconds to wait for the worker to start
+    :param java_args: -javaoption arguments from java_options
+    :return: None
+    """
+    worker_dir = os.path.dirname(state_file)
+    if not os.path.isdir(worker_dir):
+        os.makedirs(worker_dir, 0o700)
+    lock = open(state_file + ".lock", "w")
+    try:
+        # Concurrent modules on the same host start a single worker
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if read_worker_state(state_file) is not None:
+            try:
+                worker_execute(state_file, "pass\n", CONNECT_TIMEOUT)
+                return
+            except (WorkerUnavailable, WorkerError):
+                pass
+        script = write_private_file(os.path.join(worker_dir, WORKER_SCRIPT_FILE), WORKER_SCRIPT)
+        profile = result_profile(worker_dir)
+        # The worker writes its port and token into the existing file, which
+        # keeps it private to the owner
+        os.close(os.open(state_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        os.chmod(state_file, 0o600)
+        log = open(state_file + ".log", "w")
+        devnull = open(os.devnull)
+        try:
+            child = subprocess.Popen(
+                ["{0}/bin/wsadmin.sh -lang jython "
+                 "-conntype SOAP "
+                 "-host {1} "
+                 "-port {2} "
+                 "-username {3} "
+                 "-password {4} "
+                 "{5} "
+                 "-profile {6} "
+                 "-f {7} "
+                 "{8} {9}".format(
+                    wasdir,
+                    host,
+                    port,
+                    username,
+                    password,
+                    java_args,
+                    profile,
+                    script,
+                    state_file,
+                    idle_timeout
+                 )],
+                shell=True,
+                stdin=devnull,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                close_fds=True,
+                **NEW_SESSION
+            )
+        finally:
+            devnull.close()
+            log.close()
+        with open(state_file + ".pid", "w") as f:
+            f.write(str(child.pid))
+        deadline = time.time() + timeout
+        while read_worker_state(state_file) is None:
+            if child.poll() is not None:
+                raise WorkerError("wsadmin worker exited with {0}, see {1}.log".format(child.returncode, state_file))
+            if time.time() > deadline:
+                os.killpg(child.pid, signal.SIGTERM)
+                raise WorkerError("wsadmin worker did not start within {0} seconds".format(timeout))
+            time.sleep(0.5)
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
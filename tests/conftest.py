@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Makes the helpers in module_utils importable the way the modules import
+them, as ansible.module_utils.websphere_*
+"""
+import os
+
+import ansible.module_utils
+
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils")
+
+if MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.insert(0, MODULE_UTILS)
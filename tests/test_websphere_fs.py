@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import errno
+import json
+import os
+
+from ansible.module_utils import websphere_fs
+from ansible.module_utils.websphere_fs import ArtifactStore, remove_installation, remove_tree
+from ansible.module_utils.websphere_repo import file_digest
+
+import pytest
+
+
+def shared_tree(tmpdir, name, files):
+    tree = tmpdir.mkdir(name)
+    for relpath, content in files.items():
+        tree.join(relpath).write(content, ensure=True)
+    return str(tree)
+
+
+def installation(tmpdir):
+    dest = tmpdir.mkdir("was")
+    for relpath in ("bin/startServer.sh", "lib/a.jar", "lib/ext/b.jar", "profiles/AppSrv01/logs/server1/SystemOut.log"):
+        dest.join(relpath).write("x", ensure=True)
+    # A link out of the tree is removed, not followed
+    dest.join("lib", "outside").mksymlinkto(tmpdir.mkdir("outside"))
+    tmpdir.join("outside", "keep.txt").write("keep")
+    return str(dest)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_remove_tree(tmpdir, workers):
+    dest = installation(tmpdir)
+    assert remove_tree(dest, workers) == 5
+    assert not os.path.exists(dest)
+    assert tmpdir.join("outside", "keep.txt").check()
+
+
+def test_remove_tree_keep_root(tmpdir):
+    dest = installation(tmpdir)
+    remove_tree(dest, keep_root=True)
+    assert os.listdir(dest) == []
+
+
+def test_remove_tree_workers(tmpdir):
+    with pytest.raises(ValueError):
+        remove_tree(installation(tmpdir), 0)
+
+
+def test_remove_installation(tmpdir):
+    dest = installation(tmpdir)
+    removed, path = remove_installation(dest)
+    assert removed == 5
+    assert os.path.basename(path).startswith(".was.tombstone-")
+    assert not os.path.exists(dest) and not os.path.exists(path)
+
+
+def test_remove_installation_in_place(tmpdir, monkeypatch):
+    def busy(path):
+        raise OSError(errno.EBUSY, "Device or resource busy")
+
+    monkeypatch.setattr(websphere_fs, "tombstone", busy)
+    dest = installation(tmpdir)
+    assert remove_installation(dest) == (5, dest)
+    assert not os.path.exists(dest)
+
+
+def test_artifact_store_refuses_reflink_without_support(tmpdir, monkeypatch):
+    def no_reflink(source, target):
+        raise IOError(errno.EOPNOTSUPP, "Operation not supported")
+
+    monkeypatch.setattr(websphere_fs, "_reflink", no_reflink)
+    with pytest.raises(OSError) as e:
+        ArtifactStore(str(tmpdir.join("store")))
+    assert e.value.errno == errno.EOPNOTSUPP
+    assert "artifact_store_mode=hardlink" in str(e.value)
+
+
+def test_artifact_store_hardlink(tmpdir):
+    first = shared_tree(tmpdir, "first", {"native/a.zip": "a", "native/b.zip": "b"})
+    second = shared_tree(tmpdir, "second", {"native/a.zip": "a"})
+    with ArtifactStore(str(tmpdir.join("store")), "hardlink") as store:
+        stats = store.add_tree(first, manifests=["com.ibm.was_8.5.5009.20160225_0435"])
+        assert (stats["mode"], stats["stored"], stats["linked"]) == ("hardlink", 2, 0)
+        stats = store.add_tree(second)
+        assert (stats["linked"], stats["saved_bytes"]) == (1, 1)
+        assert os.path.samefile(os.path.join(first, "native/a.zip"), os.path.join(second, "native/a.zip"))
+        # Size and mtime are unchanged, the files are not hashed again
+        assert store.add_tree(first)["unchanged"] == 2
+
+
+def test_artifact_store_index(tmpdir):
+    tree = shared_tree(tmpdir, "im_shared", {"native/a.zip": "a"})
+    with ArtifactStore(str(tmpdir.join("store")), "copy") as store:
+        store.add_tree(tree, manifests=["com.ibm.was_8.5.5009.20160225_0435"])
+    with open(str(tmpdir.join("store", "index.json"))) as f:
+        index = json.load(f)
+    digest = file_digest(os.path.join(tree, "native/a.zip"))
+    assert index["manifests"] == {"com.ibm.was_8.5.5009.20160225_0435": [["native/a.zip", digest]]}
+    with ArtifactStore(str(tmpdir.join("store")), "copy") as store:
+        assert store.index == index
+
+
+def test_artifact_store_manifest(tmpdir):
+    with ArtifactStore(str(tmpdir.join("store")), "copy") as store:
+        for offering in ("com.ibm.was_8.5.5008.20151112_0939", "com.ibm.was_8.5.5009.20160225_0435",
+                         "com.ibm.was_9.0.0.20160526_1854"):
+            store.index["manifests"][offering] = []
+        assert store.manifest("com.ibm.was") == "com.ibm.was_9.0.0.20160526_1854"
+        assert store.manifest("com.ibm.was", "8.5.5") == "com.ibm.was_8.5.5009.20160225_0435"
+        assert store.manifest("com.ibm.was", "8.5.5008") == "com.ibm.was_8.5.5008.20151112_0939"
+        assert store.manifest("com.ibm.was", "8.0") is None
+        assert store.manifest("com.ibm.xs") is None
+
+
+def test_artifact_store_seed_tree(tmpdir):
+    tree = shared_tree(tmpdir, "im_shared", {"native/a.zip": "a", "native/b.zip": "b"})
+    target = str(tmpdir.mkdir("target"))
+    with ArtifactStore(str(tmpdir.join("store")), "copy") as store:
+        store.add_tree(tree, manifests=["com.ibm.was_8.5.5009.20160225_0435"], added={"native/a.zip"})
+        stats = store.seed_tree(target, ["com.ibm.was_8.5.5009.20160225_0435"])
+        assert (stats["mode"], stats["seeded"]) == ("copy", 1)
+        assert sorted(os.listdir(os.path.join(target, "native"))) == ["a.zip"]
+        assert not os.path.samefile(os.path.join(tree, "native/a.zip"), os.path.join(target, "native/a.zip"))
+        # Files the directory already has are left alone
+        assert store.seed_tree(target, ["com.ibm.was_8.5.5009.20160225_0435"])["seeded"] == 0
+
+
+def test_artifact_store_hardlink_rewritten_object(tmpdir):
+    tree = shared_tree(tmpdir, "im_shared", {"native/a.zip": "a"})
+    target = str(tmpdir.mkdir("target"))
+    with ArtifactStore(str(tmpdir.join("store")), "hardlink") as store:
+        store.add_tree(tree, manifests=["com.ibm.was_8.5.5009.20160225_0435"])
+        # Rewritten in place through the link, the stored object no longer matches its digest
+        with open(os.path.join(tree, "native/a.zip"), "w") as f:
+            f.write("changed")
+        stats = store.seed_tree(target, ["com.ibm.was_8.5.5009.20160225_0435"])
+        assert (stats["seeded"], stats["invalid"]) == (0, 1)
+        assert not os.path.exists(os.path.join(target, "native/a.zip"))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from ansible.module_utils import websphere_im
+from ansible.module_utils.websphere_im import find_installed, imcl_installed_packages, imcl_offering, offering_specs, \
+    parse_offering_spec, parse_version, split_offering, version_matches
+from ansible.module_utils.websphere_process import CommandTimeout
+from ansible.module_utils.websphere_repo import latest_version, resolve_offerings
+
+import pytest
+
+
+ND = "com.ibm.websphere.ND.v85"
+INDEX = dict(offerings={ND: ["8.5.5008.20151112_0939", "8.5.5009.20160225_0435", "9.0.0000.20160526_1854"]},
+             fixes={})
+
+
+def test_parse_version_orders_numerically():
+    assert parse_version("8.5.5009.20160225_0435") > parse_version("8.5.5008.20151112_0939")
+    assert parse_version("8.5.10.0") > parse_version("8.5.9.0")
+
+
+def test_version_matches_exact_version():
+    assert version_matches("8.5.5009.20160225_0435", "8.5.5009.20160225_0435")
+
+
+def test_version_matches_component_prefix():
+    assert version_matches("8.5.5009.20160225_0435", "8.5.5009")
+    assert version_matches("8.5.5009.20160225_0435", "8.5")
+
+
+def test_version_matches_leading_part_of_fix_pack_component():
+    assert version_matches("8.5.5009.20160225_0435", "8.5.5")
+    assert version_matches("8.5.5009.20160225_0435", "8.5.500")
+
+
+def test_version_matches_rejects_other_versions():
+    assert not version_matches("8.5.5009.20160225_0435", "8.5.6")
+    assert not version_matches("8.5.5009.20160225_0435", "8.0")
+    assert not version_matches("8.5.5009.20160225_0435", "8.5.5009.20160225_0435.1")
+    assert not version_matches("8.5.5009.20160225_0435", "8.5.5009.2015")
+
+
+def test_latest_version_with_leading_part():
+    assert latest_version(INDEX, ND, "8.5.5") == "8.5.5009.20160225_0435"
+    assert latest_version(INDEX, ND, "8.5.5008") == "8.5.5008.20151112_0939"
+    assert latest_version(INDEX, ND) == "9.0.0000.20160526_1854"
+    assert latest_version(INDEX, ND, "8.5.6") is None
+
+
+def test_resolve_offerings_reports_unavailable():
+    resolved, unavailable = resolve_offerings(INDEX, [(ND, "8.5.5", []), ("com.ibm.websphere.IHS.v85", None, [])])
+    assert resolved == {ND: "8.5.5009.20160225_0435"}
+    assert [offering["offering"] for offering in unavailable] == ["com.ibm.websphere.IHS.v85"]
+
+
+def test_find_installed_with_leading_part():
+    packages = [dict(id=ND, version="8.5.5009.20160225_0435", location="/opt/IBM/WebSphere")]
+    assert find_installed(packages, ND, "8.5.5", "/opt/IBM/WebSphere/") == packages
+    assert find_installed(packages, ND, "9.0") == []
+
+
+def test_split_offering_keeps_features():
+    assert split_offering("{0}_8.5.5009.20160225_0435,core.feature, ejbdeploy".format(ND)) == \
+        (ND, "8.5.5009.20160225_0435", ["core.feature", "ejbdeploy"])
+
+
+def test_offering_specs_keeps_a_string_whole():
+    assert offering_specs("{0},core.feature".format(ND)) == ["{0},core.feature".format(ND)]
+    assert offering_specs([ND, dict(id=ND)]) == [ND, dict(id=ND)]
+    assert offering_specs(None) == []
+
+
+def test_parse_offering_spec_dictionary():
+    assert parse_offering_spec(dict(id=ND, version=8.5, features="core.feature,ejbdeploy")) == \
+        (ND, "8.5", ["core.feature", "ejbdeploy"])
+    with pytest.raises(ValueError):
+        parse_offering_spec(dict(version="8.5"))
+
+
+def test_imcl_offering():
+    assert imcl_offering(ND, "8.5.5009.20160225_0435", ["core.feature"]) == \
+        "{0}_8.5.5009.20160225_0435,core.feature".format(ND)
+    assert imcl_offering(ND) == ND
+
+
+def fake_imcl(tmpdir, script):
+    tools = tmpdir.mkdir("eclipse").mkdir("tools")
+    imcl = tools.join("imcl")
+    imcl.write("#!/bin/sh\n" + script)
+    imcl.chmod(0o755)
+    return str(tmpdir)
+
+
+def test_imcl_installed_packages(tmpdir):
+    ibmim = fake_imcl(tmpdir, "echo 'Listing packages'\n"
+                              "echo '/opt/IBM/WebSphere : {0}_8.5.5009.20160225_0435 : WAS ND : 8.5.5.9'\n".format(ND))
+    assert imcl_installed_packages(ibmim) == [dict(id=ND, version="8.5.5009.20160225_0435", name="WAS ND",
+                                                   location="/opt/IBM/WebSphere")]
+
+
+def test_imcl_installed_packages_timeout(tmpdir, monkeypatch):
+    monkeypatch.setattr(websphere_im, "LIST_TIMEOUT", 1)
+    ibmim = fake_imcl(tmpdir, "sleep 30\n")
+    with pytest.raises(CommandTimeout):
+        imcl_installed_packages(ibmim)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from ansible.module_utils.websphere_process import SECRET_MASK, CommandTimeout, check_timeout, mask_secrets, \
+    run_command, run_parallel
+
+import pytest
+
+
+def test_run_command_output_and_rc():
+    result = run_command("echo out; echo err >&2; exit 3")
+    assert (result.rc, result.stdout, result.stderr) == (3, "out", "err")
+    assert not result.timed_out
+
+
+def test_run_command_keeps_a_bounded_tail():
+    result = run_command("seq 1 1000", tail_lines=5)
+    assert result.stdout.splitlines() == ["996", "997", "998", "999", "1000"]
+
+
+def test_run_command_line_filter():
+    result = run_command("seq 1 10", tail_lines=None, line_filter=lambda line: line if int(line) % 5 == 0 else None)
+    assert result.stdout == "5\n10"
+
+
+def test_run_command_runs_in_a_session_of_its_own():
+    result = run_command("ps -o sid= -p $$")
+    assert int(result.stdout.strip()) != os.getsid(0)
+
+
+def test_run_command_kills_the_process_group_on_timeout():
+    started = time.time()
+    # The background sleep keeps the pipes open unless the whole group is killed
+    result = run_command("sleep 30 & echo started; wait", timeout=1, kill_grace=1)
+    assert time.time() - started < 10
+    assert result.timed_out
+    assert result.signals == ["SIGTERM"]
+    assert result.stdout == "started"
+    assert "timed out after 1 seconds" in result.failure_msg("failed")
+    assert result.as_dict()["timed_out"]
+
+
+def test_run_command_sends_sigkill_when_sigterm_is_ignored():
+    result = run_command("trap '' TERM; echo started; while true; do sleep 0.1; done", timeout=1, kill_grace=1)
+    assert result.signals == ["SIGTERM", "SIGKILL"]
+
+
+def test_run_command_log_masks_secrets(tmpdir):
+    log = str(tmpdir.join("command.log"))
+    run_command("echo -password s3cret done", log=log, secrets=["s3cret"])
+    with open(log) as f:
+        content = f.read()
+    assert content.splitlines()[0] == "# echo -password {0} done".format(SECRET_MASK)
+    assert "-password s3cret done" in content
+    assert os.stat(log).st_mode & 0o777 == 0o600
+
+
+def test_mask_secrets_ignores_empty_secrets():
+    assert mask_secrets("a b", ["", None]) == "a b"
+
+
+def test_check_timeout_raises_without_a_module():
+    check_timeout(run_command("true"), "failed")
+    with pytest.raises(CommandTimeout) as error:
+        check_timeout(run_command("sleep 5", timeout=1, kill_grace=1), "listing failed")
+    assert error.value.result.timed_out
+    assert str(error.value).startswith("listing failed: timed out")
+
+
+def test_run_parallel_keeps_the_order():
+    assert run_parallel(lambda item: item * 2, [3, 1, 2], 2) == [6, 2, 4]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from ansible.module_utils import websphere_profile
+from ansible.module_utils.websphere_process import CommandTimeout
+from ansible.module_utils.websphere_profile import (
+    find_profile, manageprofiles_profiles, parse_profile_registry, registered_profiles
+)
+
+import pytest
+
+
+REGISTRY = """<?xml version="1.0" encoding="UTF-8"?><profiles>
+<profile isAReservationTicket="false" isDefault="true" name="Dmgr01" path="/opt/IBM/WebSphere/profiles/Dmgr01"
+ template="/opt/IBM/WebSphere/profileTemplates/management"/>
+<profile isAReservationTicket="false" isDefault="false" name="AppSrv01" path="/data/profiles/AppSrv01"
+ template="/opt/IBM/WebSphere/profileTemplates/default"/>
+<profile isAReservationTicket="true" isDefault="false" name="AppSrv02" path="/data/profiles/AppSrv02"
+ template="/opt/IBM/WebSphere/profileTemplates/default"/>
+</profiles>
+"""
+
+
+def fake_registry(tmpdir, content=REGISTRY):
+    tmpdir.join("properties", "profileRegistry.xml").write(content, ensure=True)
+    return str(tmpdir)
+
+
+def fake_manageprofiles(tmpdir, script):
+    manageprofiles = tmpdir.mkdir("bin").join("manageprofiles.sh")
+    manageprofiles.write("#!/bin/sh\n" + script)
+    manageprofiles.chmod(0o755)
+    return str(tmpdir)
+
+
+def test_manageprofiles_profiles(tmpdir):
+    wasdir = fake_manageprofiles(tmpdir, "echo 'Listing profiles'\necho '[Dmgr01, AppSrv01]'\n")
+    assert sorted(manageprofiles_profiles(wasdir)) == ["AppSrv01", "Dmgr01"]
+    assert manageprofiles_profiles(wasdir)["AppSrv01"] == dict(name="AppSrv01", path=None, template=None,
+                                                               is_default=None)
+
+
+def test_manageprofiles_profiles_timeout(tmpdir, monkeypatch):
+    monkeypatch.setattr(websphere_profile, "LIST_TIMEOUT", 1)
+    wasdir = fake_manageprofiles(tmpdir, "sleep 30\n")
+    with pytest.raises(CommandTimeout):
+        manageprofiles_profiles(wasdir)
+
+
+def test_parse_profile_registry(tmpdir):
+    fake_registry(tmpdir)
+    profiles = parse_profile_registry(str(tmpdir.join("properties", "profileRegistry.xml")))
+    # Reservation tickets are profiles that are still being created
+    assert sorted(profiles) == ["AppSrv01", "Dmgr01"]
+    assert profiles["AppSrv01"] == dict(name="AppSrv01", path="/data/profiles/AppSrv01",
+                                        template="/opt/IBM/WebSphere/profileTemplates/default", is_default=False)
+    assert profiles["Dmgr01"]["is_default"] is True
+
+
+def test_find_profile(tmpdir):
+    wasdir = fake_registry(tmpdir)
+    fake_manageprofiles(tmpdir, "exit 1\n")
+    assert find_profile(wasdir, "AppSrv01")["path"] == "/data/profiles/AppSrv01"
+    assert find_profile(wasdir, "AppSrv02") is None
+    assert find_profile(wasdir, "appsrv01") is None
+
+
+def test_registered_profiles_invalid_registry(tmpdir):
+    # A registry manageprofiles.sh is rewriting is listed with manageprofiles.sh
+    wasdir = fake_registry(tmpdir, "<profiles><profile name=")
+    fake_manageprofiles(tmpdir, "echo '[Dmgr01]'\n")
+    assert list(registered_profiles(wasdir)) == ["Dmgr01"]
+
+
+def test_registered_profiles_without_registry(tmpdir):
+    wasdir = fake_manageprofiles(tmpdir, "echo '[AppSrv01]'\n")
+    assert registered_profiles(wasdir)["AppSrv01"]["path"] is None
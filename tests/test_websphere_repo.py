@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import zipfile
+
+try:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from ansible.module_utils.websphere_repo import (
+    jar_artifacts, mirror_repository, parse_repository_xml, repository_index
+)
+
+import pytest
+
+WAS = "com.ibm.websphere.ND.v85"
+REPOSITORY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<repository xmlns="http://www.ibm.com/xmlns/prod/cic/repository">
+  <offering id="{0}" version="8.5.5009.20160225_0435"/>
+  <offering id="{0}" version="8.5.5008.20151112_0939"/>
+  <fix id="8.5.5.9-WS-WAS-IFPI12345" version="8.5.5009.20160301_1200"/>
+</repository>
+""".format(WAS)
+
+
+class FakeModule(object):
+    def __init__(self, tmpdir):
+        self.params = {}
+        self.tmpdir = tmpdir
+
+    def fail_json(self, **kwargs):
+        raise AssertionError(kwargs)
+
+
+class Handler(SimpleHTTPRequestHandler):
+    listings = False
+    requests = []
+
+    def list_directory(self, path):
+        if not self.listings:
+            self.send_error(403)
+            return None
+        return SimpleHTTPRequestHandler.list_directory(self, path)
+
+    def log_message(self, *args):
+        self.requests.append((self.command, self.path))
+
+
+def write_jar(path, artifacts):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with zipfile.ZipFile(path, "w") as jar:
+        jar.writestr("offering.xml", "".join('<artifact path="{0}"/>'.format(artifact) for artifact in artifacts))
+
+
+def fake_repository(path, repository_xml=True):
+    os.makedirs(os.path.join(path, "native"))
+    with open(os.path.join(path, "repository.config"), "w") as f:
+        f.write("LayoutPolicy=IMP\nLayoutPolicyVersion=0.0.0.1\n")
+    if repository_xml:
+        with open(os.path.join(path, "repository.xml"), "w") as f:
+            f.write(REPOSITORY_XML)
+    for version in ("8.5.5009.20160225_0435", "8.5.5008.20151112_0939"):
+        artifact = "native/was_{0}.zip".format(version)
+        write_jar(os.path.join(path, "Offerings", "{0}_{1}.jar".format(WAS, version)), [artifact])
+        with open(os.path.join(path, artifact), "w") as f:
+            f.write(version)
+    write_jar(os.path.join(path, "Fixes", "8.5.5.9-WS-WAS-IFPI12345_8.5.5009.20160301_1200.jar"), [])
+
+
+@pytest.fixture
+def server(tmpdir):
+    root = str(tmpdir.join("www"))
+    os.makedirs(root)
+    with open(os.path.join(root, "repository.config"), "w") as f:
+        f.write("LayoutPolicy=Composite\nLayoutPolicyVersion=0.0.0.1\nrepository.url.disk1=./disk1\n")
+    fake_repository(os.path.join(root, "disk1"))
+    cwd = os.getcwd()
+    os.chdir(root)
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    Handler.listings = False
+    del Handler.requests[:]
+    try:
+        yield root, "http://127.0.0.1:{0}/".format(httpd.server_address[1])
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        os.chdir(cwd)
+
+
+def test_parse_repository_xml():
+    assert parse_repository_xml(REPOSITORY_XML) == dict(
+        offerings={WAS: ["8.5.5009.20160225_0435", "8.5.5008.20151112_0939"]},
+        fixes={"8.5.5.9-WS-WAS-IFPI12345": ["8.5.5009.20160301_1200"]}
+    )
+
+
+def test_jar_artifacts(tmpdir):
+    jar = str(tmpdir.join("offering.jar"))
+    write_jar(jar, ["native/b.zip", "plugins/a.jar", "native/b.zip"])
+    with open(jar, "rb") as f:
+        assert jar_artifacts(f.read()) == ["native/b.zip", "plugins/a.jar"]
+
+
+def test_repository_index_without_listings(server, tmpdir):
+    repo = server[1]
+    index = repository_index(FakeModule(str(tmpdir)), repo, str(tmpdir.join("cache")))
+    assert index["offerings"] == {WAS: ["8.5.5008.20151112_0939", "8.5.5009.20160225_0435"]}
+    assert list(index["fixes"]) == ["8.5.5.9-WS-WAS-IFPI12345"]
+    # The cache file is written through a temporary file of its own
+    assert [name for name in os.listdir(str(tmpdir.join("cache"))) if not name.endswith(".index.json")] == []
+
+
+def test_repository_index_listing_fallback(tmpdir):
+    repo = str(tmpdir.join("repo"))
+    fake_repository(repo, repository_xml=False)
+    index = repository_index(None, repo, str(tmpdir.join("cache")))
+    assert index["offerings"] == {WAS: ["8.5.5008.20151112_0939", "8.5.5009.20160225_0435"]}
+
+
+def test_mirror_repository_without_listings(server, tmpdir):
+    root, repo = server
+    module = FakeModule(str(tmpdir))
+    target, stats = mirror_repository(module, repo, str(tmpdir.join("cache")))
+    assert stats["copied"] == 8
+    for relpath in ("repository.config", "disk1/repository.xml", "disk1/native/was_8.5.5009.20160225_0435.zip",
+                    "disk1/Fixes/8.5.5.9-WS-WAS-IFPI12345_8.5.5009.20160301_1200.jar"):
+        assert os.path.isfile(os.path.join(target, relpath))
+    del Handler.requests[:]
+    stats = mirror_repository(module, repo, str(tmpdir.join("cache")))[1]
+    assert (stats["copied"], stats["reused"]) == (0, 8)
+    # The jars of the offerings are not read again
+    assert [path for method, path in Handler.requests if path.endswith(".jar")] == []
+
+
+def test_mirror_repository_listing_fallback(server, tmpdir):
+    root, repo = server
+    os.remove(os.path.join(root, "disk1", "repository.xml"))
+    Handler.listings = True
+    target, stats = mirror_repository(FakeModule(str(tmpdir)), repo, str(tmpdir.join("cache")))
+    assert stats["copied"] == 7
+    assert os.path.isfile(os.path.join(target, "disk1/native/was_8.5.5008.20151112_0939.zip"))
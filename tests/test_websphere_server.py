@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+from ansible.module_utils.websphere_server import log_position, wait_for_log
+
+OPEN = "[10/18/16 10:00:00:000 CEST] 00000001 WsServerImpl A   WSVR0001I: Server server1 open for e-business\n"
+FAILED = "[10/18/16 10:00:00:000 CEST] 00000001 WsServerImpl E   WSVR0009E: Error occurred during startup\n"
+
+
+def write_later(path, *chunks):
+    """
+    Appends the chunks to a log one after the other from another thread
+    """
+    def write():
+        for chunk in chunks:
+            time.sleep(0.2)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "a") as f:
+                f.write(chunk)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+def test_wait_for_log_ready(tmpdir):
+    log = tmpdir.join("SystemOut.log")
+    log.write("starting\n")
+    thread = write_later(str(log), "Starting application: ivtApp\n", OPEN)
+    result = wait_for_log(str(log), log_position(str(log)), 10)
+    thread.join()
+    assert result["state"] == "ready"
+    assert result["line"] == OPEN.rstrip()
+    assert result["inotify"] is True
+
+
+def test_wait_for_log_failed(tmpdir):
+    log = tmpdir.join("SystemOut.log")
+    log.write("")
+    thread = write_later(str(log), FAILED, OPEN)
+    result = wait_for_log(str(log), log_position(str(log)), 10)
+    thread.join()
+    assert (result["state"], result["line"]) == ("failed", FAILED.rstrip())
+
+
+def test_wait_for_log_skips_old_lines(tmpdir):
+    # The message of the previous start is before the position
+    log = tmpdir.join("SystemOut.log")
+    log.write(OPEN)
+    started = time.time()
+    result = wait_for_log(str(log), log_position(str(log)), 0.5)
+    assert (result["state"], result["line"]) == ("timeout", None)
+    assert time.time() - started < 5
+
+
+def test_wait_for_log_partial_line(tmpdir):
+    log = tmpdir.join("SystemOut.log")
+    log.write("")
+    thread = write_later(str(log), OPEN[:60], OPEN[60:])
+    result = wait_for_log(str(log), log_position(str(log)), 10)
+    thread.join()
+    assert result["line"] == OPEN.rstrip()
+
+
+def test_wait_for_log_rotated(tmpdir):
+    log = tmpdir.join("SystemOut.log")
+    log.write("starting\n" * 100)
+    position = log_position(str(log))
+    # Rotated at startup, the new log is shorter than the old position
+    log.rename(tmpdir.join("SystemOut_16.10.18_10.00.00.log"))
+    log.write(OPEN)
+    assert wait_for_log(str(log), position, 10)["state"] == "ready"
+
+
+def test_wait_for_log_directory_created(tmpdir):
+    log = tmpdir.join("logs", "server1", "SystemOut.log")
+    assert log_position(str(log)) == (None, 0)
+    thread = write_later(str(log), OPEN)
+    result = wait_for_log(str(log), (None, 0), 10)
+    thread.join()
+    assert result["state"] == "ready"
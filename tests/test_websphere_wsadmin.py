@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from ansible.module_utils.websphere_wsadmin import CONFIG_MARKER, OutputTail, ResultCollector, parse_result, \
+    parse_steps
+
+
+def feed(tail, lines):
+    for line in lines:
+        assert tail.feed(line) is None
+    return tail.output()
+
+
+def test_output_tail_keeps_the_last_lines():
+    assert feed(OutputTail(3), ["line {0}".format(i) for i in range(10)]) == "line 7\nline 8\nline 9"
+
+
+def test_output_tail_keeps_every_marker_line():
+    lines = ["noise {0}".format(i) for i in range(500)] + [CONFIG_MARKER + "{'changes': [], 'errors': []}"] + \
+        ["noise"] * 500
+    output = feed(OutputTail(2), lines)
+    assert output.splitlines() == ["noise 498", "noise 499", lines[500], "noise", "noise"]
+    assert parse_result(output, CONFIG_MARKER) == dict(changes=[], errors=[])
+
+
+def test_output_tail_bounds_the_output_of_each_step():
+    lines = []
+    for index in range(2):
+        lines.append("@@ansible-step-begin@@ {0}".format(index))
+        lines.extend(["step {0} line {1}".format(index, i) for i in range(50)])
+        lines.extend(["", "@@ansible-step-end@@ {'rc': 0, 'elapsed': 0.1}"])
+    results = parse_steps(feed(OutputTail(3), lines))
+    assert [result["stdout"] for result in results] == ["step 0 line 48\nstep 0 line 49\n",
+                                                        "step 1 line 48\nstep 1 line 49\n"]
+
+
+def test_output_tail_without_limit_keeps_all_lines():
+    lines = ["line {0}".format(i) for i in range(1000)]
+    assert feed(OutputTail(None), lines) == "\n".join(lines)
+
+
+def test_output_tail_hands_records_to_the_collector():
+    collector = ResultCollector()
+    output = feed(OutputTail(10, collector), ["before", '@@ansible-result@@ {"created": 1}', "after"])
+    assert output == "before\nafter"
+    assert collector.records == [dict(created=1)]
+
+
+def test_result_collector_filter():
+    collector = ResultCollector()
+    assert collector.filter('a\n@@ansible-result@@ [1, 2]\nb') == "a\nb"
+    assert collector.records == [[1, 2]]